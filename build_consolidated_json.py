@@ -9,7 +9,11 @@ from tqdm import tqdm
 DATA_DIR = "./Data"
 OUTPUT_FILE = "./Data/consolidated_rag_data.json"
 
-model = OllamaLLM(model="qwen2.5")
+# Metadata generation (retrieval phrases / contextual summary) model.
+# Override with SPAA_METADATA_MODEL, same as the per-stage models in main_two_endpoints.py.
+METADATA_MODEL = os.environ.get("SPAA_METADATA_MODEL", "qwen2.5")
+
+model = OllamaLLM(model=METADATA_MODEL)
 
 
 def extract_urls(text):
@@ -0,0 +1,461 @@
+# conversation_store.py
+# Append-only SQLite log store for the chatbot server.
+#
+# Replaces the per-session CSV files in conversation/ (one file per session per
+# day plus a _retrieval.csv companion) with one WAL-mode database holding:
+# - turns:             User / Assistant / System rows
+# - router_decisions:  AnalysisRouter / RAGOnlyRouter decisions, one column per field
+#                      (sub_queries as a JSON list)
+# - retrievals:        ranked retrieval results
+# All tables are indexed on (session_id, date) and date.
+#
+# The server only enqueues rows; one background thread inserts them in batches.
+#
+# Rotation: the store is split into segments, conversation_log_YYYY-MM-DD.sqlite,
+# with a new segment each day or when a segment reaches LOG_MAX_SEGMENT_BYTES
+# (..._1.sqlite, ..._2.sqlite). Closed segments are gzip-compressed in the
+# background and compressed segments older than LOG_RETENTION_DAYS are deleted.
+#
+# Export the old CSV layout on demand (reads every segment, compressed or not):
+#   python conversation_store.py --out conversation_export
+#   python conversation_store.py --out conversation_export --date 2026-05-10 --session abc123
+
+import argparse
+import atexit
+import csv
+import glob
+import gzip
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+
+# ------------------------
+# SETTINGS
+# ------------------------
+LOG_DIR = "./conversation"
+LOG_SEGMENT_PREFIX = "conversation_log"
+LOG_MAX_SEGMENT_BYTES = 256 * 1024 * 1024   # roll over within a day past this size
+LOG_RETENTION_DAYS = 365                    # delete compressed segments older than this
+
+CONVERSATION_HEADER = ["timestamp", "session_id", "sender", "message", "search_query"]
+RETRIEVAL_HEADER = ["timestamp", "session_id", "question", "search_query", "rank", "source_url", "chunk_preview"]
+RAG_RETRIEVAL_HEADER = ["timestamp", "session_id", "endpoint", "question", "search_query", "rank", "source_url", "chunk_preview"]
+
+TURN_COLUMNS = ["timestamp", "date", "session_id", "sender", "message", "search_query"]
+ROUTER_COLUMNS = [
+    "timestamp", "date", "session_id", "sender", "language", "language_confidence",
+    "persona", "persona_confidence", "should_check_persona_again", "use_retrieval",
+    "acknowledgment", "search_query", "sub_queries", "reason", "message"
+]
+RETRIEVAL_COLUMNS = [
+    "timestamp", "date", "session_id", "endpoint", "question", "search_query",
+    "rank", "source_url", "chunk_preview"
+]
+
+TABLE_COLUMNS = {
+    "turns": TURN_COLUMNS,
+    "router_decisions": ROUTER_COLUMNS,
+    "retrievals": RETRIEVAL_COLUMNS,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    date TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    message TEXT,
+    search_query TEXT
+);
+CREATE TABLE IF NOT EXISTS router_decisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    date TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    language TEXT,
+    language_confidence REAL,
+    persona TEXT,
+    persona_confidence REAL,
+    should_check_persona_again INTEGER,
+    use_retrieval INTEGER,
+    acknowledgment TEXT,
+    search_query TEXT,
+    sub_queries TEXT,
+    reason TEXT,
+    message TEXT
+);
+CREATE TABLE IF NOT EXISTS retrievals (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    date TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    endpoint TEXT,
+    question TEXT,
+    search_query TEXT,
+    rank INTEGER,
+    source_url TEXT,
+    chunk_preview TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_turns_session_date ON turns (session_id, date);
+CREATE INDEX IF NOT EXISTS idx_turns_date ON turns (date);
+CREATE INDEX IF NOT EXISTS idx_router_session_date ON router_decisions (session_id, date);
+CREATE INDEX IF NOT EXISTS idx_router_date ON router_decisions (date);
+CREATE INDEX IF NOT EXISTS idx_retrievals_session_date ON retrievals (session_id, date);
+CREATE INDEX IF NOT EXISTS idx_retrievals_date ON retrievals (date);
+"""
+
+
+# ------------------------
+# HELPERS
+# ------------------------
+def log_timestamp():
+    """(ISO timestamp, YYYY-MM-DD) of the current time."""
+    # Evaluated per row: a long-running server must not stamp every day with its start date.
+    now = datetime.now()
+    return now.isoformat(), now.strftime("%Y-%m-%d")
+
+
+def log_date() -> str:
+    """Today's date for log rows and per-day log file names, evaluated per write."""
+    return log_timestamp()[1]
+
+
+def open_store(db_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL: no fsync per commit, still crash-safe for the database file.
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    # Segments created before a column was added get it here (as TEXT, NULL for old rows).
+    for table, columns in TABLE_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column in columns:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+    conn.commit()
+    return conn
+
+
+_SEGMENT_RE = re.compile(
+    rf"^{LOG_SEGMENT_PREFIX}_(\d{{4}}-\d{{2}}-\d{{2}})(?:_(\d+))?\.sqlite(\.gz)?$"
+)
+
+
+def segment_path(log_dir: str, day: str, part: int = 0) -> str:
+    suffix = f"_{part}" if part else ""
+    return os.path.join(log_dir, f"{LOG_SEGMENT_PREFIX}_{day}{suffix}.sqlite")
+
+
+def list_segments(log_dir: str = LOG_DIR):
+    """Returns [(day, part, path, compressed)] sorted oldest first."""
+    segments = []
+    for path in glob.glob(os.path.join(log_dir, f"{LOG_SEGMENT_PREFIX}_*.sqlite*")):
+        m = _SEGMENT_RE.match(os.path.basename(path))
+        if m:
+            segments.append((m.group(1), int(m.group(2) or 0), path, bool(m.group(3))))
+    segments.sort()
+    return segments
+
+
+def compress_segment(path: str) -> None:
+    with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(path)
+
+
+def apply_retention(log_dir: str = LOG_DIR, retention_days: int = LOG_RETENTION_DAYS) -> None:
+    cutoff = (datetime.now() - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+    for day, _, path, compressed in list_segments(log_dir):
+        if compressed and day < cutoff:
+            os.remove(path)
+
+
+class BackgroundLogWriter:
+    """
+    Keeps log writes off the request path. Callers put rows on an in-memory
+    queue; one writer thread owns the SQLite connection, drains the queue in
+    batches and commits once per batch. Pending rows are written on shutdown.
+    The writer also rotates segments (daily / by size) and hands closed
+    segments to a compression thread.
+    """
+
+    def __init__(
+            self,
+            log_dir: str = LOG_DIR,
+            max_segment_bytes: int = LOG_MAX_SEGMENT_BYTES,
+            retention_days: int = LOG_RETENTION_DAYS,
+            batch_size: int = 500,
+            idle_flush_seconds: float = 0.5
+        ):
+        self.log_dir = log_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.idle_flush_seconds = idle_flush_seconds
+        self._queue = queue.Queue()
+        self._compress_queue = queue.Queue()
+        self._stop = object()
+        self._conn = None
+        self._segment = None
+        self._segment_day = None
+        self._segment_part = 0
+        # Threads start last, once every attribute they use exists.
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._compress_thread = threading.Thread(target=self._run_compression, name="log-compress", daemon=True)
+        self._thread.start()
+        self._compress_thread.start()
+        atexit.register(self.close)
+
+    @property
+    def current_segment(self) -> str:
+        return self._segment
+
+    def write(self, table: str, rows) -> None:
+        """rows: list of dicts keyed by the table's column names."""
+        self._queue.put((table, rows))
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put(self._stop)
+            self._thread.join(timeout=10)
+
+    def _open_segment(self, day: str) -> None:
+        os.makedirs(self.log_dir, exist_ok=True)
+        # Continue today's newest segment after a restart, unless it was already compressed.
+        todays = [(part, compressed) for d, part, _, compressed in list_segments(self.log_dir) if d == day]
+        part, compressed = max(todays) if todays else (0, False)
+        if compressed:
+            part += 1
+
+        self._segment_day = day
+        self._segment_part = part
+        self._segment = segment_path(self.log_dir, day, part)
+        self._conn = open_store(self._segment)
+
+        # Anything older that is still uncompressed (left by an earlier run) is closed for good.
+        for _, _, path, compressed in list_segments(self.log_dir):
+            if not compressed and path != self._segment:
+                self._compress_queue.put(path)
+
+    def _close_segment(self) -> None:
+        if self._conn is None:
+            return
+        # Fold the WAL back into the main file so the segment is self-contained.
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._conn.close()
+        self._conn = None
+
+    def _maybe_rotate(self) -> None:
+        today = log_date()
+        if self._conn is None:
+            self._open_segment(today)
+            return
+
+        # In WAL mode recent rows live in the -wal file until a checkpoint, so count both.
+        size = sum(
+            os.path.getsize(path)
+            for path in (self._segment, self._segment + "-wal")
+            if os.path.isfile(path)
+        )
+        too_big = size >= self.max_segment_bytes
+        if today == self._segment_day and not too_big:
+            return
+
+        old_segment = self._segment
+        self._close_segment()
+        if today == self._segment_day:
+            self._segment_part += 1
+            self._segment = segment_path(self.log_dir, today, self._segment_part)
+            self._conn = open_store(self._segment)
+        else:
+            self._open_segment(today)
+        self._compress_queue.put(old_segment)
+
+    def _run_compression(self) -> None:
+        while True:
+            path = self._compress_queue.get()
+            try:
+                if os.path.isfile(path) and not os.path.isfile(path + "-wal"):
+                    compress_segment(path)
+                apply_retention(self.log_dir, self.retention_days)
+            except Exception as e:
+                print(f"Log segment compression failed for {path}: {repr(e)}")
+
+    def _write_batch(self, batch) -> None:
+        grouped = defaultdict(list)
+        for table, rows in batch:
+            columns = TABLE_COLUMNS[table]
+            grouped[table].extend(tuple(row.get(c) for c in columns) for row in rows)
+
+        try:
+            self._maybe_rotate()
+            with self._conn:
+                for table, values in grouped.items():
+                    columns = TABLE_COLUMNS[table]
+                    self._conn.executemany(
+                        f"INSERT INTO {table} ({', '.join(columns)}) "
+                        f"VALUES ({', '.join('?' for _ in columns)})",
+                        values
+                    )
+        except Exception as e:
+            print(f"Log write failed ({sum(len(v) for v in grouped.values())} rows): {repr(e)}")
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.idle_flush_seconds)
+            except queue.Empty:
+                continue
+
+            batch = []
+            while True:
+                if item is self._stop:
+                    stopping = True
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+
+        self._close_segment()
+
+
+# ------------------------
+# CSV EXPORT
+# ------------------------
+def _where(session_id: str = None, date: str = None):
+    clauses, params = [], []
+    if session_id:
+        clauses.append("session_id = ?")
+        params.append(session_id)
+    if date:
+        clauses.append("date = ?")
+        params.append(date)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def _readable_segments(log_dir: str):
+    """Yields a path SQLite can open for every segment, compressed or not."""
+    for _, _, path, compressed in list_segments(log_dir):
+        if not compressed:
+            yield path
+            continue
+        # SQLite cannot read gzip directly; unpack to a temporary file first.
+        with tempfile.TemporaryDirectory() as tmp:
+            unpacked = os.path.join(tmp, "segment.sqlite")
+            with gzip.open(path, "rb") as src, open(unpacked, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            yield unpacked
+
+
+def _read_segment(db_path: str, session_id: str, date: str, conversation, retrieval) -> None:
+    conn = sqlite3.connect(db_path)
+    where, params = _where(session_id, date)
+
+    # Turns and router decisions share the conversation file, in time order.
+    query = (
+        f"SELECT timestamp, session_id, sender, message, search_query, date, 0 AS src, id FROM turns{where} "
+        f"UNION ALL "
+        f"SELECT timestamp, session_id, sender, message, search_query, date, 1 AS src, id FROM router_decisions{where} "
+        f"ORDER BY timestamp, src, id"
+    )
+    for ts, sid, sender, message, search_query, day, _, _ in conn.execute(query, params + params):
+        conversation[(sid, day)].append([ts, sid, sender, message or "", search_query or ""])
+
+    query = (
+        f"SELECT timestamp, session_id, endpoint, question, search_query, rank, source_url, chunk_preview, date "
+        f"FROM retrievals{where} ORDER BY timestamp, id"
+    )
+    for ts, sid, endpoint, question, search_query, rank, url, preview, day in conn.execute(query, params):
+        retrieval[(sid, day)].append((endpoint, [ts, sid, question, search_query, rank, url, preview]))
+
+    conn.close()
+
+
+def read_retrievals(log_dir: str = LOG_DIR, date: str = None) -> list:
+    """All logged retrieval rows (as dicts) from every segment, oldest first."""
+    rows = []
+    where, params = _where(None, date)
+    for path in _readable_segments(log_dir):
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        query = f"SELECT {', '.join(RETRIEVAL_COLUMNS)} FROM retrievals{where} ORDER BY timestamp, id"
+        rows.extend(dict(row) for row in conn.execute(query, params))
+        conn.close()
+    rows.sort(key=lambda row: row["timestamp"])
+    return rows
+
+
+def export_csv(log_dir: str, out_dir: str, session_id: str = None, date: str = None) -> int:
+    """
+    Regenerates the per-session CSV layout: {session_id}_{date}.csv and
+    {session_id}_{date}_retrieval.csv from every segment in log_dir.
+    Returns the number of files written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    conversation = defaultdict(list)
+    retrieval = defaultdict(list)
+
+    for path in _readable_segments(log_dir):
+        _read_segment(path, session_id, date, conversation, retrieval)
+
+    # A session can span two segments (size rollover, or rows written near midnight).
+    for rows in conversation.values():
+        rows.sort(key=lambda row: row[0])
+    for rows in retrieval.values():
+        rows.sort(key=lambda item: item[1][0])
+
+    written = 0
+    for (sid, day), rows in conversation.items():
+        path = os.path.join(out_dir, f"{sid}_{day}.csv")
+        with open(path, "w", newline="", encoding="utf-8-sig") as csvfile:
+            writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+            writer.writerow(CONVERSATION_HEADER)
+            writer.writerows(rows)
+        written += 1
+
+    for (sid, day), rows in retrieval.items():
+        path = os.path.join(out_dir, f"{sid}_{day}_retrieval.csv")
+        # /chat_rag sessions used the layout with the extra endpoint column.
+        with_endpoint = any(endpoint for endpoint, _ in rows)
+        with open(path, "w", newline="", encoding="utf-8-sig") as csvfile:
+            writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
+            writer.writerow(RAG_RETRIEVAL_HEADER if with_endpoint else RETRIEVAL_HEADER)
+            for endpoint, row in rows:
+                writer.writerow(row[:2] + [endpoint] + row[2:] if with_endpoint else row)
+        written += 1
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the chatbot log store to the per-session CSV layout.")
+    parser.add_argument("--log-dir", default=LOG_DIR, help="Folder with the log store segments")
+    parser.add_argument("--out", default="./conversation_export", help="Output folder for CSV files")
+    parser.add_argument("--session", default=None, help="Only export this session_id")
+    parser.add_argument("--date", default=None, help="Only export this date (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    written = export_csv(args.log_dir, args.out, session_id=args.session, date=args.date)
+    print(f"Exported {written} CSV files to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+# dense_index.py
+# Exact in-memory vector search over the chunk embeddings of the Chroma collection.
+#
+# The corpus is small (thousands to tens of thousands of chunks), so one matrix
+# multiply over row-normalized embeddings is both exact and faster than a query
+# through the Chroma client. The matrix is saved next to the Chroma database as
+# a .npy file and opened memory-mapped: the OS page cache holds it once for all
+# processes. While the saved ids match the collection (open_saved), the server
+# does not pull the embeddings from Chroma's SQLite on startup.
+#
+# Storage types (bytes per 768-d vector):
+#   float32  3072   exact
+#   float16  1536   exact up to rounding
+#   int8      768   per-dimension scale, approximate
+#   binary     96   sign bits, Hamming distance, approximate
+# Quantized indexes can re-score their top k * rescore_factor candidates with a
+# float copy kept on disk (memory-mapped, so only the candidate rows are read),
+# which recovers most of the recall lost to quantization.
+#
+# Usage:
+#   index = DenseIndex.open_or_build("./chroma_db/dense_index", ids, matrix,
+#                                    dtype="int8", rescore_dtype="float16")
+#   rows, scores = index.search(query_embedding, k=20)   # rows follow `ids` order
+#   per_query = index.search_many([emb_a, emb_b], k=20)  # one pass for several queries
+#
+# The saved index is rebuilt automatically when the collection's ids change.
+# To skip reading every embedding when nothing changed, try first:
+#   index = DenseIndex.open_saved(path, ids, embedding_of_ids_0, dtype="int8", rescore_dtype="float16")
+
+import json
+import os
+
+import numpy as np
+
+
+# ------------------------
+# SETTINGS
+# ------------------------
+FLOAT_DTYPES = ("float32", "float16")
+QUANTIZED_DTYPES = ("int8", "binary")
+SUPPORTED_DTYPES = FLOAT_DTYPES + QUANTIZED_DTYPES
+SCORE_BLOCK_ROWS = 8192   # float16 / int8 rows converted to float32 per block while scoring
+DEFAULT_RESCORE_FACTOR = 4
+
+
+# Set bits per byte value, for NumPy < 2.0 (no np.bitwise_count).
+_POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def popcount(codes: np.ndarray) -> np.ndarray:
+    """Number of set bits in each uint8 element."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes)
+    return _POPCOUNT_TABLE[codes]
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def normalize_vector(vector) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+def encode(matrix: np.ndarray, dtype: str) -> tuple:
+    """Row-normalizes and encodes the matrix; returns (codes, int8 scales or None)."""
+    matrix = normalize_rows(matrix)
+    if dtype in FLOAT_DTYPES:
+        return matrix.astype(dtype), None
+    if dtype == "int8":
+        scales = np.maximum(np.abs(matrix).max(axis=0), 1e-12) / 127
+        return np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8), scales.astype(np.float32)
+    if dtype == "binary":
+        return np.packbits(matrix > 0, axis=1), None
+    raise ValueError(f"Unsupported dense index dtype {dtype!r}; expected one of {SUPPORTED_DTYPES}.")
+
+
+class DenseIndex:
+    """
+    Row-normalized (optionally quantized) embedding matrix with top-k cosine search.
+    Row i belongs to ids[i]; callers map rows back to their own documents.
+    """
+
+    def __init__(self, ids: list, matrix: np.ndarray, dtype: str, dim: int,
+                 scales: np.ndarray = None, path: str = None):
+        self.ids = list(ids)
+        self.matrix = matrix
+        self.dtype = dtype
+        self.dim = dim
+        self.scales = scales
+        self.path = path
+        self.rescore_index = None
+        self.rescore_factor = DEFAULT_RESCORE_FACTOR
+
+    # ---------- persistence ----------
+    @staticmethod
+    def _files(path: str, dtype: str) -> tuple:
+        return (
+            os.path.join(path, f"embeddings.{dtype}.npy"),
+            os.path.join(path, f"index.{dtype}.json"),
+            os.path.join(path, f"scales.{dtype}.npy"),
+        )
+
+    @classmethod
+    def build(cls, path: str, ids: list, matrix: np.ndarray, dtype: str = "float32") -> "DenseIndex":
+        codes, scales = encode(matrix, dtype)
+        os.makedirs(path, exist_ok=True)
+        matrix_file, meta_file, scales_file = cls._files(path, dtype)
+
+        # Write to temporary names first so a crash never leaves a half-written index.
+        with open(matrix_file + ".tmp", "wb") as handle:
+            np.save(handle, np.ascontiguousarray(codes))
+        if scales is not None:
+            with open(scales_file + ".tmp", "wb") as handle:
+                np.save(handle, scales)
+        with open(meta_file + ".tmp", "w", encoding="utf-8") as handle:
+            json.dump({"dim": int(np.shape(matrix)[1]), "ids": list(ids)}, handle)
+        os.replace(matrix_file + ".tmp", matrix_file)
+        if scales is not None:
+            os.replace(scales_file + ".tmp", scales_file)
+        os.replace(meta_file + ".tmp", meta_file)
+        return cls.load(path, dtype)
+
+    @classmethod
+    def load(cls, path: str, dtype: str = "float32") -> "DenseIndex":
+        matrix_file, meta_file, scales_file = cls._files(path, dtype)
+        with open(meta_file, encoding="utf-8") as handle:
+            meta = json.load(handle)
+        matrix = np.load(matrix_file, mmap_mode="r")
+        scales = np.load(scales_file) if dtype == "int8" else None
+        if matrix.ndim != 2 or len(matrix) != len(meta["ids"]):
+            raise ValueError(f"Dense index at {path} is inconsistent: {matrix.shape} for {len(meta['ids'])} ids.")
+        return cls(meta["ids"], matrix, dtype, meta["dim"], scales, path)
+
+    @staticmethod
+    def _check_dtypes(dtype: str, rescore_dtype: str) -> bool:
+        """Validates the dtypes; returns whether a re-scoring copy is used."""
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported dense index dtype {dtype!r}; expected one of {SUPPORTED_DTYPES}.")
+        if not rescore_dtype or dtype not in QUANTIZED_DTYPES:
+            return False
+        if rescore_dtype not in FLOAT_DTYPES:
+            raise ValueError(f"Re-scoring needs a float dtype, got {rescore_dtype!r}.")
+        return True
+
+    @classmethod
+    def _load_current(cls, path: str, ids: list, dtype: str, dim: int):
+        try:
+            index = cls.load(path, dtype)
+        except (OSError, ValueError, KeyError):
+            return None
+        return index if index.ids == list(ids) and index.dim == dim else None
+
+    @classmethod
+    def open_saved(cls, path: str, ids: list, sample_embedding, dtype: str = "float32",
+                   rescore_dtype: str = None, rescore_factor: int = DEFAULT_RESCORE_FACTOR):
+        """
+        The saved index (with its re-scoring copy) if it holds exactly these ids in
+        the same order, else None. Needs only the stored embedding of ids[0]: its
+        dimension must match and, where the index keeps float rows, its row too,
+        which catches a rebuild with another embedding model under the same ids.
+        """
+        use_rescore = cls._check_dtypes(dtype, rescore_dtype)
+        if not len(ids):
+            return None
+        sample = normalize_vector(sample_embedding)
+        index = cls._load_current(path, ids, dtype, len(sample))
+        if index is None:
+            return None
+        if use_rescore:
+            index.rescore_index = cls._load_current(path, ids, rescore_dtype, len(sample))
+            if index.rescore_index is None:
+                return None
+            index.rescore_factor = max(int(rescore_factor), 1)
+
+        float_matrix = index.float_matrix
+        if float_matrix is not None and float(float_matrix[0].astype(np.float32) @ sample) < 0.999:
+            return None
+        return index
+
+    @classmethod
+    def open_or_build(cls, path: str, ids: list, matrix: np.ndarray, dtype: str = "float32",
+                      rescore_dtype: str = None, rescore_factor: int = DEFAULT_RESCORE_FACTOR) -> "DenseIndex":
+        """
+        Loads the saved index if it holds exactly these ids (same order); otherwise rebuilds it.
+        rescore_dtype ("float32" / "float16") adds a float copy used to re-score the
+        candidates of a quantized index.
+        """
+        use_rescore = cls._check_dtypes(dtype, rescore_dtype)
+        dim = np.shape(matrix)[1]
+        index = cls._load_current(path, ids, dtype, dim)
+        if index is None:
+            index = cls.build(path, ids, matrix, dtype)
+        if use_rescore:
+            index.rescore_index = cls._load_current(path, ids, rescore_dtype, dim)
+            if index.rescore_index is None:
+                index.rescore_index = cls.build(path, ids, matrix, rescore_dtype)
+            index.rescore_factor = max(int(rescore_factor), 1)
+        return index
+
+    # ---------- search ----------
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        """Size of what every query scans (the codes plus int8 scales)."""
+        return int(self.matrix.nbytes) + (int(self.scales.nbytes) if self.scales is not None else 0)
+
+    @property
+    def float_matrix(self):
+        """A float view of the normalized embeddings, if this index has one."""
+        if self.dtype in FLOAT_DTYPES:
+            return self.matrix
+        return self.rescore_index.matrix if self.rescore_index is not None else None
+
+    def scores_many(self, query_embeddings) -> np.ndarray:
+        """
+        Cosine similarity (estimated for quantized types) of every query to every
+        row, as a float32 (rows, queries) array; one pass over the matrix for all queries.
+        """
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim))
+        if self.dtype == "float32":
+            return np.asarray(self.matrix @ queries.T)
+        if self.dtype == "binary":
+            bits = np.packbits(queries > 0, axis=1)
+            out = np.empty((len(self.matrix), len(queries)), dtype=np.float32)
+            for start in range(0, len(self.matrix), SCORE_BLOCK_ROWS):
+                block = self.matrix[start:start + SCORE_BLOCK_ROWS]
+                hamming = popcount(block[:, None, :] ^ bits[None, :, :]).sum(axis=2, dtype=np.int32)
+                out[start:start + len(block)] = 1.0 - 2.0 * hamming / self.dim
+            return out
+
+        # NumPy has no fast float16 / int8 matmul; convert one block at a time.
+        if self.dtype == "int8":
+            queries = queries * self.scales
+        out = np.empty((len(self.matrix), len(queries)), dtype=np.float32)
+        for start in range(0, len(self.matrix), SCORE_BLOCK_ROWS):
+            block = self.matrix[start:start + SCORE_BLOCK_ROWS]
+            out[start:start + len(block)] = block.astype(np.float32) @ queries.T
+        return out
+
+    def scores(self, query_embedding) -> np.ndarray:
+        """Cosine similarity (estimated for quantized types) of the query to every row, as float32."""
+        return self.scores_many([query_embedding])[:, 0]
+
+    def row_scores(self, query_embedding, rows) -> np.ndarray:
+        """Exact cosine similarity for the given rows (float indexes only)."""
+        return self.matrix[np.asarray(rows)].astype(np.float32) @ normalize_vector(query_embedding)
+
+    def search_many(self, query_embeddings, k: int) -> list:
+        """search() for several queries at once; returns one (rows, scores) pair per query."""
+        if not len(query_embeddings):
+            return []
+        if not len(self.ids) or k <= 0:
+            return [([], []) for _ in query_embeddings]
+        all_scores = self.scores_many(query_embeddings)
+
+        results = []
+        n = min(k * self.rescore_factor if self.rescore_index is not None else k, len(self.ids))
+        for column, query_embedding in enumerate(query_embeddings):
+            scores = all_scores[:, column]
+            top = np.argpartition(-scores, n - 1)[:n]
+            if self.rescore_index is not None:
+                # Sorted rows read the memory-mapped float copy in file order.
+                top = np.sort(top)
+                top_scores = self.rescore_index.row_scores(query_embedding, top)
+            else:
+                top_scores = scores[top]
+
+            order = np.argsort(-top_scores)[:k]
+            results.append((top[order].tolist(), top_scores[order].tolist()))
+        return results
+
+    def search(self, query_embedding, k: int) -> tuple:
+        """Returns (rows, scores) of the k most similar rows, best first."""
+        return self.search_many([query_embedding], k)[0]
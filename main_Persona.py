@@ -10,17 +10,16 @@ import json
 import re
 import random
 from datetime import datetime
+from conversation_store import log_date
 
 
 # ----------------------------
 # 1) LOGGING
 # ----------------------------
 os.makedirs("conversation", exist_ok=True)
-date = datetime.now().strftime("%Y-%m-%d")
-
 
 def save_to_csv(session_id: str, sender: str, message: str, search_query: str = "") -> None:
-    filename = f"conversation/{session_id}_{date}.csv"
+    filename = f"conversation/{session_id}_{log_date()}.csv"
     file_exists = os.path.isfile(filename)
 
     with open(filename, "a", newline="", encoding="utf-8-sig") as csvfile:
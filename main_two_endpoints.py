@@ -15,34 +15,103 @@ from flask_cors import CORS
 from langchain_ollama.llms import OllamaLLM
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_chroma import Chroma
+import chromadb
 from langchain_ollama import OllamaEmbeddings
 from rank_bm25 import BM25Okapi
 from langchain_core.documents import Document
-import csv
+from ollama import Client as OllamaClient
+from conversation_store import BackgroundLogWriter, log_timestamp
+from session_store import SessionStore
+from request_metrics import registry as metrics_registry, start_trace, current_trace
+from micro_batcher import MicroBatcher, SingleFlight
+from dense_index import DenseIndex
+from reranker import CrossEncoderReranker
+import numpy as np
 import os
 import json
 import re
 import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from difflib import SequenceMatcher
 
 
 # ----------------------------
-# 1) LOGGING DIRECTORY
+# 1) LOGGING
 # ----------------------------
+# Turns, router decisions and retrieval ranks go to one SQLite store
+# (conversation/conversation_log_<date>.sqlite segments, rotated daily or by size
+# and gzip-compressed when closed; see conversation_store.py) through a background
+# writer, so logging never blocks a request. The old per-session CSV layout can be
+# regenerated with:  python conversation_store.py --out <folder>
 os.makedirs("conversation", exist_ok=True)
 
-date = datetime.now().strftime("%Y-%m-%d")
+log_writer = BackgroundLogWriter()
+
 
 def save_to_csv(session_id: str, sender: str, message: str, search_query: str = "") -> None:
-    filename = f"conversation/{session_id}_{date}.csv"
-    file_exists = os.path.isfile(filename)
+    # Name kept from the CSV days; rows now go to the "turns" table.
+    timestamp, day = log_timestamp()
+    log_writer.write("turns", [{
+        "timestamp": timestamp,
+        "date": day,
+        "session_id": session_id,
+        "sender": sender,
+        "message": message,
+        "search_query": search_query
+    }])
+
+
+def save_router_decision(session_id: str, sender: str, decision: dict, message: str, search_query: str = "") -> None:
+    """
+    Logs one router decision with each field in its own column (lists such as
+    sub_queries as JSON). message is the human-readable summary that the CSV
+    export shows in the conversation file.
+    """
+    decision = {
+        key: json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value
+        for key, value in decision.items()
+    }
+    timestamp, day = log_timestamp()
+    log_writer.write("router_decisions", [{
+        "timestamp": timestamp,
+        "date": day,
+        "session_id": session_id,
+        "sender": sender,
+        "message": message,
+        "search_query": search_query,
+        **decision
+    }])
+
+
+def save_retrieval_log(session_id: str, question: str, search_query: str, docs, endpoint: str = "") -> None:
+    """
+    Logs the ranked retrieval results. /chat_rag passes endpoint="chat_rag",
+    which the CSV export turns into the extra endpoint column.
+    """
+    timestamp, day = log_timestamp()
+
+    rows = []
+    for idx, doc in enumerate(docs, start=1):
+        # shorten chunk for readability
+        contextual_summary = doc.metadata.get("contextual_summary", "")
+        preview_text = f"{contextual_summary} {doc.page_content}"
+
+        rows.append({
+            "timestamp": timestamp,
+            "date": day,
+            "session_id": session_id,
+            "endpoint": endpoint,
+            "question": question,
+            "search_query": search_query,
+            "rank": idx,
+            "source_url": doc.metadata.get("source_url", ""),
+            "chunk_preview": preview_text[:500].replace("\n", " ")
+        })
 
-    with open(filename, "a", newline="", encoding="utf-8-sig") as csvfile:
-        writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-        if not file_exists:
-            writer.writerow(["timestamp", "session_id", "sender", "message", "search_query"])
-        writer.writerow([datetime.now().isoformat(), session_id, sender, message, search_query])
+    log_writer.write("retrievals", rows)
 
 
 # ----------------------------
@@ -51,34 +120,82 @@ def save_to_csv(session_id: str, sender: str, message: str, search_query: str =
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# session_id -> ["User: ...", "Assistant: ...", ...]
-conversation_memory = {}
+# Session stores are bounded: sessions idle for SESSION_IDLE_TTL_SECONDS are
+# dropped, and the least recently used one is evicted beyond MAX_SESSIONS.
+# Sizes and eviction counts are reported on /health.
+MAX_SESSIONS = 5000
+SESSION_IDLE_TTL_SECONDS = 2 * 60 * 60
+
+# session_id -> {"lines": ["User: ...", "Assistant: ...", ...], "summary": str, ...}
+# (see 6.3) CONVERSATION HISTORY MANAGER)
+conversation_memory = SessionStore("conversation_memory", MAX_SESSIONS, SESSION_IDLE_TTL_SECONDS)
 
 # Separate memory for the RAG-only endpoint so A/B tests do not share history.
-rag_conversation_memory = {}
+rag_conversation_memory = SessionStore("rag_conversation_memory", MAX_SESSIONS, SESSION_IDLE_TTL_SECONDS)
 
 # session_id -> persona info dict
-persona_memory = {}
+persona_memory = SessionStore("persona_memory", MAX_SESSIONS, SESSION_IDLE_TTL_SECONDS)
 
-# Keep memory small for speed
+# Keep memory small for speed. Older lines are folded into a rolling summary
+# (see 6.3); this is the hard cap on raw lines if summarization falls behind.
 MAX_MEMORY_LINES = 10  # each turn adds 2 lines: user + assistant
 
 
 # ----------------------------
 # 3) VECTOR DB (RAG)
 # ----------------------------
+# Shared Ollama settings for the embedding model and the LLM (see 4) LLM).
+OLLAMA_KEEP_ALIVE = 1800  # seconds; OllamaEmbeddings only accepts an int here
+OLLAMA_NUM_CTX = 8192
+
 print("Connecting to Vector Database...")
-embeddings = OllamaEmbeddings(model="nomic-embed-text")
+embeddings = OllamaEmbeddings(model="nomic-embed-text", keep_alive=OLLAMA_KEEP_ALIVE)
+# One client for both: LangChain's Chroma wrapper for similarity search and the
+# plain collection for queries the wrapper does not offer.
+chroma_client = chromadb.PersistentClient(path="./chroma_db")
 vector_db = Chroma(
-    persist_directory="./chroma_db",
+    client=chroma_client,
     embedding_function=embeddings,
     collection_name="rutgers_corpus"
 )
+chroma_collection = chroma_client.get_collection("rutgers_corpus", embedding_function=None)
+
+# The HNSW settings (M, ef_construction, ef_search) are stored with the
+# collection when vector.py builds it; see HNSW_* there. ef_search can be changed
+# without a rebuild with vector.py's UPDATE_EF_SEARCH_ONLY, then a server restart.
+# test/benchmark_ann_recall.py measures recall against exact search.
+
+
+def chroma_hnsw_config() -> dict:
+    try:
+        return dict(chroma_collection.configuration.get("hnsw") or {})
+    except Exception:
+        return {}
+
+
+print(f"Chroma HNSW config: {chroma_hnsw_config()}")
 
 retriever = vector_db.as_retriever(
     search_kwargs={"k": 20}
 )
 
+# Vector search backend (used in 3.3):
+# "chroma": approximate HNSW search through the Chroma client (default).
+# "numpy":  exact cosine search over the chunk embeddings, saved under
+#           DENSE_INDEX_DIR and memory-mapped (dense_index.py). Same Documents
+#           as Chroma returns; nomic-embed-text vectors are unit length, so the
+#           ranking matches an exact L2 search.
+# DENSE_INDEX_DTYPE sets the storage per 768-d vector: "float32" (3 KB),
+# "float16" (1.5 KB), or the approximate "int8" (768 B) and "binary" (96 B).
+# Quantized indexes re-score their top k * DENSE_INDEX_RESCORE_FACTOR candidates
+# with a memory-mapped DENSE_INDEX_RESCORE_DTYPE copy ("" = no re-scoring).
+# test/benchmark_ann_recall.py reports memory and recall@20 for each option.
+VECTOR_BACKEND = os.environ.get("SPAA_VECTOR_BACKEND", "chroma").strip().lower()
+DENSE_INDEX_DIR = "./chroma_db/dense_index"
+DENSE_INDEX_DTYPE = os.environ.get("SPAA_DENSE_INDEX_DTYPE", "float32")
+DENSE_INDEX_RESCORE_DTYPE = os.environ.get("SPAA_DENSE_INDEX_RESCORE", "float16")
+DENSE_INDEX_RESCORE_FACTOR = 4
+
 # ----------------------------
 # 3.1) BM25 INDEX
 # ----------------------------
@@ -91,8 +208,8 @@ def tokenize_for_bm25(text: str):
 
 print("Building BM25 index...")
 
-# Pull all Chroma documents into memory for BM25.
-# Adjust limit if your database grows much larger.
+# Pull all Chroma documents into memory for BM25 (embeddings are pulled in 3.2,
+# only when needed). Adjust limit if your database grows much larger.
 chroma_data = vector_db.get(
     include=["documents", "metadatas"],
     limit=10000
@@ -124,11 +241,240 @@ bm25_index = BM25Okapi(bm25_corpus)
 
 print(f"BM25 index built with {len(bm25_docs)} documents.")
 
+# ----------------------------
+# 3.2) EMBEDDING MATRIX (RESULT DIVERSIFICATION)
+# ----------------------------
+# Stored chunk embeddings are fetched once at startup and kept as a
+# row-normalized matrix (with the numpy backend, the memory-mapped index itself).
+# Diversification then only needs dot products between candidate rows; no extra
+# embedding or LLM calls per request.
+
+DIVERSIFY_RESULTS = os.environ.get("SPAA_DIVERSIFY", "0") == "1"   # MMR + per-source cap after fusion
+MMR_LAMBDA = 0.7              # 1.0 = pure relevance, 0.0 = pure novelty
+MAX_CHUNKS_PER_SOURCE = 2     # at most this many chunks from the same URL
+MMR_CANDIDATE_POOL = 30       # fused candidates considered by MMR
+
+
+def doc_key(doc):
+    return (
+        doc.metadata.get("source_url", ""),
+        doc.metadata.get("title", ""),
+        doc.page_content[:120]
+    )
+
+
+def pull_embeddings(ids: list) -> np.ndarray:
+    """Stored embeddings of ids, in that order, row-normalized; (0, 0) if unavailable."""
+    if not ids:
+        return np.zeros((0, 0), dtype=np.float32)
+    stored = vector_db.get(ids=ids, include=["embeddings"])
+    vectors = stored.get("embeddings")
+    position = {doc_id: i for i, doc_id in enumerate(stored["ids"])}
+    if vectors is None or len(vectors) == 0 or any(doc_id not in position for doc_id in ids):
+        return np.zeros((0, 0), dtype=np.float32)
+    matrix = np.asarray(vectors, dtype=np.float32)[[position[doc_id] for doc_id in ids]]
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+# Reading every embedding out of Chroma's SQLite is the slowest part of startup.
+# The numpy backend saves its own copy (3.3): while that copy still matches the
+# collection it is opened as is, checked against one stored embedding.
+dense_index = None
+if VECTOR_BACKEND == "numpy" and chroma_data["ids"]:
+    sample = pull_embeddings(chroma_data["ids"][:1])
+    if len(sample):
+        dense_index = DenseIndex.open_saved(
+            DENSE_INDEX_DIR, chroma_data["ids"], sample[0], dtype=DENSE_INDEX_DTYPE,
+            rescore_dtype=DENSE_INDEX_RESCORE_DTYPE, rescore_factor=DENSE_INDEX_RESCORE_FACTOR
+        )
+
+if dense_index is None:
+    embedding_matrix = pull_embeddings(chroma_data["ids"])
+    print(f"Embedding matrix cached: {embedding_matrix.shape}")
+else:
+    embedding_matrix = np.zeros((0, 0), dtype=np.float32)
+    print("Saved dense index is current; embeddings not pulled from Chroma.")
+
+# ----------------------------
+# 3.3) VECTOR SEARCH BACKEND
+# ----------------------------
+# Settings (VECTOR_BACKEND, DENSE_INDEX_*) are at the end of 3). The numpy
+# backend's index is built here when 3.2 found no current saved copy.
+if VECTOR_BACKEND == "numpy":
+    if dense_index is None and len(embedding_matrix):
+        dense_index = DenseIndex.open_or_build(
+            DENSE_INDEX_DIR, chroma_data["ids"], embedding_matrix, dtype=DENSE_INDEX_DTYPE,
+            rescore_dtype=DENSE_INDEX_RESCORE_DTYPE, rescore_factor=DENSE_INDEX_RESCORE_FACTOR
+        )
+    if dense_index is not None:
+        # Diversification reads the same normalized rows, so share the mapped file
+        # instead of keeping a second float32 copy in RAM. A quantized index
+        # without re-scoring has no float rows: MMR then applies only the
+        # per-source cap rather than holding the full float32 matrix.
+        if dense_index.float_matrix is not None:
+            embedding_matrix = dense_index.float_matrix
+        else:
+            embedding_matrix = np.zeros((0, 0), dtype=np.float32)
+            print("No float embeddings kept (no re-scoring copy); MMR uses the per-source cap only.")
+        rescore = (
+            f", re-scored with {dense_index.rescore_index.dtype} x{dense_index.rescore_factor}"
+            if dense_index.rescore_index is not None else ""
+        )
+        print(f"Dense vector index: {len(dense_index)} x {dense_index.dim} "
+              f"{DENSE_INDEX_DTYPE} ({dense_index.nbytes / 1e6:.1f} MB, memory-mapped{rescore})")
+    else:
+        print("Dense vector index unavailable (no stored embeddings); using Chroma search.")
+
+# doc_key -> row in embedding_matrix
+embedding_row_index = {
+    doc_key(doc): row for row, doc in enumerate(bm25_docs)
+} if len(embedding_matrix) else {}
+
+
+# Chroma id -> row in bm25_docs (same order as the startup pull).
+doc_row_by_id = {doc_id: row for row, doc_id in enumerate(chroma_data["ids"])}
+
+
+def vector_search(query_embedding, k: int):
+    """Top-k chunks for an already embedded query, from the configured backend."""
+    if dense_index is not None:
+        rows, _ = dense_index.search(query_embedding, k)
+        return [bm25_docs[row] for row in rows]
+    return vector_db.similarity_search_by_vector(query_embedding, k=k)
+
+
+def vector_search_many(query_embeddings, k: int) -> list:
+    """vector_search for several embedded queries in one backend call; one list per query."""
+    if len(query_embeddings) == 1:
+        return [vector_search(query_embeddings[0], k)]
+    if dense_index is not None:
+        return [[bm25_docs[row] for row in rows] for rows, _ in dense_index.search_many(query_embeddings, k)]
+
+    found = chroma_collection.query(
+        query_embeddings=[list(map(float, e)) for e in query_embeddings],
+        n_results=k,
+        include=["documents", "metadatas"]
+    )
+    results = []
+    for ids, contents, metadatas in zip(found["ids"], found["documents"], found["metadatas"]):
+        results.append([
+            bm25_docs[doc_row_by_id[doc_id]] if doc_id in doc_row_by_id
+            else Document(page_content=content or "", metadata=metadata or {})
+            for doc_id, content, metadata in zip(ids, contents, metadatas)
+        ])
+    return results
+
+
 # ----------------------------
 # 4) LLM
 # ----------------------------
-# Keep the same model for language, persona, router, filter, and answer for simplicity.
-model = OllamaLLM(model="qwen3")
+# Per-stage model selection. The router stages only emit a short JSON decision,
+# so they run on a small fast model; the answer stage keeps the large model.
+# Override any stage with an environment variable, e.g.
+#   SPAA_ROUTER_MODEL=qwen3 python main_two_endpoints.py
+# Use test/evaluate_router_agreement.py to check a small router against the large one.
+STAGE_MODELS = {
+    "router": os.environ.get("SPAA_ROUTER_MODEL", "qwen3:1.7b"),
+    "rag_router": os.environ.get("SPAA_RAG_ROUTER_MODEL", "qwen3:1.7b"),
+    "answer": os.environ.get("SPAA_ANSWER_MODEL", "qwen3"),
+    "summary": os.environ.get("SPAA_SUMMARY_MODEL", "qwen3:1.7b"),
+}
+#
+# Ollama reuses the KV cache of the longest matching prompt prefix in a slot, so:
+# - keep_alive keeps the model (and its cache) resident between requests,
+# - num_ctx is pinned because a different context size forces a model reload,
+# - every prompt below is assembled as STATIC instructions first and per-request
+#   values last (see assemble_template), so the long instruction block is only
+#   prefilled once per slot. Run Ollama with OLLAMA_NUM_PARALLEL >= 2 so router
+#   and answer prompts can each keep their own cached slot.
+# Router calls only need a short JSON object: no thinking, deterministic, and a
+# hard cap on generated tokens so a runaway output cannot stall the request.
+ROUTER_MAX_TOKENS = 200
+ROUTER_LLM_SETTINGS = {"reasoning": False, "temperature": 0, "num_predict": ROUTER_MAX_TOKENS}
+
+_stage_llms = {}
+
+
+def get_llm(model_name: str, **settings) -> OllamaLLM:
+    # One client per model name + settings, shared by all stages that use it.
+    key = (model_name, json.dumps(settings, sort_keys=True))
+    if key not in _stage_llms:
+        _stage_llms[key] = OllamaLLM(
+            model=model_name,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            num_ctx=OLLAMA_NUM_CTX,
+            **settings
+        )
+    return _stage_llms[key]
+
+
+def get_router_llm(model_name: str, schema: dict):
+    """
+    Router LLM constrained by Ollama structured outputs: the JSON schema is sent
+    as the request "format", so the reply is always a parseable JSON object.
+    (OllamaLLM's own format field only accepts "json", so the schema is bound
+    per call instead.)
+    """
+    return get_llm(model_name, **ROUTER_LLM_SETTINGS).bind(format=schema)
+
+
+model = get_llm(STAGE_MODELS["answer"])
+
+
+def assemble_template(static_part: str, dynamic_part: str) -> str:
+    """
+    Joins a static instruction block and a per-request block into one template.
+    The static block must not contain template variables; a variable there would
+    change the prompt prefix on every call and defeat Ollama's prefix cache.
+    """
+    static_vars = ChatPromptTemplate.from_template(static_part).input_variables
+    if static_vars:
+        raise ValueError(f"Static prompt block must not contain variables: {static_vars}")
+    return static_part.rstrip() + "\n\n" + dynamic_part.strip() + "\n"
+
+
+# ----------------------------
+# 4.1) ROUTER OUTPUT SCHEMAS
+# ----------------------------
+LANGUAGE_CODES = ["en", "es", "fr", "de", "it", "pt", "zh", "zh-cn", "zh-tw", "ja", "ko", "ru", "ar", "hi"]
+
+PERSONA_LABELS = [
+    "law_enforcement", "veteran", "government_employee", "nonprofit_professional",
+    "current_student", "international_user", "faculty_or_staff", "general_public", "unknown"
+]
+
+RAG_ROUTER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "language": {"type": "string", "enum": LANGUAGE_CODES},
+        "language_confidence": {"type": "number"},
+        "use_retrieval": {"type": "boolean"},
+        "search_query": {"type": "string", "maxLength": 120},
+        "sub_queries": {"type": "array", "items": {"type": "string", "maxLength": 80}, "maxItems": 3},
+        "reason": {"type": "string", "maxLength": 120}
+    },
+    "required": ["language", "language_confidence", "use_retrieval", "search_query", "sub_queries", "reason"]
+}
+
+COMBINED_ROUTER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "language": {"type": "string", "enum": LANGUAGE_CODES},
+        "language_confidence": {"type": "number"},
+        "persona": {"type": "string", "enum": PERSONA_LABELS},
+        "persona_confidence": {"type": "number"},
+        "use_acknowledgment": {"type": "boolean"},
+        "acknowledgment": {"type": "string", "maxLength": 120},
+        "use_retrieval": {"type": "boolean"},
+        "search_query": {"type": "string", "maxLength": 120},
+        "sub_queries": {"type": "array", "items": {"type": "string", "maxLength": 80}, "maxItems": 3},
+        "reason": {"type": "string", "maxLength": 120}
+    },
+    "required": [
+        "language", "language_confidence", "persona", "persona_confidence",
+        "use_acknowledgment", "acknowledgment", "use_retrieval", "search_query", "sub_queries", "reason"
+    ]
+}
 
 
 # ----------------------------
@@ -145,21 +491,9 @@ model = OllamaLLM(model="qwen3")
 #   contains a clear role/background signal.
 # - Routing is still evaluated every turn because retrieval needs vary by question.
 
-combined_template = """
+combined_static = """
 You are a fast analysis-and-routing module for a Rutgers School of Public Affairs and Administration (SPAA) chatbot.
-
-Conversation History:
-{context}
-
-Current User Question:
-{question}
-
-Cached session values:
-- cached_language: {cached_language}
-- cached_language_confidence: {cached_language_confidence}
-- cached_persona: {cached_persona}
-- cached_persona_confidence: {cached_persona_confidence}
-- should_check_persona_again: {should_check_persona_again}
+The cached session values, the Conversation History, and the Current User Question are given at the end.
 
 Tasks:
 1. Decide the user's language.
@@ -202,6 +536,8 @@ Search query rules:
 - If the user language is not English, translate the search query into concise English keywords.
 - Use the conversation history to resolve follow-up references.
 - Do not use overly broad words as the search query, such as "SPAA", "Rutgers", "University", or "school" by themselves.
+- If the question asks about several distinct things (e.g. "CPT and OPT deadlines and who to contact"), also give one short English sub-query per topic in sub_queries (at most 3), e.g. ["CPT deadline", "OPT deadline", "international student office contact"].
+- Otherwise, and when retrieval is not needed, set sub_queries to [].
 
 Return ONLY valid JSON with exactly these keys:
 - language: string
@@ -212,13 +548,30 @@ Return ONLY valid JSON with exactly these keys:
 - acknowledgment: string
 - use_retrieval: true/false
 - search_query: string
-- reason: string
+- sub_queries: list of strings
+- reason: string (one short phrase)
+"""
+
+combined_dynamic = """
+Cached session values:
+- cached_language: {cached_language}
+- cached_language_confidence: {cached_language_confidence}
+- cached_persona: {cached_persona}
+- cached_persona_confidence: {cached_persona_confidence}
+- should_check_persona_again: {should_check_persona_again}
+
+Conversation History:
+{context}
+
+Current User Question:
+{question}
 
 JSON:
 """
 
+combined_template = assemble_template(combined_static, combined_dynamic)
 combined_prompt = ChatPromptTemplate.from_template(combined_template)
-combined_chain = combined_prompt | model
+combined_chain = combined_prompt | get_router_llm(STAGE_MODELS["router"], COMBINED_ROUTER_SCHEMA)
 
 LANG_NAME = {
     "en": "English",
@@ -251,7 +604,9 @@ def lang_display(code: str) -> str:
 
 def parse_combined_json(text) -> dict:
     """
-    Attempts strict JSON parse, then falls back to extracting the first {...} block.
+    Router output is schema-constrained, so the strict parse normally succeeds.
+    Falls back to extracting the first {...} block (e.g. a model without
+    structured-output support).
     Defaults to retrieval when parsing fails, because false negatives are riskier for
     SPAA-specific questions.
     """
@@ -283,6 +638,7 @@ def parse_combined_json(text) -> dict:
         "acknowledgment": "",
         "use_retrieval": True,
         "search_query": "",
+        "sub_queries": [],
         "reason": "Combined analysis/router output not parseable; defaulting to retrieval."
     }
 
@@ -315,13 +671,9 @@ def question_has_role_signal(question: str) -> bool:
 # ----------------------------
 # 6) ANSWER PROMPT
 # ----------------------------
-answer_template = """
+answer_static = """
 Your name is SPAA-rkly. You are a helpful assistant for the School of Public Affairs and Administration (SPAA) at Rutgers University-Newark.
-
-User language: {user_lang_name} ({user_lang}).
-Detected persona: {persona}.
-Persona confidence: {persona_confidence}.
-Acknowledgment: {acknowledgment_to_use}.
+The user language, detected persona, Acknowledgment, Conversation History, Related Information, and Question are given at the end.
 
 ### SAFETY OVERRIDE (HIGHEST PRIORITY)
 
@@ -349,7 +701,7 @@ IMPORTANT:
 - When referring to the SPAA, always use first-person plural language (e.g., "our website", "our program", "our faculty")
 - Do NOT introduce yourself or state your name in your response.
 - Do NOT say "Hello" or "Hi" unless the user is specifically greeting you for the first time.
-- If the user language is not English, respond in {user_lang_name}. Keep proper nouns (program names, office names) in English if they appear in the source text.
+- If the user language is not English, respond in the user language. Keep proper nouns (program names, office names) in English if they appear in the source text.
 - Use retrieved information silently. Do not announce that you are using retrieved information.
 - Do not mention "the retrieved documents", "based on the information", or similar phrases. Just provide the answer naturally.
 - Prefer human conversational wording over formal report wording.
@@ -372,14 +724,7 @@ IMPORTANT:
     • Do NOT treat the user as a prospective student.
     • Prioritize operational, academic, or institutional information relevant to their role.
 
-Conversation History:
-{context}
-
-Question: {question}
-
-Related Information (may be empty if retrieval not needed):
-{info}
-
+Related Information rules (Related Information may be empty if retrieval was not needed):
 - If Related Information is provided, first review all retrieved documents and identify which ones directly answer the user's question.
 - Use only the relevant retrieved documents as references, and ignore documents that are unrelated, weakly related, outdated, duplicated, or only generally about the topic.
 - Ground SPAA-specific facts only in the relevant retrieved content. Do not invent SPAA-specific names, dates, requirements, policies, contacts, or URLs.
@@ -421,9 +766,24 @@ Privacy and Contact Rules:
 
 - If multiple contacts are listed, give each contact on a separate line or in a separate short paragraph.
 - Do not overuse bold or italics for other parts of the answer.
+"""
+
+answer_dynamic = """
+User language: {user_lang_name} ({user_lang}).
+Detected persona: {persona}.
+Persona confidence: {persona_confidence}.
+Acknowledgment: {acknowledgment_to_use}.
+
+Conversation History:
+{context}
+
+Related Information:
+{info}
 
+Question: {question}
 """
 
+answer_template = assemble_template(answer_static, answer_dynamic)
 answer_prompt = ChatPromptTemplate.from_template(answer_template)
 answer_chain = answer_prompt | model
 
@@ -435,14 +795,9 @@ answer_chain = answer_prompt | model
 # persona acknowledgment, and persona-based tailoring. It uses the same vector
 # database, BM25 index, hybrid retrieval function, and source-citation format.
 
-rag_router_template = """
+rag_router_static = """
 You are a fast language-and-routing module for a RAG-only Rutgers School of Public Affairs and Administration (SPAA) chatbot.
-
-Conversation History:
-{context}
-
-Current User Question:
-{question}
+The Conversation History and the Current User Question are given at the end.
 
 Tasks:
 1. Decide the user's language.
@@ -469,24 +824,35 @@ Search query rules:
 - If the user language is not English, translate the search query into concise English keywords.
 - Use the conversation history to resolve follow-up references.
 - Do not use overly broad words as the search query, such as "SPAA", "Rutgers", "University", or "school" by themselves.
+- If the question asks about several distinct things (e.g. "CPT and OPT deadlines and who to contact"), also give one short English sub-query per topic in sub_queries (at most 3), e.g. ["CPT deadline", "OPT deadline", "international student office contact"].
+- Otherwise, and when retrieval is not needed, set sub_queries to [].
 
 Return ONLY valid JSON with exactly these keys:
 - language: string
 - language_confidence: number
 - use_retrieval: true/false
 - search_query: string
-- reason: string
+- sub_queries: list of strings
+- reason: string (one short phrase)
+"""
+
+rag_router_dynamic = """
+Conversation History:
+{context}
+
+Current User Question:
+{question}
 
 JSON:
 """
 
+rag_router_template = assemble_template(rag_router_static, rag_router_dynamic)
 rag_router_prompt = ChatPromptTemplate.from_template(rag_router_template)
-rag_router_chain = rag_router_prompt | model
+rag_router_chain = rag_router_prompt | get_router_llm(STAGE_MODELS["rag_router"], RAG_ROUTER_SCHEMA)
 
-rag_answer_template = """
+rag_answer_static = """
 Your name is SPAA-rkly. You are a RAG-only assistant for the School of Public Affairs and Administration (SPAA) at Rutgers University-Newark.
-
-User language: {user_lang_name} ({user_lang}).
+The user language, Conversation History, Related Information, and Question are given at the end.
 
 ### SAFETY OVERRIDE (HIGHEST PRIORITY)
 
@@ -519,19 +885,12 @@ IMPORTANT:
 - When referring to SPAA, use first-person plural language only when natural, such as "our program" or "our website".
 - Do NOT introduce yourself or state your name in your response.
 - Do NOT say "Hello" or "Hi" unless the user is specifically greeting you for the first time.
-- If the user language is not English, respond in {user_lang_name}. Keep proper nouns (program names, office names) in English if they appear in the source text.
+- If the user language is not English, respond in the user language. Keep proper nouns (program names, office names) in English if they appear in the source text.
 - Use retrieved information silently. Do not announce that you are using retrieved information.
 - Do not mention "the retrieved documents", "based on the information", or similar phrases. Just provide the answer naturally.
 - Assume the full name "School of Public Affairs and Administration (SPAA)" has already been introduced; always use "SPAA" only in all responses.
 
-Conversation History:
-{context}
-
-Question: {question}
-
-Related Information (may be empty if retrieval not needed):
-{info}
-
+Related Information rules (Related Information may be empty if retrieval was not needed):
 - If Related Information is provided, first review all retrieved documents and identify which ones directly answer the user's question.
 - Use only the relevant retrieved documents as references, and ignore documents that are unrelated, weakly related, outdated, duplicated, or only generally about the topic.
 - Ground SPAA-specific facts only in the relevant retrieved content. Do not invent SPAA-specific names, dates, requirements, policies, contacts, or URLs.
@@ -575,6 +934,19 @@ Privacy and Contact Rules:
 - Do not overuse bold or italics for other parts of the answer.
 """
 
+rag_answer_dynamic = """
+User language: {user_lang_name} ({user_lang}).
+
+Conversation History:
+{context}
+
+Related Information:
+{info}
+
+Question: {question}
+"""
+
+rag_answer_template = assemble_template(rag_answer_static, rag_answer_dynamic)
 rag_answer_prompt = ChatPromptTemplate.from_template(rag_answer_template)
 rag_answer_chain = rag_answer_prompt | model
 
@@ -590,19 +962,8 @@ def safe_float(value, default=0.0) -> float:
 
 
 def sanitize_persona_label(label: str) -> str:
-    allowed = {
-        "law_enforcement",
-        "veteran",
-        "government_employee",
-        "nonprofit_professional",
-        "current_student",
-        "international_user",
-        "faculty_or_staff",
-        "general_public",
-        "unknown"
-    }
     label = (label or "").strip()
-    return label if label in allowed else "unknown"
+    return label if label in PERSONA_LABELS else "unknown"
 
 
 def sanitize_acknowledgment(persona: str, use_acknowledgment: bool, acknowledgment: str) -> str:
@@ -659,7 +1020,21 @@ def phrase_overlap_score(query: str, phrases: str) -> float:
         return score
 
 
-def metadata_boost_score(doc, query: str) -> float:
+# Ranking weights used by hybrid_retrieve. Tune them with
+# test/benchmark_retrieval.py rather than by hand.
+RRF_CHROMA_WEIGHT = 0.70
+RRF_BM25_WEIGHT = 0.30
+METADATA_BOOST_WEIGHTS = {
+    "title_in_query": 2.0,    # whole title appears in the query
+    "title_term": 0.4,        # per query term found in the title
+    "summary_term": 0.2,      # per query term found in the contextual summary
+    "phrase_overlap": 1.5     # multiplier on phrase_overlap_score
+}
+
+
+def metadata_boost_score(doc, query: str, weights: dict = None) -> float:
+        # A partial override only replaces the weights it names.
+        weights = {**METADATA_BOOST_WEIGHTS, **(weights or {})}
         q = (query or "").lower()
 
         title = doc.metadata.get("title", "").lower()
@@ -669,141 +1044,739 @@ def metadata_boost_score(doc, query: str) -> float:
         score = 0.0
 
         if title and title in q:
-            score += 2.0
+            score += weights["title_in_query"]
 
         for term in q.split():
             if term in title:
-                score += 0.4
+                score += weights["title_term"]
             if term in contextual_summary:
-                score += 0.2
+                score += weights["summary_term"]
 
-        score += phrase_overlap_score(q, retrieval_phrases) * 1.5
+        score += phrase_overlap_score(q, retrieval_phrases) * weights["phrase_overlap"]
 
         return score
 
 
-def hybrid_retrieve(query: str, k_final: int = 8, k_chroma: int = 20, k_bm25: int = 20):
+def diversify_ranked(ranked, k_final: int, lambda_mult: float = MMR_LAMBDA, max_per_source: int = MAX_CHUNKS_PER_SOURCE):
+    """
+    Maximal marginal relevance over the fused ranking.
+    Relevance is the fused score (scaled to 0-1); redundancy is the cosine similarity
+    to already selected chunks, taken from the cached embedding matrix. Chunks from
+    an already selected URL count as fully redundant, and a per-source cap keeps
+    one URL from filling all context slots.
+    """
+    pool = ranked[:max(MMR_CANDIDATE_POOL, k_final)]
+    if not pool:
+        return []
+
+    top_score = max(item["score"] for item in pool) or 1.0
+    relevance = np.array([item["score"] / top_score for item in pool], dtype=np.float32)
+
+    sources = np.array([item["doc"].metadata.get("source_url", "") for item in pool], dtype=object)
+    rows = [embedding_row_index.get(doc_key(item["doc"])) for item in pool]
+    has_vec = np.array([r is not None for r in rows])
+    dim = embedding_matrix.shape[1] if embedding_matrix.ndim == 2 else 0
+    vecs = np.zeros((len(pool), dim), dtype=np.float32)
+    if dim and has_vec.any():
+        vecs[has_vec] = embedding_matrix[[r for r in rows if r is not None]]
+
+    selected = []
+    per_source = {}
+    max_sim = np.zeros(len(pool), dtype=np.float32)
+    available = np.ones(len(pool), dtype=bool)
+
+    while len(selected) < k_final and available.any():
+        mmr = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        available[best] = False
+
+        source = sources[best]
+        if source and per_source.get(source, 0) >= max_per_source:
+            continue
+        per_source[source] = per_source.get(source, 0) + 1
+        selected.append(best)
+
+        if dim and has_vec[best]:
+            max_sim = np.maximum(max_sim, vecs @ vecs[best])
+        if source:
+            max_sim[sources == source] = 1.0
+
+    return [pool[i]["doc"] for i in selected]
+
+
+# Multi-query retrieval: the routers may split a compound question ("CPT and OPT
+# deadlines and who to contact") into up to MAX_SUB_QUERIES sub_queries. All
+# queries are embedded in one call and searched in one vector pass, and their
+# result lists are fused together with the main query's.
+MULTI_QUERY = os.environ.get("SPAA_MULTI_QUERY", "1") == "1"
+MAX_SUB_QUERIES = 3
+
+
+def clean_sub_queries(values) -> list:
+    """Router sub_queries as a short list of distinct non-empty strings."""
+    if not MULTI_QUERY or not isinstance(values, list):
+        return []
+    cleaned = []
+    for value in values:
+        value = str(value or "").strip()
+        if value and value.lower() not in {c.lower() for c in cleaned}:
+            cleaned.append(value[:120])
+    return cleaned[:MAX_SUB_QUERIES]
+
+
+def retrieval_queries(query: str, sub_queries=None) -> list:
+    """The main query followed by the sub-queries that differ from it."""
+    queries = [query]
+    for sub_query in sub_queries or []:
+        if sub_query.strip().lower() not in {q.strip().lower() for q in queries}:
+            queries.append(sub_query)
+    return queries
+
+
+# Optional cross-encoder reranking (reranker.py) of the top RERANK_CANDIDATES
+# fused chunks, replacing the removed LLM filter_chain. Scores are 0-1; chunks
+# under RERANK_MIN_SCORE are dropped, but at least RERANK_MIN_KEEP are kept.
+# Tune with test/benchmark_reranker.py (batch size) and
+# test/benchmark_retrieval.py (run with SPAA_RERANK=1 and compare "default"
+# with "no_rerank").
+RERANK = os.environ.get("SPAA_RERANK", "0") == "1"
+RERANK_MODEL_DIR = os.environ.get("SPAA_RERANK_MODEL", "./models/ms-marco-MiniLM-L-6-v2")
+RERANK_BATCH_SIZE = 16
+RERANK_THREADS = 4
+RERANK_CANDIDATES = 20
+RERANK_MIN_SCORE = 0.02
+RERANK_MIN_KEEP = 3
+
+reranker = None
+if RERANK:
+    try:
+        reranker = CrossEncoderReranker(RERANK_MODEL_DIR, batch_size=RERANK_BATCH_SIZE, threads=RERANK_THREADS)
+        print(f"Cross-encoder reranker loaded from {RERANK_MODEL_DIR}")
+    except Exception as e:
+        print(f"Cross-encoder reranker unavailable ({repr(e)}); continuing without reranking.")
+
+
+def rerank_candidates(ranked, queries) -> list:
+    """Re-scores the top fused candidates with the cross-encoder (best score over the queries)."""
+    head = ranked[:RERANK_CANDIDATES]
+    chunks = [
+        (doc_key(item["doc"]), f"{item['doc'].metadata.get('title', '')}\n{strip_chunk_header(item['doc'].page_content)}")
+        for item in head
+    ]
+    best = np.zeros(len(head), dtype=np.float32)
+    for q in queries:
+        best = np.maximum(best, reranker.score(q, chunks))
+
+    rescored = sorted(
+        ({"doc": item["doc"], "score": float(score)} for item, score in zip(head, best)),
+        key=lambda x: x["score"],
+        reverse=True
+    )
+    kept = [item for item in rescored if item["score"] >= RERANK_MIN_SCORE]
+    return kept if len(kept) >= RERANK_MIN_KEEP else rescored[:RERANK_MIN_KEEP]
+
+
+def hybrid_retrieve(
+    query: str,
+    k_final: int = 8,
+    k_chroma: int = 20,
+    k_bm25: int = 20,
+    diversify: bool = None,
+    chroma_weight: float = None,
+    bm25_weight: float = None,
+    boost_weights: dict = None,
+    query_embedding=None,
+    sub_queries: list = None,
+    query_embeddings: list = None,
+    rerank: bool = None
+):
     """
     Hybrid retrieval:
-    - Chroma captures semantic similarity.
+    - Vector search (Chroma or the dense index) captures semantic similarity.
     - BM25 captures exact keywords, names, titles, acronyms, and role phrases.
     - Reciprocal Rank Fusion combines both.
+    - Optional cross-encoder reranking re-scores the top fused chunks (default: on
+      when the reranker is loaded).
+    - Optional MMR / per-source cap spreads the final slots over distinct sources.
+    Weights default to RRF_CHROMA_WEIGHT, RRF_BM25_WEIGHT and METADATA_BOOST_WEIGHTS.
+    With sub_queries, every query contributes a vector and a BM25 list to the
+    fusion (RRF scores are averaged over the queries, so one query scores as before).
+    Pass query_embedding (or query_embeddings for [query] + sub_queries) when the
+    queries were already embedded (e.g. in a batch).
     """
-
-    # 1. Chroma semantic retrieval
-    chroma_results = vector_db.similarity_search(query, k=k_chroma)
+    if diversify is None:
+        diversify = DIVERSIFY_RESULTS
+    if chroma_weight is None:
+        chroma_weight = RRF_CHROMA_WEIGHT
+    if bm25_weight is None:
+        bm25_weight = RRF_BM25_WEIGHT
+
+    trace = current_trace()
+    queries = retrieval_queries(query, sub_queries)
+    trace.count("retrieval_queries", len(queries))
+
+    # 1. Semantic retrieval (embedding and search timed separately; backend per VECTOR_BACKEND)
+    if query_embeddings is None and query_embedding is not None:
+        query_embeddings = [query_embedding]
+    if query_embeddings is None or len(query_embeddings) != len(queries):
+        with trace.stage("embed_query"):
+            if len(queries) == 1:
+                query_embeddings = [embeddings.embed_query(query)]
+            else:
+                query_embeddings = embeddings.embed_documents(queries)
+    with trace.stage("vector_search"):
+        vector_results = vector_search_many(query_embeddings, k_chroma)
 
     # 2. BM25 keyword retrieval
-    tokenized_query = tokenize_for_bm25(query)
-    bm25_scores = bm25_index.get_scores(tokenized_query)
+    with trace.stage("bm25"):
+        bm25_results = []
+        for q in queries:
+            bm25_scores = bm25_index.get_scores(tokenize_for_bm25(q))
+
+            top_bm25_indices = sorted(
+                range(len(bm25_scores)),
+                key=lambda i: bm25_scores[i],
+                reverse=True
+            )[:k_bm25]
+
+            bm25_results.append([bm25_docs[i] for i in top_bm25_indices if bm25_scores[i] > 0])
+
+    with trace.stage("fusion_boost"):
+        # 3. Reciprocal Rank Fusion over every query's lists
+        fused = {}
+        lists = [(docs, chroma_weight) for docs in vector_results] + [(docs, bm25_weight) for docs in bm25_results]
+
+        for docs, weight in lists:
+            for rank, doc in enumerate(docs, start=1):
+                key = doc_key(doc)
+                if key not in fused:
+                    fused[key] = {"doc": doc, "score": 0.0}
+                fused[key]["score"] += weight * (1 / rank) / len(queries)
+
+        # 4. Add your existing metadata boost (best match over the queries)
+        for item in fused.values():
+            item["score"] += max(metadata_boost_score(item["doc"], q, boost_weights) for q in queries)
+
+        ranked = sorted(
+            fused.values(),
+            key=lambda x: x["score"],
+            reverse=True
+        )
 
-    top_bm25_indices = sorted(
-        range(len(bm25_scores)),
-        key=lambda i: bm25_scores[i],
-        reverse=True
-    )[:k_bm25]
+    # 5. Optional cross-encoder reranking
+    if rerank is None:
+        rerank = reranker is not None
+    if rerank and reranker is not None and ranked:
+        with trace.stage("rerank"):
+            ranked = rerank_candidates(ranked, queries)
+        trace.count("reranked_docs", len(ranked))
+
+    if diversify:
+        with trace.stage("diversify"):
+            return diversify_ranked(ranked, k_final)
+
+    return [item["doc"] for item in ranked[:k_final]]
 
-    bm25_results = [bm25_docs[i] for i in top_bm25_indices if bm25_scores[i] > 0]
+# ----------------------------
+# 6.2) TOKEN-BUDGETED CONTEXT BUILDER
+# ----------------------------
+# Prompt prefill is the largest latency cost, so the retrieved chunks are fitted
+# into a fixed token budget instead of being pasted in full:
+# - the "Title / Retrieval phrases / Contextual summary" header that vector.py
+#   bakes into each record's first chunk is stripped (TITLE is sent separately),
+# - RETRIEVAL_PHRASES are dropped (they only help ranking, not answering),
+# - each chunk is cut down to its most query-relevant sentences.
+
+CONTEXT_TOKEN_BUDGET = 1800    # approximate tokens for the whole Related Information block
+MIN_TOKENS_PER_DOC = 80        # never trim a kept chunk below this
+DOC_SEPARATOR = "\n\n======= DOCUMENT SEPARATOR =======\n\n"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", flags=re.UNICODE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_CHUNK_HEADER_RE = re.compile(
+    r"^\s*Title:.*?Content:\s*",
+    flags=re.DOTALL
+)
 
-    # 3. Reciprocal Rank Fusion
-    fused = {}
 
-    def doc_key(doc):
-        return (
-            doc.metadata.get("source_url", ""),
-            doc.metadata.get("title", ""),
-            doc.page_content[:120]
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap tokenizer-free estimate: words and punctuation marks. Close enough to
+    the qwen3 BPE count for budgeting (slightly under for long words/URLs).
+    """
+    return len(_TOKEN_RE.findall(text or ""))
+
+
+def strip_chunk_header(content: str) -> str:
+    content = (content or "").strip()
+    if content.startswith("Title:"):
+        content = _CHUNK_HEADER_RE.sub("", content, count=1).strip()
+    return content
+
+
+def extract_relevant_span(content: str, query: str, max_tokens: int) -> str:
+    """
+    Keeps the sentences with the highest query-term overlap, in their original
+    order, until max_tokens is reached. Short chunks are returned unchanged.
+    """
+    if estimate_tokens(content) <= max_tokens:
+        return content
+
+    sentences = [x.strip() for x in _SENTENCE_RE.split(content) if x.strip()]
+    query_terms = {t for t in tokenize_for_bm25(query) if len(t) > 2}
+
+    scored = []
+    for idx, sentence in enumerate(sentences):
+        terms = set(tokenize_for_bm25(sentence))
+        overlap = len(query_terms & terms)
+        # Earlier sentences win ties: page intros usually carry the key facts.
+        scored.append((overlap, -idx, idx, sentence))
+
+    scored.sort(reverse=True)
+
+    kept = []
+    used = 0
+    for overlap, _, idx, sentence in scored:
+        cost = estimate_tokens(sentence)
+        if used + cost > max_tokens:
+            if not kept:
+                # A single oversized sentence: hard-cut it at roughly max_tokens.
+                kept.append((idx, " ".join(sentence.split()[:max_tokens]) + " ..."))
+                used = max_tokens
+            continue
+        kept.append((idx, sentence))
+        used += cost
+
+    kept.sort()
+    return " ".join(sentence for _, sentence in kept)
+
+
+def build_context(docs, query: str, token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """
+    Builds the Related Information block for the answer prompt.
+    Returns (info_text, stats) where stats has the token counts for logging.
+    Docs are visited in rank order; budget left unused by short chunks rolls
+    over to the next ones, and docs are dropped once the budget is spent.
+    """
+    info_blocks = []
+    seen_summaries = set()
+    used = 0
+    raw_tokens = 0
+
+    for i, doc in enumerate(docs, start=1):
+        url = doc.metadata.get("source_url", "Unknown source")
+        title = doc.metadata.get("title", "")
+        contextual_summary = (doc.metadata.get("contextual_summary", "") or "").strip()
+        content = strip_chunk_header(doc.page_content)
+        # What the untrimmed block (content + title + phrases + summary) would cost.
+        raw_tokens += estimate_tokens(
+            f"{title} {doc.metadata.get('retrieval_phrases', '')} {contextual_summary} {url} {doc.page_content}"
         )
 
-    for rank, doc in enumerate(chroma_results, start=1):
-        key = doc_key(doc)
-        if key not in fused:
-            fused[key] = {"doc": doc, "score": 0.0}
-        fused[key]["score"] += 0.70 * (1 / rank)
+        header = f"[S{i}]\nTITLE: {title}\nURL: {url}\n"
+        # One summary per source page is enough; later chunks of the same page skip it.
+        if contextual_summary and url not in seen_summaries:
+            seen_summaries.add(url)
+            header += f"SUMMARY: {contextual_summary}\n"
+
+        overhead = estimate_tokens(header) + (estimate_tokens(DOC_SEPARATOR) if info_blocks else 0)
+        remaining = token_budget - used - overhead
+        if remaining < MIN_TOKENS_PER_DOC:
+            break
+
+        docs_left = len(docs) - i + 1
+        doc_budget = max(MIN_TOKENS_PER_DOC, remaining // docs_left)
+        content = extract_relevant_span(content, query, doc_budget)
+
+        block = f"{header}CONTENT:\n{content}"
+        used += estimate_tokens(block) + overhead - estimate_tokens(header)
+        info_blocks.append(block)
+
+    info_text = DOC_SEPARATOR.join(info_blocks)
+    stats = {
+        "docs_in": len(docs),
+        "docs_used": len(info_blocks),
+        "raw_tokens": raw_tokens,
+        "context_tokens": estimate_tokens(info_text),
+    }
+    return info_text, stats
 
-    for rank, doc in enumerate(bm25_results, start=1):
-        key = doc_key(doc)
-        if key not in fused:
-            fused[key] = {"doc": doc, "score": 0.0}
-        fused[key]["score"] += 0.30 * (1 / rank)
 
-    # 4. Add your existing metadata boost
-    for item in fused.values():
-        item["score"] += metadata_boost_score(item["doc"], query)
+def log_prompt_size(prompt, prompt_vars: dict, context_stats: dict) -> None:
+    """Records prompt and context sizes on the request trace (and so on /metrics)."""
+    trace = current_trace()
+    trace.count("prompt_tokens", estimate_tokens(prompt.format(**prompt_vars)))
+    trace.count("context_tokens", context_stats.get("context_tokens", 0))
+    trace.count("raw_context_tokens", context_stats.get("raw_tokens", 0))
+    trace.count("context_docs_used", context_stats.get("docs_used", 0))
+    trace.count("context_docs_in", context_stats.get("docs_in", 0))
 
-    ranked = sorted(
-        fused.values(),
-        key=lambda x: x["score"],
-        reverse=True
-    )
 
-    return [item["doc"] for item in ranked[:k_final]]
+# ----------------------------
+# 6.3) CONVERSATION HISTORY MANAGER
+# ----------------------------
+# History used to be the last MAX_MEMORY_LINES raw lines, pasted in full into both
+# the router and the answer prompt. Long Markdown answers made that the second
+# largest prefill cost after the retrieved context. Now:
+# - each session keeps recent raw lines plus a rolling summary of older turns,
+# - the summary is written by a small model on a background thread, never on
+#   the request path (until it lands, the older lines are simply left out),
+# - the answer prompt gets summary + recent lines within ANSWER_HISTORY_TOKEN_BUDGET,
+# - the router only gets the summary + the last exchange within ROUTER_HISTORY_TOKEN_BUDGET,
+#   which is all it needs to resolve follow-up references.
+
+ANSWER_HISTORY_TOKEN_BUDGET = 700
+ROUTER_HISTORY_TOKEN_BUDGET = 200
+HISTORY_LINE_TOKEN_CAP = 250       # longest single line kept in the answer history
+KEEP_RECENT_LINES = 4              # raw lines never folded into the summary
+SUMMARY_MAX_TOKENS = 160
+SUMMARY_MAX_PENDING = 32           # queued folds across sessions; past this, new folds wait
+
+summary_template = assemble_template("""
+You maintain a short running summary of a conversation between a user and the SPAA chatbot at Rutgers University-Newark.
+Merge the earlier summary and the new conversation lines into one updated summary.
+
+Rules:
+- At most 5 short sentences.
+- Keep the user's goals, programs, dates, names, and facts the user was given.
+- Keep the user's language and stated background if mentioned.
+- Do not add anything that is not in the input.
+- Return only the summary text.
+""", """
+Earlier summary:
+{summary}
+
+New conversation lines:
+{lines}
+
+Updated summary:
+""")
+
+summary_prompt = ChatPromptTemplate.from_template(summary_template)
+summary_chain = summary_prompt | get_llm(
+    STAGE_MODELS["summary"],
+    reasoning=False,
+    temperature=0,
+    num_predict=SUMMARY_MAX_TOKENS
+)
+
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+_history_lock = threading.Lock()
+_pending_summaries = 0   # folds submitted and not finished, guarded by _history_lock
+
+
+def new_history() -> dict:
+    return {"lines": [], "summary": "", "summarizing": False}
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    text = text or ""
+    for count, match in enumerate(_TOKEN_RE.finditer(text), start=1):
+        if count > max_tokens:
+            return text[:match.start()].rstrip() + " ..."
+    return text
+
+
+def render_history(history, token_budget: int, max_lines: int = None, line_cap: int = HISTORY_LINE_TOKEN_CAP) -> str:
+    """
+    Summary first, then the newest lines that fit the budget (oldest dropped first).
+    """
+    if not history:
+        return ""
+
+    with _history_lock:
+        summary = history.get("summary", "")
+        lines = list(history.get("lines", []))
+
+    if max_lines is not None:
+        lines = lines[-max_lines:]
+
+    parts = []
+    used = 0
+    if summary:
+        summary_text = f"Summary of earlier conversation: {summary}"
+        parts.append(summary_text)
+        used += estimate_tokens(summary_text)
+
+    kept = []
+    for line in reversed(lines):
+        line = truncate_to_tokens(line, line_cap)
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            remaining = token_budget - used
+            if remaining > 20 and not kept:
+                # Always give the model at least the head of the latest line.
+                kept.append(truncate_to_tokens(line, remaining))
+            break
+        kept.append(line)
+        used += cost
+
+    parts.extend(reversed(kept))
+    return "\n".join(parts).strip()
+
+
+def summarize_history(history: dict) -> None:
+    """Background job: folds all but the KEEP_RECENT_LINES newest lines into the summary."""
+    global _pending_summaries
+    # The slice is taken when the job runs, not when it was queued: the hard cap
+    # in record_turn may have dropped lines in between.
+    with _history_lock:
+        old_summary = history.get("summary", "")
+        fold_count = max(len(history["lines"]) - KEEP_RECENT_LINES, 0)
+        folded = history["lines"][:fold_count]
+        history["dropped_while_summarizing"] = 0
+
+    if not folded:
+        with _history_lock:
+            history["summarizing"] = False
+            _pending_summaries -= 1
+        return
+
+    try:
+        new_summary = summary_chain.invoke({
+            "summary": old_summary or "(none)",
+            "lines": "\n".join(truncate_to_tokens(line, HISTORY_LINE_TOKEN_CAP) for line in folded)
+        })
+        new_summary = str(new_summary).strip()
+    except Exception as e:
+        print(f"History summarization failed: {repr(e)}")
+        new_summary = None
+
+    with _history_lock:
+        history["summarizing"] = False
+        _pending_summaries -= 1
+        if new_summary is None:
+            return
+        # Lines are only ever appended, so the folded ones are still the oldest,
+        # unless the hard cap already dropped some of them.
+        lines = history["lines"]
+        dropped = history.pop("dropped_while_summarizing", 0)
+        history["lines"] = lines[max(fold_count - dropped, 0):]
+        history["summary"] = new_summary
+
+
+def record_turn(store, session_id: str, question: str, answer: str) -> None:
+    """
+    Appends one exchange and, when the raw lines exceed the answer budget or
+    MAX_MEMORY_LINES, schedules a background summary of all but the most recent
+    lines. At most one fold per session is pending, and at most
+    SUMMARY_MAX_PENDING overall. If summaries fall far behind, the oldest raw
+    lines are dropped.
+    """
+    global _pending_summaries
+    # Re-read the history: the session may have been evicted while this request ran.
+    history = store.get(session_id) or new_history()
+
+    with _history_lock:
+        history["lines"].extend([f"User: {question}", f"Assistant: {answer}"])
+        lines = history["lines"]
+
+        over_budget = (
+            len(lines) > MAX_MEMORY_LINES
+            or sum(estimate_tokens(line) for line in lines) > ANSWER_HISTORY_TOKEN_BUDGET
+        )
+        schedule = (
+            over_budget
+            and len(lines) > KEEP_RECENT_LINES
+            and not history["summarizing"]
+            and _pending_summaries < SUMMARY_MAX_PENDING
+        )
+        if schedule:
+            history["summarizing"] = True
+            _pending_summaries += 1
+
+        hard_cap = 2 * MAX_MEMORY_LINES
+        if len(lines) > hard_cap:
+            drop = len(lines) - hard_cap
+            history["lines"] = lines[drop:]
+            if history["summarizing"]:
+                history["dropped_while_summarizing"] = history.get("dropped_while_summarizing", 0) + drop
+
+    store[session_id] = history
+
+    if schedule:
+        summary_executor.submit(summarize_history, history)
+
 
 # ----------------------------
-# 7) CHAT ENDPOINT
+# 6.4) REQUEST TIMING
 # ----------------------------
-@app.route('/chat', methods=['POST'])
-def chat_endpoint():
-    data = request.get_json() or {}
-    question = (data.get("question") or "").strip()
-    session_id = (data.get("session_id") or "").strip()
+# Each request records per-stage latency (router, retrieval sub-stages, prompt
+# build, answer), estimated token counts and cache hits via request_metrics.
+# They are aggregated into histograms on /metrics; a client can also get its own
+# request's breakdown by sending "include_timings": true.
 
-    if not question or not session_id:
-        return jsonify({"error": "Missing question or session_id"}), 400
+INCLUDE_TIMINGS_IN_RESPONSE = os.environ.get("SPAA_INCLUDE_TIMINGS", "") == "1"
+
+
+def wants_timings(data: dict) -> bool:
+    return INCLUDE_TIMINGS_IN_RESPONSE or bool(data.get("include_timings"))
+
+
+def trace_history(trace, history, history_string: str) -> None:
+    trace.count("history_tokens", estimate_tokens(history_string))
+    # The rolling summary stands in for older turns the prompt no longer carries.
+    if history and history.get("lines"):
+        trace.cache("history_summary", hit=bool(history.get("summary")))
+
+
+# ----------------------------
+# 6.5) NO-RETRIEVAL FAST PATH
+# ----------------------------
+# Turns the router sends without retrieval (greetings, small talk, general
+# writing help) do not need the long answer prompt with its citation, contact
+# and formatting rules. They use a short prompt, no thinking and a small
+# generation cap. Bare greetings / thanks / goodbyes in English skip the models
+# entirely and get a canned reply.
+
+LIGHT_ANSWER_PATH = os.environ.get("SPAA_LIGHT_ANSWER", "1") == "1"
+LIGHT_ANSWER_MAX_TOKENS = 300
+CANNED_REPLIES = os.environ.get("SPAA_CANNED_REPLIES", "1") == "1"
+
+light_answer_static = """
+Your name is SPAA-rkly. You are a friendly assistant for the School of Public Affairs and Administration (SPAA) at Rutgers University-Newark.
+This turn needs no SPAA documents: it is small talk or a general question.
+
+- Reply briefly (1-3 short paragraphs) in a warm, professional tone, in the user language.
+- Do not introduce yourself or state your name.
+- Do not invent SPAA-specific facts (names, dates, requirements, contacts, URLs); if the user needs them, invite them to ask about that topic.
+- If Acknowledgment is not empty, use it once as the first sentence.
+- If the user expresses intent to harm themselves or others, do not help with it; respond calmly and supportively and encourage them to contact a trusted person, local emergency services, or a crisis hotline.
+- Use Markdown only where it helps; no raw HTML.
+"""
+
+light_answer_dynamic = """
+User language: {user_lang_name} ({user_lang}).
+Acknowledgment: {acknowledgment_to_use}.
+
+Conversation History:
+{context}
+
+Question: {question}
+"""
+
+light_answer_template = assemble_template(light_answer_static, light_answer_dynamic)
+light_answer_prompt = ChatPromptTemplate.from_template(light_answer_template)
+light_answer_chain = light_answer_prompt | get_llm(
+    STAGE_MODELS["answer"], reasoning=False, num_predict=LIGHT_ANSWER_MAX_TOKENS
+)
+
+_CANNED_PATTERNS = [
+    ("greeting", re.compile(
+        r"^(hi|hello|hey|hiya|howdy|greetings|good (morning|afternoon|evening))( there)?( spaa-?rkly| spaa)?$"
+    )),
+    ("thanks", re.compile(
+        r"^((ok|okay|great|perfect|awesome|cool|got it) )?"
+        r"(thanks|thank you|thx|ty|many thanks)( so much| very much| a lot| again)?$"
+    )),
+    ("goodbye", re.compile(r"^(bye|bye bye|goodbye|see you|see ya|have a (good|nice|great) (day|one))$")),
+]
+
+CANNED_TEXT = {
+    "greeting": "Hello! I can help with questions about SPAA's programs, admissions, courses, deadlines, and services. What would you like to know?",
+    "thanks": "You're welcome! Feel free to ask if you have any other questions about SPAA.",
+    "goodbye": "Thank you for your interest in SPAA. Have a great day!",
+}
+
+
+def canned_reply(question: str, cached_profile: dict):
+    """(kind, text) for a bare English greeting / thanks / goodbye, else None."""
+    if not CANNED_REPLIES or cached_profile.get("language", "unknown") not in ("unknown", "en"):
+        return None
+    text = re.sub(r"[^\w\s-]", " ", (question or "").lower())
+    text = re.sub(r"\s+", " ", text).strip()
+    for kind, pattern in _CANNED_PATTERNS:
+        if pattern.match(text):
+            return kind, CANNED_TEXT[kind]
+    return None
+
+
+def use_light_answer(turn: dict) -> bool:
+    return LIGHT_ANSWER_PATH and not turn["use_retrieval"]
+
+
+# ----------------------------
+# 7) CHAT PIPELINE AND ENDPOINT
+# ----------------------------
+# The /chat pipeline is split into steps so it can also run in-process, without
+# Flask and JSON over HTTP:
+#   run_chat(question, session_id)      -> the same dict /chat returns
+#   run_chat_batch([(question, session_id), ...])
+#                                       -> one dict per item, in input order
+# run_chat_batch sends the router and answer calls of a whole batch together
+# (up to BATCH_MAX_CONCURRENCY at a time, so Ollama can fill its parallel slots)
+# and embeds all retrieval queries in one call.
+
+BATCH_MAX_CONCURRENCY = 4   # keep at or below OLLAMA_NUM_PARALLEL on the Ollama server
+
+
+def invoke_concurrently(chain, inputs: list, max_concurrency: int) -> list:
+    """
+    chain.invoke over all inputs on up to max_concurrency threads; a failed call
+    returns its exception. (LangChain's LLM .batch() runs prompts one by one.)
+    chain may also be a list with one chain per input.
+    """
+    chains = chain if isinstance(chain, list) else [chain] * len(inputs)
+
+    def call(pair):
+        item_chain, chain_input = pair
+        try:
+            return item_chain.invoke(chain_input)
+        except Exception as e:
+            return e
+
+    pairs = list(zip(chains, inputs))
+    if len(pairs) <= 1:
+        return [call(pair) for pair in pairs]
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="chat-batch") as pool:
+        return list(pool.map(call, pairs))
+
+
+# Router calls from concurrent requests are micro-batched: calls arriving within
+# ROUTER_BATCH_WAIT_MS of each other are sent to Ollama together, at most
+# BATCH_MAX_CONCURRENCY (one per parallel slot) at a time, and identical router
+# inputs are computed once. A lone request waits at most ROUTER_BATCH_WAIT_MS extra.
+ROUTER_MICROBATCH = os.environ.get("SPAA_ROUTER_MICROBATCH", "1") == "1"
+ROUTER_BATCH_WAIT_MS = 5
+
+combined_router_batcher = MicroBatcher(
+    "router",
+    lambda router_vars: combined_chain.invoke(router_vars),
+    max_in_flight=BATCH_MAX_CONCURRENCY,
+    max_wait_ms=ROUTER_BATCH_WAIT_MS
+)
+rag_router_batcher = MicroBatcher(
+    "rag_router",
+    lambda router_vars: rag_router_chain.invoke(router_vars),
+    max_in_flight=BATCH_MAX_CONCURRENCY,
+    max_wait_ms=ROUTER_BATCH_WAIT_MS
+)
+
+
+def invoke_router(chain, batcher, router_vars: dict):
+    if not ROUTER_MICROBATCH:
+        return chain.invoke(router_vars)
+    result, queue_seconds = batcher.submit(router_vars)
+    current_trace().add_stage("router_queue", queue_seconds)
+    return result
 
+
+def prepare_chat_turn(question: str, session_id: str) -> dict:
+    """Step 1: memory, history and router inputs for one /chat turn."""
     # Initialize session memory if new
     if session_id not in conversation_memory:
-        conversation_memory[session_id] = []
+        conversation_memory[session_id] = new_history()
 
     # Save user input
     save_to_csv(session_id, "User", question, search_query="")
 
-    # save retrieval log
-    def save_retrieval_log(
-        session_id: str,
-        question: str,
-        search_query: str,
-        docs
-    ) -> None:
-
-        filename = f"conversation/{session_id}_{date}_retrieval.csv"
-        file_exists = os.path.isfile(filename)
-
-        with open(filename, "a", newline="", encoding="utf-8-sig") as csvfile:
-            writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-
-            if not file_exists:
-                writer.writerow([
-                    "timestamp",
-                    "session_id",
-                    "question",
-                    "search_query",
-                    "rank",
-                    "source_url",
-                    "chunk_preview"
-                ])
-
-            for idx, doc in enumerate(docs, start=1):
-
-                source_url = doc.metadata.get("source_url", "")
-
-                # shorten chunk for CSV readability
-                contextual_summary = doc.metadata.get("contextual_summary", "")
-                preview_text = f"{contextual_summary} {doc.page_content}"
-                preview = preview_text[:500].replace("\n", " ")
-
-                writer.writerow([
-                    datetime.now().isoformat(),
-                    session_id,
-                    question,
-                    search_query,
-                    idx,
-                    source_url,
-                    preview
-                ])
-
-    # Prepare history
-    history_string = "\n".join(conversation_memory[session_id]).strip()
+    # Prepare history: a short one for the router, a longer one for the answer.
+    session_history = conversation_memory.get(session_id)
+    router_history_string = render_history(session_history, ROUTER_HISTORY_TOKEN_BUDGET, max_lines=2, line_cap=ROUTER_HISTORY_TOKEN_BUDGET // 2)
+    history_string = render_history(session_history, ANSWER_HISTORY_TOKEN_BUDGET)
+    trace = current_trace()
+    trace_history(trace, session_history, history_string)
 
     # --- STEP A0/A2: COMBINED LANGUAGE + PERSONA + ROUTER ---
     cached_profile = persona_memory.get(session_id, {
@@ -821,24 +1794,39 @@ def chat_endpoint():
         cached_profile.get("persona", "unknown") == "unknown"
         or question_has_role_signal(question)
     )
+    trace.cache("persona_profile", hit=not should_check_persona_again)
 
-    combined_raw = combined_chain.invoke({
-        "context": history_string,
+    return {
         "question": question,
-        "cached_language": cached_profile.get("language", "unknown"),
-        "cached_language_confidence": cached_profile.get("language_confidence", 0.0),
-        "cached_persona": cached_profile.get("persona", "unknown"),
-        "cached_persona_confidence": cached_profile.get("confidence", 0.0),
-        "should_check_persona_again": should_check_persona_again
-    })
+        "session_id": session_id,
+        # No history and no cached profile: the answer depends only on the question.
+        "stateless": session_id not in persona_memory and not (session_history or {}).get("lines"),
+        "history_string": history_string,
+        "cached_profile": cached_profile,
+        "should_check_persona_again": should_check_persona_again,
+        "router_vars": {
+            "context": router_history_string,
+            "question": question,
+            "cached_language": cached_profile.get("language", "unknown"),
+            "cached_language_confidence": cached_profile.get("language_confidence", 0.0),
+            "cached_persona": cached_profile.get("persona", "unknown"),
+            "cached_persona_confidence": cached_profile.get("confidence", 0.0),
+            "should_check_persona_again": should_check_persona_again
+        }
+    }
+
+
+def apply_chat_router_decision(turn: dict, combined_raw) -> None:
+    """Step 2: language, persona and routing from the combined router output."""
+    session_id = turn["session_id"]
+    cached_profile = turn["cached_profile"]
+    should_check_persona_again = turn["should_check_persona_again"]
 
     combined_result = parse_combined_json(combined_raw)
 
     # Language
     user_lang = normalize_lang(combined_result.get("language", cached_profile.get("language", "en")))
     user_lang_confidence = safe_float(combined_result.get("language_confidence"), cached_profile.get("language_confidence", 0.0))
-    user_lang_name = lang_display(user_lang)
-    language_reason = (combined_result.get("reason") or "").strip()
 
     # Persona
     previous_persona = cached_profile
@@ -868,7 +1856,6 @@ def chat_endpoint():
         use_acknowledgment,
         combined_result.get("acknowledgment", "")
     )
-    persona_reason = (combined_result.get("reason") or "").strip()
 
     first_time_ack = (
         previous_persona.get("persona", "unknown") == "unknown"
@@ -899,86 +1886,172 @@ def chat_endpoint():
     # Routing
     use_retrieval = bool(combined_result.get("use_retrieval", True))
     search_query = (combined_result.get("search_query") or "").strip()
-    router_reason = (combined_result.get("reason") or "").strip()
+    sub_queries = clean_sub_queries(combined_result.get("sub_queries")) if use_retrieval else []
+    reason = (combined_result.get("reason") or "").strip()
 
-    save_to_csv(
+    save_router_decision(
         session_id,
         "AnalysisRouter",
+        {
+            "language": user_lang,
+            "language_confidence": user_lang_confidence,
+            "persona": detected_persona,
+            "persona_confidence": persona_confidence,
+            "should_check_persona_again": should_check_persona_again,
+            "use_retrieval": use_retrieval,
+            "sub_queries": sub_queries,
+            "acknowledgment": acknowledgment_to_use,
+            "reason": combined_result.get("reason", "")
+        },
         f"language={user_lang}; language_confidence={user_lang_confidence}; "
         f"persona={detected_persona}; persona_confidence={persona_confidence}; "
         f"should_check_persona_again={should_check_persona_again}; "
-        f"use_retrieval={use_retrieval}; ack={acknowledgment_to_use}; "
+        f"use_retrieval={use_retrieval}; sub_queries={sub_queries}; ack={acknowledgment_to_use}; "
         f"reason={combined_result.get('reason', '')}",
         search_query=search_query
     )
 
-    # --- STEP A3: RETRIEVAL ---
-    
+    turn.update({
+        "user_lang": user_lang,
+        "user_lang_confidence": user_lang_confidence,
+        "user_lang_name": lang_display(user_lang),
+        "detected_persona": detected_persona,
+        "persona_confidence": persona_confidence,
+        "acknowledgment_to_use": acknowledgment_to_use,
+        "use_retrieval": use_retrieval,
+        "search_query": search_query,
+        "effective_query": search_query if search_query else turn["question"],
+        "sub_queries": sub_queries,
+        "reason": reason
+    })
 
-    docs = []
-    info_text = ""
-    sources = []
 
-    if use_retrieval:
-        effective_query = search_query if search_query else question
-        try:
-            docs = hybrid_retrieve(
+def apply_canned_reply(turn: dict, kind: str) -> None:
+    """Step 2 for a canned greeting / thanks / goodbye: no router, no retrieval."""
+    cached_profile = turn["cached_profile"]
+    persona = cached_profile.get("persona", "unknown")
+    reason = f"canned {kind}"
+
+    save_router_decision(
+        turn["session_id"],
+        "CannedReply",
+        {"language": "en", "persona": persona, "use_retrieval": False, "reason": reason},
+        f"language=en; persona={persona}; use_retrieval=False; reason={reason}"
+    )
+
+    turn.update({
+        "user_lang": "en",
+        "user_lang_confidence": cached_profile.get("language_confidence", 0.0),
+        "user_lang_name": lang_display("en"),
+        "detected_persona": persona,
+        "persona_confidence": cached_profile.get("confidence", 0.0),
+        "acknowledgment_to_use": "",
+        "use_retrieval": False,
+        "search_query": "",
+        "effective_query": turn["question"],
+        "sub_queries": [],
+        "reason": reason,
+        "docs": [],
+        "info_text": "",
+        "context_stats": {},
+        "sources": []
+    })
+    current_trace().increment("answer_path_canned")
+
+
+def retrieve_for_chat_turn(turn: dict, query_embeddings=None) -> None:
+    """
+    Step 3: hybrid retrieval and the token-budgeted context block.
+    query_embeddings, if given, are those of retrieval_queries(effective_query, sub_queries).
+    """
+    turn.update({"docs": [], "info_text": "", "context_stats": {}, "sources": []})
+    if not turn["use_retrieval"]:
+        return
+
+    session_id = turn["session_id"]
+    question = turn["question"]
+    effective_query = turn["effective_query"]
+    trace = current_trace()
+
+    # --- STEP A3: RETRIEVAL ---
+    try:
+        with trace.stage("retrieval"):
+            turn["docs"] = hybrid_retrieve(
                 effective_query,
                 k_final=8,
                 k_chroma=20,
-                k_bm25=20
+                k_bm25=20,
+                sub_queries=turn["sub_queries"],
+                query_embeddings=query_embeddings
             )
 
-            # NEW
-            save_retrieval_log(
-                session_id=session_id,
-                question=question,
-                search_query=effective_query,
-                docs=docs
-            )
-        except Exception as e:
-            save_to_csv(session_id, "System", f"Retriever error: {repr(e)}")
-
-        # --- STEP A4: POST-RETRIEVAL FILTERING ---
-        #removed for accelerating response time. Can be added back if needed for better relevance.
-
-        # Build source-aware context for the answer model.
-        # The LLM can now place source links directly after the supported content.
-        info_blocks = []
-        for i, doc in enumerate(docs, start=1):
-                url = doc.metadata.get("source_url", "Unknown source")
-                title = doc.metadata.get("title", "")
-                content = doc.page_content.strip()
-                phrases = doc.metadata.get("retrieval_phrases", "")
-                contextual_summary = doc.metadata.get("contextual_summary", "")
-
-                info_blocks.append(
-                    f"[S{i}]\n"
-                    f"TITLE: {title}\n"
-                    f"RETRIEVAL_PHRASES: {phrases}\n"
-                    f"CONTEXTUAL_SUMMARY: {contextual_summary}\n"
-                    f"URL: {url}\n"
-                    f"CONTENT:\n{content}"
-                )
-        info_text = "\n\n======= DOCUMENT SEPARATOR =======\n\n".join(info_blocks)
+        # NEW
+        save_retrieval_log(
+            session_id=session_id,
+            question=question,
+            search_query=effective_query,
+            docs=turn["docs"]
+        )
+    except Exception as e:
+        save_to_csv(session_id, "System", f"Retriever error: {repr(e)}")
+
+    # --- STEP A4: POST-RETRIEVAL FILTERING ---
+    #removed for accelerating response time. Can be added back if needed for better relevance.
+
+    # Build source-aware context for the answer model.
+    # The LLM can now place source links directly after the supported content.
+    with trace.stage("prompt_build"):
+        turn["info_text"], turn["context_stats"] = build_context(
+            turn["docs"], " ".join([effective_query, *turn["sub_queries"], question])
+        )
 
-        # Keep unique source URLs in the JSON payload for debugging/logging,
-        # but do not append them to the displayed answer.
-        sources = list(set([doc.metadata.get("source_url", "Unknown source") for doc in docs]))
+    # Keep unique source URLs in the JSON payload for debugging/logging,
+    # but do not append them to the displayed answer.
+    turn["sources"] = list(set([doc.metadata.get("source_url", "Unknown source") for doc in turn["docs"]]))
 
+
+def chat_answer_chain(turn: dict):
+    return light_answer_chain if use_light_answer(turn) else answer_chain
+
+
+def chat_answer_vars(turn: dict) -> dict:
+    """Step 4: answer prompt variables for chat_answer_chain(turn) (also logs the prompt size)."""
     # --- STEP B: GENERATE RESPONSE ---
-    print("ACKNOWLEDGMENT TO USE:", repr(acknowledgment_to_use))
+    print("ACKNOWLEDGMENT TO USE:", repr(turn["acknowledgment_to_use"]))
+
+    if use_light_answer(turn):
+        answer_vars = {
+            "context": turn["history_string"],
+            "question": turn["question"],
+            "user_lang": turn["user_lang"],
+            "user_lang_name": turn["user_lang_name"],
+            "acknowledgment_to_use": turn["acknowledgment_to_use"]
+        }
+        current_trace().increment("answer_path_light")
+        with current_trace().stage("prompt_build"):
+            log_prompt_size(light_answer_prompt, answer_vars, turn["context_stats"])
+        return answer_vars
+
+    answer_vars = {
+        "context": turn["history_string"],
+        "info": turn["info_text"],
+        "question": turn["question"],
+        "user_lang": turn["user_lang"],
+        "user_lang_name": turn["user_lang_name"],
+        "persona": turn["detected_persona"],
+        "persona_confidence": turn["persona_confidence"],
+        "acknowledgment_to_use": turn["acknowledgment_to_use"]
+    }
+    current_trace().increment("answer_path_full")
+    with current_trace().stage("prompt_build"):
+        log_prompt_size(answer_prompt, answer_vars, turn["context_stats"])
+    return answer_vars
 
-    ai_response_text = answer_chain.invoke({
-        "context": history_string,
-        "info": info_text,
-        "question": question,
-        "user_lang": user_lang,
-        "user_lang_name": user_lang_name,
-        "persona": detected_persona,
-        "persona_confidence": persona_confidence,
-        "acknowledgment_to_use": acknowledgment_to_use
-    })
+
+def finish_chat_turn(turn: dict, ai_response_text) -> dict:
+    """Step 5: logging, memory update and the /chat response body."""
+    session_id = turn["session_id"]
+    acknowledgment_to_use = turn["acknowledgment_to_use"]
 
     if not isinstance(ai_response_text, str):
         ai_response_text = str(ai_response_text)
@@ -989,42 +2062,255 @@ def chat_endpoint():
     # --- STEP C: PREPARE DISPLAY ANSWER ---
     # Source links should already be embedded inline by the answer prompt,
     # e.g., [source](https://...). Do not append a final source list.
-    cleaned_sources = sorted(set([s for s in sources if s and s != "Unknown source"]))
+    cleaned_sources = sorted(set([s for s in turn["sources"] if s and s != "Unknown source"]))
     final_display_answer = ai_response_text
 
     # --- STEP D: LOGGING & MEMORY UPDATE ---
-    save_to_csv(session_id, "Assistant", final_display_answer, search_query=search_query)
+    save_to_csv(session_id, "Assistant", final_display_answer, search_query=turn["search_query"])
 
-    conversation_memory[session_id].append(f"User: {question}")
-    conversation_memory[session_id].append(f"Assistant: {ai_response_text}")
+    record_turn(conversation_memory, session_id, turn["question"], ai_response_text)
 
-    if len(conversation_memory[session_id]) > MAX_MEMORY_LINES:
-        conversation_memory[session_id] = conversation_memory[session_id][-MAX_MEMORY_LINES:]
+    current_trace().count("answer_tokens", estimate_tokens(ai_response_text))
 
-    # --- STEP E: SEND RESPONSE ---
-    return jsonify({
+    return {
         "answer": final_display_answer,
         "raw_text": ai_response_text,
         "sources": cleaned_sources,
         "session_id": session_id,
         "language": {
-            "code": user_lang,
-            "name": user_lang_name,
-            "confidence": user_lang_confidence,
-            "reason": language_reason
+            "code": turn["user_lang"],
+            "name": turn["user_lang_name"],
+            "confidence": turn["user_lang_confidence"],
+            "reason": turn["reason"]
         },
         "persona": {
-            "label": detected_persona,
-            "confidence": persona_confidence,
+            "label": turn["detected_persona"],
+            "confidence": turn["persona_confidence"],
             "acknowledgment_used": acknowledgment_to_use,
-            "reason": persona_reason
+            "reason": turn["reason"]
         },
         "routing": {
-            "use_retrieval": use_retrieval,
-            "search_query": search_query,
-            "reason": router_reason
+            "use_retrieval": turn["use_retrieval"],
+            "search_query": turn["search_query"],
+            "sub_queries": turn["sub_queries"],
+            "reason": turn["reason"]
         }
-    })
+    }
+
+
+# Identical first-turn questions sent at the same moment (a class or orientation
+# session) share one retrieval + answer generation. Only stateless first turns
+# are coalesced, keyed by the normalized question and the router's language,
+# persona and retrieval query; the result is not cached after it is delivered.
+SINGLE_FLIGHT = os.environ.get("SPAA_SINGLE_FLIGHT", "1") == "1"
+
+answer_flight = SingleFlight("chat_answer")
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", (question or "").lower()).strip(" ?!.")
+
+
+def single_flight_key(turn: dict):
+    if not SINGLE_FLIGHT or not turn["stateless"]:
+        return None
+    return (
+        normalize_question(turn["question"]),
+        turn["user_lang"],
+        turn["detected_persona"],
+        turn["effective_query"] if turn["use_retrieval"] else "",
+        tuple(turn["sub_queries"])
+    )
+
+
+def generate_chat_answer(turn: dict) -> dict:
+    """Steps 3-4: retrieval and answer generation; returns what a duplicate can reuse."""
+    retrieve_for_chat_turn(turn)
+
+    answer_vars = chat_answer_vars(turn)
+    with current_trace().stage("answer"):
+        ai_response_text = chat_answer_chain(turn).invoke(answer_vars)
+
+    return {
+        "docs": turn["docs"],
+        "info_text": turn["info_text"],
+        "context_stats": turn["context_stats"],
+        "sources": turn["sources"],
+        "acknowledgment_to_use": turn["acknowledgment_to_use"],
+        "ai_response_text": ai_response_text
+    }
+
+
+MISSING_INPUT_ERROR = "Missing question or session_id"
+
+
+def run_chat(question: str, session_id: str, include_timings: bool = False) -> dict:
+    """
+    The full /chat pipeline for one question, without Flask.
+    A blank question or session_id returns {"error": ...} as /chat does.
+    """
+    question = (question or "").strip()
+    session_id = (session_id or "").strip()
+    if not question or not session_id:
+        return {"error": MISSING_INPUT_ERROR, "session_id": session_id}
+
+    trace = start_trace("chat")
+    try:
+        turn = prepare_chat_turn(question, session_id)
+
+        canned = canned_reply(question, turn["cached_profile"])
+        if canned is not None:
+            apply_canned_reply(turn, canned[0])
+            result = finish_chat_turn(turn, canned[1])
+            timings = trace.finish()
+            if include_timings:
+                result["timings"] = timings
+            return result
+
+        with trace.stage("router"):
+            combined_raw = invoke_router(combined_chain, combined_router_batcher, turn["router_vars"])
+        apply_chat_router_decision(turn, combined_raw)
+
+        key = single_flight_key(turn)
+        if key is None:
+            answer = generate_chat_answer(turn)
+        else:
+            with trace.stage("single_flight"):
+                answer, shared = answer_flight.do(key, lambda: generate_chat_answer(turn))
+            trace.cache("single_flight", hit=shared)
+            if shared:
+                # Reuse the other request's work, but keep this session's logs complete.
+                turn.update({k: v for k, v in answer.items() if k != "ai_response_text"})
+                # chat_answer_vars did not run for this turn, so count its path here.
+                trace.increment("answer_path_light" if use_light_answer(turn) else "answer_path_full")
+                if turn["use_retrieval"]:
+                    save_retrieval_log(
+                        session_id=session_id,
+                        question=question,
+                        search_query=turn["effective_query"],
+                        docs=turn["docs"]
+                    )
+
+        result = finish_chat_turn(turn, answer["ai_response_text"])
+
+        timings = trace.finish()
+        if include_timings:
+            result["timings"] = timings
+        return result
+    finally:
+        trace.discard()
+
+
+def batch_rounds(items) -> list:
+    """
+    Splits item indexes into rounds in which every session_id appears at most
+    once, so follow-up questions of one session still see the earlier answer.
+    """
+    rounds = []
+    next_round = {}
+    for index, (_, session_id) in enumerate(items):
+        position = next_round.get(session_id, 0)
+        if position == len(rounds):
+            rounds.append([])
+        rounds[position].append(index)
+        next_round[session_id] = position + 1
+    return rounds
+
+
+def run_chat_batch(items, max_concurrency: int = BATCH_MAX_CONCURRENCY) -> list:
+    """
+    The /chat pipeline for many (question, session_id) pairs at once.
+    Router calls, query embeddings and answer calls are each sent as one group;
+    a failed router call falls back to retrieval (as parse_combined_json does),
+    a failed answer call yields {"error": ..., "session_id": ...} for that item.
+    Items with a blank question or session_id get {"error": ...} as /chat gives;
+    they are not sent to the models and do not share a session.
+    """
+    items = [((question or "").strip(), (session_id or "").strip()) for question, session_id in items]
+    results = [None] * len(items)
+
+    valid = []
+    for index, (question, session_id) in enumerate(items):
+        if question and session_id:
+            valid.append(index)
+        else:
+            results[index] = {"error": MISSING_INPUT_ERROR, "session_id": session_id}
+
+    for positions in batch_rounds([items[index] for index in valid]):
+        indexes = [valid[position] for position in positions]
+        trace = start_trace("chat_batch")
+        try:
+            round_size = len(indexes)
+            turns = []
+            for index in indexes:
+                turn = prepare_chat_turn(*items[index])
+                canned = canned_reply(turn["question"], turn["cached_profile"])
+                if canned is None:
+                    turns.append(turn)
+                    continue
+                apply_canned_reply(turn, canned[0])
+                results[index] = finish_chat_turn(turn, canned[1])
+            indexes = [index for index in indexes if results[index] is None]
+
+            with trace.stage("router"):
+                router_outputs = invoke_concurrently(
+                    combined_chain, [turn["router_vars"] for turn in turns], max_concurrency
+                )
+            for turn, combined_raw in zip(turns, router_outputs):
+                apply_chat_router_decision(turn, "" if isinstance(combined_raw, Exception) else combined_raw)
+
+            # One embedding call for every query (and sub-query) in the round.
+            retrieving = [turn for turn in turns if turn["use_retrieval"]]
+            turn_queries = [retrieval_queries(turn["effective_query"], turn["sub_queries"]) for turn in retrieving]
+            query_embeddings = [None] * len(retrieving)
+            if retrieving:
+                try:
+                    with trace.stage("embed_query"):
+                        flat = embeddings.embed_documents([q for queries in turn_queries for q in queries])
+                    query_embeddings, start = [], 0
+                    for queries in turn_queries:
+                        query_embeddings.append(flat[start:start + len(queries)])
+                        start += len(queries)
+                except Exception as e:
+                    print(f"Batch query embedding failed, embedding per query: {repr(e)}")
+            for turn, turn_embeddings in zip(retrieving, query_embeddings):
+                retrieve_for_chat_turn(turn, query_embeddings=turn_embeddings)
+            for turn in turns:
+                if not turn["use_retrieval"]:
+                    retrieve_for_chat_turn(turn)
+
+            answer_vars = [chat_answer_vars(turn) for turn in turns]
+            with trace.stage("answer"):
+                answers = invoke_concurrently(
+                    [chat_answer_chain(turn) for turn in turns], answer_vars, max_concurrency
+                )
+
+            for index, turn, answer in zip(indexes, turns, answers):
+                if isinstance(answer, Exception):
+                    save_to_csv(turn["session_id"], "System", f"Answer error: {repr(answer)}")
+                    results[index] = {"error": repr(answer), "session_id": turn["session_id"]}
+                else:
+                    results[index] = finish_chat_turn(turn, answer)
+
+            trace.count("batch_size", round_size)
+            trace.finish()
+        finally:
+            trace.discard()
+
+    return results
+
+
+@app.route('/chat', methods=['POST'])
+def chat_endpoint():
+    data = request.get_json() or {}
+    question = (data.get("question") or "").strip()
+    session_id = (data.get("session_id") or "").strip()
+
+    if not question or not session_id:
+        return jsonify({"error": MISSING_INPUT_ERROR}), 400
+
+    # --- STEP E: SEND RESPONSE ---
+    return jsonify(run_chat(question, session_id, include_timings=wants_timings(data)))
 
 
 
@@ -1038,166 +2324,242 @@ def chat_rag_endpoint():
     session_id = (data.get("session_id") or "").strip()
 
     if not question or not session_id:
-        return jsonify({"error": "Missing question or session_id"}), 400
-
-    # Keep RAG-only memory separate from the persona-enabled endpoint.
-    rag_session_id = f"rag_{session_id}"
-
-    if rag_session_id not in rag_conversation_memory:
-        rag_conversation_memory[rag_session_id] = []
-
-    save_to_csv(rag_session_id, "User", question, search_query="")
-
-    def save_rag_retrieval_log(
-        session_id: str,
-        question: str,
-        search_query: str,
-        docs
-    ) -> None:
-        filename = f"conversation/{session_id}_{date}_retrieval.csv"
-        file_exists = os.path.isfile(filename)
-
-        with open(filename, "a", newline="", encoding="utf-8-sig") as csvfile:
-            writer = csv.writer(csvfile, quoting=csv.QUOTE_ALL)
-
-            if not file_exists:
-                writer.writerow([
-                    "timestamp",
-                    "session_id",
-                    "endpoint",
-                    "question",
-                    "search_query",
-                    "rank",
-                    "source_url",
-                    "chunk_preview"
-                ])
-
-            for idx, doc in enumerate(docs, start=1):
-                source_url = doc.metadata.get("source_url", "")
-                contextual_summary = doc.metadata.get("contextual_summary", "")
-                preview_text = f"{contextual_summary} {doc.page_content}"
-                preview = preview_text[:500].replace("\n", " ")
-
-                writer.writerow([
-                    datetime.now().isoformat(),
-                    session_id,
-                    "chat_rag",
-                    question,
-                    search_query,
-                    idx,
-                    source_url,
-                    preview
-                ])
-
-    history_string = "\n".join(rag_conversation_memory[rag_session_id]).strip()
-
-    # --- STEP A: LANGUAGE + ROUTING ONLY; NO PERSONA ---
-    router_raw = rag_router_chain.invoke({
-        "context": history_string,
-        "question": question
-    })
+        return jsonify({"error": MISSING_INPUT_ERROR}), 400
 
-    router_result = parse_combined_json(router_raw)
+    trace = start_trace("chat_rag")
+    try:
+        # Keep RAG-only memory separate from the persona-enabled endpoint.
+        rag_session_id = f"rag_{session_id}"
+
+        if rag_session_id not in rag_conversation_memory:
+            rag_conversation_memory[rag_session_id] = new_history()
+
+        save_to_csv(rag_session_id, "User", question, search_query="")
+
+        session_history = rag_conversation_memory.get(rag_session_id)
+        router_history_string = render_history(session_history, ROUTER_HISTORY_TOKEN_BUDGET, max_lines=2, line_cap=ROUTER_HISTORY_TOKEN_BUDGET // 2)
+        history_string = render_history(session_history, ANSWER_HISTORY_TOKEN_BUDGET)
+        trace_history(trace, session_history, history_string)
+
+        # --- STEP A: LANGUAGE + ROUTING ONLY; NO PERSONA ---
+        with trace.stage("router"):
+            router_raw = invoke_router(rag_router_chain, rag_router_batcher, {
+                "context": router_history_string,
+                "question": question
+            })
+
+        router_result = parse_combined_json(router_raw)
+
+        user_lang = normalize_lang(router_result.get("language", "en"))
+        user_lang_confidence = safe_float(router_result.get("language_confidence"), 0.0)
+        user_lang_name = lang_display(user_lang)
+        use_retrieval = bool(router_result.get("use_retrieval", True))
+        search_query = (router_result.get("search_query") or "").strip()
+        sub_queries = clean_sub_queries(router_result.get("sub_queries")) if use_retrieval else []
+        router_reason = (router_result.get("reason") or "").strip()
+
+        save_router_decision(
+            rag_session_id,
+            "RAGOnlyRouter",
+            {
+                "language": user_lang,
+                "language_confidence": user_lang_confidence,
+                "use_retrieval": use_retrieval,
+                "sub_queries": sub_queries,
+                "reason": router_reason
+            },
+            f"language={user_lang}; language_confidence={user_lang_confidence}; "
+            f"use_retrieval={use_retrieval}; sub_queries={sub_queries}; reason={router_reason}",
+            search_query=search_query
+        )
 
-    user_lang = normalize_lang(router_result.get("language", "en"))
-    user_lang_confidence = safe_float(router_result.get("language_confidence"), 0.0)
-    user_lang_name = lang_display(user_lang)
-    use_retrieval = bool(router_result.get("use_retrieval", True))
-    search_query = (router_result.get("search_query") or "").strip()
-    router_reason = (router_result.get("reason") or "").strip()
+        # --- STEP B: RETRIEVAL USING THE SAME VECTOR DB + BM25 INDEX ---
+        docs = []
+        info_text = ""
+        context_stats = {}
+        sources = []
+
+        if use_retrieval:
+            effective_query = search_query if search_query else question
+            try:
+                with trace.stage("retrieval"):
+                    docs = hybrid_retrieve(
+                        effective_query,
+                        k_final=8,
+                        k_chroma=20,
+                        k_bm25=20,
+                        sub_queries=sub_queries
+                    )
+
+                save_retrieval_log(
+                    session_id=rag_session_id,
+                    question=question,
+                    search_query=effective_query,
+                    docs=docs,
+                    endpoint="chat_rag"
+                )
+            except Exception as e:
+                save_to_csv(rag_session_id, "System", f"Retriever error: {repr(e)}")
+
+            with trace.stage("prompt_build"):
+                info_text, context_stats = build_context(docs, " ".join([effective_query, *sub_queries, question]))
+            sources = list(set([doc.metadata.get("source_url", "Unknown source") for doc in docs]))
+
+        # --- STEP C: RAG-ONLY RESPONSE GENERATION ---
+        rag_answer_vars = {
+            "context": history_string,
+            "info": info_text,
+            "question": question,
+            "user_lang": user_lang,
+            "user_lang_name": user_lang_name
+        }
+        with trace.stage("prompt_build"):
+            log_prompt_size(rag_answer_prompt, rag_answer_vars, context_stats)
+
+        with trace.stage("answer"):
+            ai_response_text = rag_answer_chain.invoke(rag_answer_vars)
+
+        if not isinstance(ai_response_text, str):
+            ai_response_text = str(ai_response_text)
+
+        cleaned_sources = sorted(set([s for s in sources if s and s != "Unknown source"]))
+        final_display_answer = ai_response_text
+
+        save_to_csv(rag_session_id, "Assistant", final_display_answer, search_query=search_query)
+
+        record_turn(rag_conversation_memory, rag_session_id, question, ai_response_text)
+
+        trace.count("answer_tokens", estimate_tokens(ai_response_text))
+        timings = trace.finish()
+
+        response = {
+            "answer": final_display_answer,
+            "raw_text": ai_response_text,
+            "sources": cleaned_sources,
+            "session_id": session_id,
+            "endpoint": "chat_rag",
+            "language": {
+                "code": user_lang,
+                "name": user_lang_name,
+                "confidence": user_lang_confidence
+            },
+            "routing": {
+                "use_retrieval": use_retrieval,
+                "search_query": search_query,
+                "sub_queries": sub_queries,
+                "reason": router_reason
+            }
+        }
+        if wants_timings(data):
+            response["timings"] = timings
+        return jsonify(response)
+    finally:
+        trace.discard()
 
-    save_to_csv(
-        rag_session_id,
-        "RAGOnlyRouter",
-        f"language={user_lang}; language_confidence={user_lang_confidence}; "
-        f"use_retrieval={use_retrieval}; reason={router_reason}",
-        search_query=search_query
+
+# ----------------------------
+# 7.2) MODEL WARM-UP AND KEEP-ALIVE
+# ----------------------------
+# Loading the stage models and nomic-embed-text on the first request (or after
+# Ollama unloads them when idle) adds seconds to that request. A background thread
+# preloads every model at startup and re-pings them well inside OLLAMA_KEEP_ALIVE
+# so they stay resident through quiet periods.
+
+KEEPALIVE_PING_SECONDS = 600   # must stay below OLLAMA_KEEP_ALIVE
+OLLAMA_STATUS_TIMEOUT_SECONDS = 2
+
+# Pings may wait minutes for a model to load; /health uses its own client with a
+# short timeout so a busy or stalled Ollama cannot hang the probe.
+ollama_client = OllamaClient(host=model.base_url)
+ollama_status_client = OllamaClient(host=model.base_url, timeout=OLLAMA_STATUS_TIMEOUT_SECONDS)
+
+# model name -> {"last_ping": iso time, "last_ping_seconds": float, "error": str}
+model_warmup_state = {}
+_warmup_thread = None
+
+
+def ping_llm(model_name: str) -> None:
+    # An empty prompt loads the model without generating anything. num_ctx must
+    # match the chains' setting, otherwise the first real request reloads it.
+    ollama_client.generate(
+        model=model_name,
+        prompt="",
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        options={"num_ctx": OLLAMA_NUM_CTX}
     )
 
-    # --- STEP B: RETRIEVAL USING THE SAME VECTOR DB + BM25 INDEX ---
-    docs = []
-    info_text = ""
-    sources = []
 
-    if use_retrieval:
-        effective_query = search_query if search_query else question
-        try:
-            docs = hybrid_retrieve(
-                effective_query,
-                k_final=8,
-                k_chroma=20,
-                k_bm25=20
-            )
+def ping_embeddings(model_name: str) -> None:
+    ollama_client.embed(
+        model=model_name,
+        input="warm up",
+        keep_alive=OLLAMA_KEEP_ALIVE
+    )
 
-            save_rag_retrieval_log(
-                session_id=rag_session_id,
-                question=question,
-                search_query=effective_query,
-                docs=docs
-            )
+
+def warm_up_models() -> None:
+    targets = [(name, ping_llm) for name in sorted(set(STAGE_MODELS.values()))]
+    targets.append((embeddings.model, ping_embeddings))
+
+    for name, ping in targets:
+        start = time.perf_counter()
+        try:
+            ping(name)
+            error = ""
         except Exception as e:
-            save_to_csv(rag_session_id, "System", f"Retriever error: {repr(e)}")
-
-        info_blocks = []
-        for i, doc in enumerate(docs, start=1):
-            url = doc.metadata.get("source_url", "Unknown source")
-            title = doc.metadata.get("title", "")
-            content = doc.page_content.strip()
-            phrases = doc.metadata.get("retrieval_phrases", "")
-            contextual_summary = doc.metadata.get("contextual_summary", "")
-
-            info_blocks.append(
-                f"[S{i}]\n"
-                f"TITLE: {title}\n"
-                f"RETRIEVAL_PHRASES: {phrases}\n"
-                f"CONTEXTUAL_SUMMARY: {contextual_summary}\n"
-                f"URL: {url}\n"
-                f"CONTENT:\n{content}"
-            )
+            error = repr(e)
+        model_warmup_state[name] = {
+            "last_ping": datetime.now().isoformat(),
+            "last_ping_seconds": round(time.perf_counter() - start, 3),
+            "error": error
+        }
+        if error:
+            print(f"Model warm-up failed for {name}: {error}")
 
-        info_text = "\n\n======= DOCUMENT SEPARATOR =======\n\n".join(info_blocks)
-        sources = list(set([doc.metadata.get("source_url", "Unknown source") for doc in docs]))
 
-    # --- STEP C: RAG-ONLY RESPONSE GENERATION ---
-    ai_response_text = rag_answer_chain.invoke({
-        "context": history_string,
-        "info": info_text,
-        "question": question,
-        "user_lang": user_lang,
-        "user_lang_name": user_lang_name
-    })
+def keep_models_warm() -> None:
+    while True:
+        warm_up_models()
+        time.sleep(KEEPALIVE_PING_SECONDS)
 
-    if not isinstance(ai_response_text, str):
-        ai_response_text = str(ai_response_text)
 
-    cleaned_sources = sorted(set([s for s in sources if s and s != "Unknown source"]))
-    final_display_answer = ai_response_text
+def start_model_warmup() -> None:
+    global _warmup_thread
+    if _warmup_thread is not None and _warmup_thread.is_alive():
+        return
+    print("Warming up Ollama models in the background...")
+    _warmup_thread = threading.Thread(target=keep_models_warm, name="model-keepalive", daemon=True)
+    _warmup_thread.start()
 
-    save_to_csv(rag_session_id, "Assistant", final_display_answer, search_query=search_query)
 
-    rag_conversation_memory[rag_session_id].append(f"User: {question}")
-    rag_conversation_memory[rag_session_id].append(f"Assistant: {ai_response_text}")
+def model_residency() -> dict:
+    """
+    Reports which of our models Ollama currently holds in memory (via /api/ps),
+    merged with the last warm-up ping result for each model.
+    """
+    wanted = set(STAGE_MODELS.values()) | {embeddings.model}
+    report = {
+        name: {"resident": False, **model_warmup_state.get(name, {})}
+        for name in wanted
+    }
 
-    if len(rag_conversation_memory[rag_session_id]) > MAX_MEMORY_LINES:
-        rag_conversation_memory[rag_session_id] = rag_conversation_memory[rag_session_id][-MAX_MEMORY_LINES:]
+    try:
+        running = ollama_status_client.ps().models
+    except Exception as e:
+        return {"ollama_error": repr(e), "models": report}
 
-    return jsonify({
-        "answer": final_display_answer,
-        "raw_text": ai_response_text,
-        "sources": cleaned_sources,
-        "session_id": session_id,
-        "endpoint": "chat_rag",
-        "language": {
-            "code": user_lang,
-            "name": user_lang_name,
-            "confidence": user_lang_confidence
-        },
-        "routing": {
-            "use_retrieval": use_retrieval,
-            "search_query": search_query,
-            "reason": router_reason
-        }
-    })
+    for item in running:
+        # /api/ps names include the tag, e.g. "qwen3:latest"
+        running_name = item.model or item.name or ""
+        name = running_name[:-len(":latest")] if running_name.endswith(":latest") else running_name
+        if name in report:
+            report[name].update({
+                "resident": True,
+                "expires_at": item.expires_at.isoformat() if item.expires_at else "",
+                "size_vram": item.size_vram
+            })
+
+    return {"models": report}
 
 
 # ----------------------------
@@ -1205,8 +2567,42 @@ def chat_rag_endpoint():
 # ----------------------------
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "ok"}), 200
+    return jsonify({
+        "status": "ok",
+        **model_residency(),
+        "sessions": {
+            store.name: store.stats()
+            for store in (conversation_memory, rag_conversation_memory, persona_memory)
+        },
+        "router_batching": {
+            batcher.name: batcher.stats()
+            for batcher in (combined_router_batcher, rag_router_batcher)
+        },
+        "single_flight": answer_flight.stats(),
+        "reranker": reranker.stats() if reranker is not None else None,
+        "vector_index": (
+            {
+                "backend": "numpy",
+                "dtype": dense_index.dtype,
+                "rows": len(dense_index),
+                "bytes": dense_index.nbytes,
+                "rescore_dtype": dense_index.rescore_index.dtype if dense_index.rescore_index is not None else None,
+            }
+            if dense_index is not None
+            else {"backend": "chroma_hnsw", **chroma_hnsw_config()}
+        )
+    }), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return metrics_registry.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    DEBUG = True
+    # With the debug reloader the script runs twice: in a watcher process and in
+    # the serving child (WERKZEUG_RUN_MAIN=true). Only the child pings the models.
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_model_warmup()
+    app.run(host='0.0.0.0', port=5000, debug=DEBUG)
\ No newline at end of file
@@ -0,0 +1,192 @@
+# micro_batcher.py
+# Coalescing of work requested by concurrent requests:
+# - MicroBatcher: micro-batching for model calls,
+# - SingleFlight: identical in-flight computations run once and share the result.
+#
+# MicroBatcher: each request thread calls batcher.submit(item) and blocks for its own result.
+# A dispatcher thread collects items arriving within max_wait_ms and sends them
+# to the model together, keeping at most max_in_flight calls running (set it to
+# the number of Ollama parallel slots). Identical items, whether queued together
+# or already running, are computed once and share the result.
+#
+# Ollama has no multi-prompt generate call, so "together" means the group is
+# sent concurrently: the prompts land in Ollama's parallel slots at the same
+# time and are decoded in the same llama.cpp batch, instead of every Flask
+# thread racing for a slot on its own.
+
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def default_key(item) -> str:
+    return json.dumps(item, sort_keys=True, default=str)
+
+
+class _Call:
+    __slots__ = ("item", "key", "future", "submitted_at", "dispatched_at")
+
+    def __init__(self, item, key):
+        self.item = item
+        self.key = key
+        self.future = Future()
+        self.submitted_at = time.perf_counter()
+        self.dispatched_at = None
+
+
+class MicroBatcher:
+    """
+    call_fn(item) computes one result; exceptions are raised in the caller(s).
+    """
+
+    def __init__(self, name: str, call_fn, max_in_flight: int = 4, max_wait_ms: float = 5.0, key_fn=default_key):
+        self.name = name
+        self.call_fn = call_fn
+        self.max_in_flight = max_in_flight
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.key_fn = key_fn
+
+        self._queue = []          # _Call objects waiting for dispatch
+        self._running = {}        # key -> _Call currently being computed
+        self._cond = threading.Condition()
+        self._thread = None
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix=f"microbatch-{name}")
+
+        self.batches = 0
+        self.calls = 0
+        self.items = 0
+        self.deduplicated = 0
+
+    def _ensure_started(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._dispatch_loop, name=f"microbatch-{self.name}", daemon=True)
+            self._thread.start()
+
+    def submit(self, item):
+        """Blocks until the item is computed; returns (result, queue_seconds)."""
+        key = self.key_fn(item) if self.key_fn else None
+        submitted_at = time.perf_counter()
+
+        with self._cond:
+            self.items += 1
+            shared = self._running.get(key) if key is not None else None
+            if shared is None and key is not None:
+                shared = next((call for call in self._queue if call.key == key), None)
+            if shared is not None:
+                self.deduplicated += 1
+                call = shared
+            else:
+                call = _Call(item, key)
+                self._ensure_started()
+                self._queue.append(call)
+                self._cond.notify_all()
+
+        try:
+            result = call.future.result()
+        finally:
+            queue_seconds = max((call.dispatched_at or submitted_at) - submitted_at, 0.0)
+        return result, queue_seconds
+
+    def _take_group(self) -> list:
+        with self._cond:
+            while not self._queue or len(self._running) >= self.max_in_flight:
+                self._cond.wait()
+            # Give companions until the oldest queued call has waited max_wait_seconds,
+            # unless the free slots are already filled.
+            deadline = self._queue[0].submitted_at + self.max_wait_seconds
+            while len(self._queue) < self.max_in_flight - len(self._running):
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            free = self.max_in_flight - len(self._running)
+            group = self._queue[:free]
+            del self._queue[:free]
+
+            now = time.perf_counter()
+            for call in group:
+                call.dispatched_at = now
+                self._running[call.key if call.key is not None else id(call)] = call
+            self.batches += 1
+            self.calls += len(group)
+            return group
+
+    def _run_call(self, call: _Call) -> None:
+        try:
+            call.future.set_result(self.call_fn(call.item))
+        except Exception as e:
+            call.future.set_exception(e)
+        finally:
+            with self._cond:
+                self._running.pop(call.key if call.key is not None else id(call), None)
+                self._cond.notify_all()
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            for call in self._take_group():
+                self._executor.submit(self._run_call, call)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "items": self.items,
+                "model_calls": self.calls,
+                "deduplicated": self.deduplicated,
+                "batches": self.batches,
+                "mean_batch_size": round(self.calls / self.batches, 2) if self.batches else 0.0,
+                "queued": len(self._queue),
+                "in_flight": len(self._running),
+                "max_in_flight": self.max_in_flight,
+                "max_wait_ms": self.max_wait_seconds * 1000,
+            }
+
+
+class SingleFlight:
+    """
+    do(key, fn): the first caller for a key runs fn(); callers arriving with the
+    same key while it runs wait for it and get the same result (or exception).
+    Nothing is cached after the call finishes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight = {}   # key -> Future
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Returns (result, shared) where shared is True for waiting callers."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "computed": self.leaders,
+                "shared": self.shared,
+                "in_flight": len(self._in_flight),
+            }
@@ -0,0 +1,222 @@
+# request_metrics.py
+# Per-request stage timing and Prometheus-style metrics for the chatbot server.
+#
+# Usage inside a request:
+#   trace = start_trace("chat")
+#   with trace.stage("router"):
+#       ...
+#   trace.count("prompt_tokens", 1234)
+#   trace.increment("answer_path_light")
+#   trace.cache("history_summary", hit=True)
+#   trace.finish()             # aggregates into the histograms served on /metrics
+# Call trace.discard() in a finally block so a request that raises does not
+# leave its trace current on the thread.
+#
+# Code deeper in the call stack (e.g. hybrid_retrieve) can record sub-stages
+# with current_trace().stage(...) without passing the trace around; outside a
+# request current_trace() returns a no-op trace.
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ------------------------
+# SETTINGS
+# ------------------------
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+TOKEN_BUCKETS = [50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000]
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Thread-safe store of histograms and counters, rendered as Prometheus text."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}    # (name, labels) -> int
+        self._help = {}
+
+    def observe(self, name: str, labels: dict, value: float, buckets, help_text: str = "") -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+            if help_text:
+                self._help[name] = help_text
+
+    def inc(self, name: str, labels: dict, amount: int = 1, help_text: str = "") -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if help_text:
+                self._help[name] = help_text
+
+    @staticmethod
+    def _labels(pairs, extra: str = "") -> str:
+        items = [f'{k}="{v}"' for k, v in pairs]
+        if extra:
+            items.append(extra)
+        return "{" + ",".join(items) + "}" if items else ""
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), hist in sorted(self._histograms.items()):
+                if name not in seen:
+                    seen.add(name)
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} histogram")
+                for bound, count in zip(hist.buckets, hist.counts):
+                    le = 'le="%s"' % bound
+                    lines.append(f"{name}_bucket{self._labels(labels, le)} {count}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{self._labels(labels, le)} {hist.total}")
+                lines.append(f"{name}_sum{self._labels(labels)} {hist.sum:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {hist.total}")
+
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    seen.add(name)
+                    if name in self._help:
+                        lines.append(f"# HELP {name} {self._help[name]}")
+                    lines.append(f"# TYPE {name} counter")
+                lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class RequestTrace:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}   # stage -> seconds (summed if a stage runs more than once)
+        self.counts = {}   # name -> number
+        self.caches = {}   # cache name -> "hit" / "miss"
+        self._token = None
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start)
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        """Records a duration measured elsewhere (e.g. time spent queued)."""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, value) -> None:
+        self.counts[name] = value
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """Adds to a count, e.g. once per item of a batch request."""
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def cache(self, name: str, hit: bool) -> None:
+        self.caches[name] = "hit" if hit else "miss"
+
+    def as_dict(self) -> dict:
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages_ms": {name: round(sec * 1000, 1) for name, sec in self.stages.items()},
+            "counts": dict(self.counts),
+            "cache": dict(self.caches),
+        }
+
+    def finish(self) -> dict:
+        total = time.perf_counter() - self.started
+        labels = {"endpoint": self.endpoint}
+
+        registry.inc("spaa_requests_total", labels, help_text="Completed chat requests.")
+        registry.observe(
+            "spaa_request_duration_seconds", labels, total, DURATION_BUCKETS,
+            help_text="End-to-end request latency."
+        )
+        for name, seconds in self.stages.items():
+            registry.observe(
+                "spaa_stage_duration_seconds", {**labels, "stage": name}, seconds, DURATION_BUCKETS,
+                help_text="Latency of each pipeline stage."
+            )
+        for name, value in self.counts.items():
+            if isinstance(value, (int, float)) and name.endswith("_tokens"):
+                registry.observe(
+                    "spaa_tokens", {**labels, "kind": name}, value, TOKEN_BUCKETS,
+                    help_text="Estimated token counts per request."
+                )
+            elif isinstance(value, (int, float)) and name.startswith("answer_path_"):
+                registry.inc(
+                    "spaa_answer_paths_total", {**labels, "path": name[len("answer_path_"):]}, value,
+                    help_text="Answers per answer path (canned, light, full)."
+                )
+        for name, result in self.caches.items():
+            registry.inc(
+                "spaa_cache_events_total", {**labels, "cache": name, "result": result},
+                help_text="Cache hits and misses."
+            )
+
+        self.discard()
+        return self.as_dict()
+
+    def discard(self) -> None:
+        """Stops being the current trace without recording anything; a no-op after finish()."""
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+
+
+class _NoopTrace(RequestTrace):
+    def __init__(self):
+        super().__init__("none")
+
+    @contextmanager
+    def stage(self, name: str):
+        yield
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        pass
+
+    def count(self, name: str, value) -> None:
+        pass
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        pass
+
+    def cache(self, name: str, hit: bool) -> None:
+        pass
+
+
+_NOOP = _NoopTrace()
+_current = contextvars.ContextVar("spaa_request_trace", default=_NOOP)
+
+
+def start_trace(endpoint: str) -> RequestTrace:
+    trace = RequestTrace(endpoint)
+    trace._token = _current.set(trace)
+    return trace
+
+
+def current_trace() -> RequestTrace:
+    return _current.get()
@@ -0,0 +1,109 @@
+# session_store.py
+# Bounded in-memory session store for the chatbot server.
+#
+# The widget creates a new session_id per browser, so plain dicts keyed by
+# session_id grow forever. SessionStore keeps the dict interface the endpoints
+# already use (in / [] / get) but:
+# - drops sessions idle for longer than idle_ttl_seconds,
+# - evicts the least recently used session once max_sessions is reached,
+# - reports session counts, evictions and approximate memory via stats().
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+def approx_size(obj) -> int:
+    """Approximate deep size in bytes for the str/list/dict values we store."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(approx_size(item) for item in obj)
+    return size
+
+
+class SessionStore:
+    """
+    Dict-like, thread-safe session_id -> value store with idle TTL and LRU eviction.
+    Every read or write counts as activity and moves the session to the back of
+    the LRU order; expired sessions are swept from the front on each access.
+    """
+
+    def __init__(self, name: str, max_sessions: int = 5000, idle_ttl_seconds: float = 2 * 60 * 60):
+        self.name = name
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._data = OrderedDict()  # session_id -> (value, last_access)
+        self._lock = threading.Lock()
+        self.evicted_ttl = 0
+        self.evicted_lru = 0
+
+    def _sweep(self, now: float) -> None:
+        # Oldest access first, so stop at the first session that is still fresh.
+        while self._data:
+            key, (_, last_access) = next(iter(self._data.items()))
+            if now - last_access <= self.idle_ttl_seconds:
+                break
+            self._data.popitem(last=False)
+            self.evicted_ttl += 1
+
+    def _touch(self, key, value, now: float) -> None:
+        self._data[key] = (value, now)
+        self._data.move_to_end(key)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            self._sweep(time.monotonic())
+            return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            value, _ = self._data[key]
+            self._touch(key, value, now)
+            return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            if key not in self._data:
+                return default
+            value, _ = self._data[key]
+            self._touch(key, value, now)
+            return value
+
+    def __setitem__(self, key, value) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._sweep(now)
+            if key not in self._data and len(self._data) >= self.max_sessions:
+                self._data.popitem(last=False)
+                self.evicted_lru += 1
+            self._touch(key, value, now)
+
+    def __delitem__(self, key) -> None:
+        with self._lock:
+            del self._data[key]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._sweep(time.monotonic())
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._sweep(time.monotonic())
+            values = [value for value, _ in self._data.values()]
+            approx_bytes = sum(approx_size(key) for key in self._data) + sum(approx_size(v) for v in values)
+            return {
+                "sessions": len(values),
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_lru": self.evicted_lru,
+                "approx_bytes": approx_bytes
+            }
@@ -0,0 +1,253 @@
+"""
+Concurrent, resumable batch test script for the SPAA chatbot.
+
+Same inputs and outputs as batch_test_chatbot_fixed.py, but:
+- questions are sent by a bounded pool of MAX_WORKERS clients, each reusing
+  one HTTP connection (requests.Session),
+- every answer is appended to a checkpoint file as soon as it arrives,
+- re-running the script skips rows already in the checkpoint, so an
+  interrupted run (Ctrl+C, crash, server restart) continues where it stopped.
+  Rows that failed are retried when RETRY_ERRORS is True.
+
+Delete the checkpoint file (or set RESUME = False) to start a fresh run.
+
+Outputs:
+- QA_test_with_chatbot_responses.xlsx
+- QA_test_with_chatbot_responses.docx
+- QA_test_with_chatbot_responses.checkpoint.jsonl (one JSON line per tested row)
+
+Each Excel question receives a unique session_id, so test questions do not
+share conversation history.
+
+Required packages:
+    pip install pandas openpyxl requests python-docx
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+from batch_test_chatbot_fixed import (
+    build_payload,
+    create_word_report,
+    extract_response,
+    find_question_column,
+)
+
+
+# =========================
+# Configuration
+# =========================
+INPUT_FILE = "QA_test.xlsx"
+OUTPUT_EXCEL = "QA_test_with_chatbot_responses.xlsx"
+OUTPUT_WORD = "QA_test_with_chatbot_responses.docx"
+CHECKPOINT_FILE = "QA_test_with_chatbot_responses.checkpoint.jsonl"
+
+CHATBOT_URL = "http://127.0.0.1:5000/chat"
+
+TIMEOUT_SECONDS = 180
+MAX_WORKERS = 4
+
+RESUME = True
+RETRY_ERRORS = True
+
+
+# =========================
+# API helpers
+# =========================
+_thread_local = threading.local()
+
+
+def http_session() -> requests.Session:
+    """One keep-alive session per worker thread."""
+    if not hasattr(_thread_local, "session"):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+
+def test_one_question(question: str, session_id: str) -> tuple[str, float, str, int | None]:
+    """Send one independent question to the chatbot."""
+    start_time = time.time()
+
+    try:
+        response = http_session().post(
+            CHATBOT_URL,
+            json=build_payload(question, session_id),
+            timeout=TIMEOUT_SECONDS,
+        )
+        elapsed = round(time.time() - start_time, 2)
+
+        if not response.ok:
+            body = response.text.strip()
+            error = f"HTTP {response.status_code}: {body or response.reason}"
+            return "", elapsed, error, response.status_code
+
+        try:
+            data = response.json()
+        except ValueError:
+            return response.text.strip(), elapsed, "", response.status_code
+
+        return extract_response(data).strip(), elapsed, "", response.status_code
+
+    except requests.exceptions.Timeout:
+        elapsed = round(time.time() - start_time, 2)
+        return "", elapsed, f"Request timed out after {TIMEOUT_SECONDS} seconds", None
+    except requests.exceptions.ConnectionError as exc:
+        elapsed = round(time.time() - start_time, 2)
+        return "", elapsed, f"Connection error: {exc}", None
+    except requests.RequestException as exc:
+        elapsed = round(time.time() - start_time, 2)
+        return "", elapsed, f"Request error: {exc}", None
+    except Exception as exc:
+        elapsed = round(time.time() - start_time, 2)
+        return "", elapsed, f"Unexpected error: {exc}", None
+
+
+# =========================
+# Checkpoint helpers
+# =========================
+class Checkpoint:
+    """Append-only JSON-lines record of finished rows, keyed by row number."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> dict[int, dict]:
+        results: dict[int, dict] = {}
+        if not self.path.exists():
+            return results
+        with open(self.path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; that row is simply re-run.
+                    continue
+                results[record["row"]] = record
+        return results
+
+    def append(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(line)
+                handle.flush()
+                os.fsync(handle.fileno())
+
+
+def run_row(row: int, question: str) -> dict:
+    session_id = f"batch_test_{uuid.uuid4().hex}"
+    answer, elapsed, error, status = test_one_question(question, session_id)
+    return {
+        "row": row,
+        "question": question,
+        "chatbot_response": answer,
+        "response_time_seconds": elapsed,
+        "http_status": status,
+        "error": error,
+        "test_session_id": session_id,
+    }
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    script_dir = Path(__file__).resolve().parent
+    input_path = script_dir / INPUT_FILE
+    excel_path = script_dir / OUTPUT_EXCEL
+    word_path = script_dir / OUTPUT_WORD
+    checkpoint = Checkpoint(script_dir / CHECKPOINT_FILE)
+
+    if not input_path.exists():
+        raise FileNotFoundError(
+            f"Cannot find {input_path}. Put QA_test.xlsx in the same folder as this script, "
+            "or revise INPUT_FILE."
+        )
+
+    df = pd.read_excel(input_path)
+    if df.empty:
+        raise ValueError(f"{input_path.name} is empty.")
+
+    question_col = find_question_column(df)
+    questions = [
+        "" if pd.isna(value) else str(value).strip()
+        for value in df[question_col]
+    ]
+
+    if not RESUME and checkpoint.path.exists():
+        checkpoint.path.unlink()
+
+    # A checkpointed row is reused only if the sheet still has the same question there.
+    done = {
+        row: record
+        for row, record in checkpoint.load().items()
+        if row < len(questions)
+        and record.get("question") == questions[row]
+        and not (RETRY_ERRORS and record.get("error") and record.get("question"))
+    }
+
+    pending = [(row, q) for row, q in enumerate(questions) if row not in done]
+    total = len(questions)
+    print(f"{len(done)} of {total} rows already in {checkpoint.path.name}; testing {len(pending)} rows "
+          f"with {MAX_WORKERS} workers.")
+
+    started = time.time()
+    finished = 0
+    pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="batch-test")
+    try:
+        futures = {}
+        for row, question in pending:
+            if not question:
+                record = {
+                    "row": row, "question": "", "chatbot_response": "", "response_time_seconds": 0.0,
+                    "http_status": None, "error": "Empty question", "test_session_id": "",
+                }
+                checkpoint.append(record)
+                done[row] = record
+                continue
+            futures[pool.submit(run_row, row, question)] = row
+
+        for future in as_completed(futures):
+            record = future.result()
+            checkpoint.append(record)
+            done[record["row"]] = record
+            finished += 1
+
+            status = f"ERROR: {record['error']}" if record["error"] else f"OK: {record['response_time_seconds']} seconds"
+            print(f"[{len(done)}/{total}] row {record['row'] + 1}: {record['question'][:80]} -> {status}")
+    except KeyboardInterrupt:
+        print("\nInterrupted; finished rows are saved. Run the script again to resume.")
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown(wait=True)
+
+    elapsed = time.time() - started
+    if finished:
+        print(f"\nTested {finished} rows in {elapsed:.1f} seconds ({finished / elapsed:.2f} rows/second).")
+
+    records = [done.get(row, {}) for row in range(total)]
+    df["chatbot_response"] = [r.get("chatbot_response", "") for r in records]
+    df["response_time_seconds"] = [r.get("response_time_seconds", 0.0) for r in records]
+    df["http_status"] = [r.get("http_status") for r in records]
+    df["error"] = [r.get("error", "") for r in records]
+    df["test_session_id"] = [r.get("test_session_id", "") for r in records]
+
+    # Save both outputs independently so one export failure is clearly reported.
+    df.to_excel(excel_path, index=False)
+    print(f"\nExcel results saved to: {excel_path}")
+
+    create_word_report(df, question_col, word_path)
+    print(f"Word report saved to: {word_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+In-process batch test script for the SPAA chatbot.
+
+Same inputs and outputs as batch_test_chatbot_fixed.py, but instead of calling
+a running server over HTTP it imports main_two_endpoints and calls
+run_chat_batch() directly. Questions are processed BATCH_SIZE at a time; within
+a batch the router calls, query embeddings and answer calls are grouped (see
+run_chat_batch), which is much faster than one HTTP request per question.
+
+Each Excel question receives a unique session_id, so test questions do not
+share conversation history.
+
+Outputs:
+- QA_test_with_chatbot_responses.xlsx
+- QA_test_with_chatbot_responses.docx
+
+Run from the repository root (./chroma_db must exist and Ollama must be
+running; the Flask server does not need to be running):
+    python test/batch_test_chatbot_inprocess.py
+
+Required packages:
+    pip install pandas openpyxl python-docx
+"""
+
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+
+from batch_test_chatbot_fixed import create_word_report, find_question_column
+
+
+# =========================
+# Configuration
+# =========================
+INPUT_FILE = "QA_test.xlsx"
+OUTPUT_EXCEL = "QA_test_with_chatbot_responses.xlsx"
+OUTPUT_WORD = "QA_test_with_chatbot_responses.docx"
+
+BATCH_SIZE = 16
+MAX_CONCURRENCY = 4   # parallel Ollama calls within a batch
+
+
+# =========================
+# Helpers
+# =========================
+def load_server():
+    repo_root = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(repo_root))
+    os.chdir(repo_root)
+    import main_two_endpoints as server
+    return server
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    script_dir = Path(__file__).resolve().parent
+    input_path = script_dir / INPUT_FILE
+    excel_path = script_dir / OUTPUT_EXCEL
+    word_path = script_dir / OUTPUT_WORD
+
+    if not input_path.exists():
+        raise FileNotFoundError(
+            f"Cannot find {input_path}. Put QA_test.xlsx in the same folder as this script, "
+            "or revise INPUT_FILE."
+        )
+
+    df = pd.read_excel(input_path)
+    if df.empty:
+        raise ValueError(f"{input_path.name} is empty.")
+
+    question_col = find_question_column(df)
+    questions = ["" if pd.isna(value) else str(value).strip() for value in df[question_col]]
+    session_ids = [f"batch_test_{uuid.uuid4().hex}" for _ in questions]
+
+    server = load_server()
+
+    total = len(questions)
+    responses = [""] * total
+    response_times = [0.0] * total
+    errors = ["Empty question" if not q else "" for q in questions]
+    statuses = [None] * total
+
+    rows = [row for row, question in enumerate(questions) if question]
+    started = time.time()
+
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = rows[start:start + BATCH_SIZE]
+        print(f"[{start + len(batch)}/{len(rows)}] Testing {len(batch)} questions ...")
+
+        batch_started = time.time()
+        try:
+            results = server.run_chat_batch(
+                [(questions[row], session_ids[row]) for row in batch],
+                max_concurrency=MAX_CONCURRENCY,
+            )
+        except Exception as exc:
+            results = [{"error": f"Unexpected error: {exc}"}] * len(batch)
+        # Questions in a batch finish together; report the per-question share.
+        elapsed = round((time.time() - batch_started) / len(batch), 2)
+
+        for row, result in zip(batch, results):
+            responses[row] = result.get("answer", "")
+            response_times[row] = elapsed
+            errors[row] = result.get("error", "")
+            statuses[row] = None if errors[row] else 200
+            if errors[row]:
+                print(f"  ERROR (row {row + 1}): {errors[row]}")
+
+    print(f"\nTested {len(rows)} questions in {time.time() - started:.1f} seconds.")
+
+    df["chatbot_response"] = responses
+    df["response_time_seconds"] = response_times
+    df["http_status"] = statuses
+    df["error"] = errors
+    df["test_session_id"] = session_ids
+
+    # Save both outputs independently so one export failure is clearly reported.
+    df.to_excel(excel_path, index=False)
+    print(f"\nExcel results saved to: {excel_path}")
+
+    create_word_report(df, question_col, word_path)
+    print(f"Word report saved to: {word_path}")
+
+
+if __name__ == "__main__":
+    main()
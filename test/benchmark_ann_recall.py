@@ -0,0 +1,284 @@
+"""
+Latency-versus-recall benchmark for the vector search backends.
+
+hybrid_retrieve's semantic leg is an approximate (HNSW) search. This script
+measures how much of the exact top-K it actually returns, and how fast, for
+different HNSW settings:
+- exact:   brute-force NumPy search over all stored embeddings (ground truth)
+- current: an in-memory copy of the ./chroma_db index (its M / ef_construction),
+           at each ef_search
+- m*_efc*: in-memory Chroma indexes built from the same stored embeddings with
+           other M / ef_construction values, at each ef_search
+- dense_*: the numpy backend (dense_index.py) at each storage type, with and
+           without float re-scoring of quantized candidates; recall is measured
+           against exact cosine search, since that is what this backend computes
+
+Reported per row: recall@K (share of the exact top K found), mean / p95 query
+latency and, for dense indexes, the bytes scanned per query (index_mb) and of
+the memory-mapped re-scoring copy (rescore_mb). Pick settings here, then put
+M / ef_construction in vector.py (HNSW_M, HNSW_EF_CONSTRUCTION, rebuild needed)
+and ef_search in vector.py too (HNSW_EF_SEARCH; UPDATE_EF_SEARCH_ONLY applies it
+without a rebuild), or choose SPAA_VECTOR_BACKEND=numpy with SPAA_DENSE_INDEX_DTYPE /
+SPAA_DENSE_INDEX_RESCORE.
+
+Queries: the QA_test.xlsx questions embedded with the corpus embedding model
+(needs Ollama), plus CORPUS_QUERY_SAMPLE stored chunk embeddings so the numbers
+are stable even with a short sheet (and without Ollama).
+
+Outputs:
+- ann_benchmark.xlsx (sheet "summary")
+
+Run from the repository root (./chroma_db must exist):
+    python test/benchmark_ann_recall.py
+
+Required packages:
+    pip install pandas openpyxl numpy chromadb
+"""
+
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+# =========================
+# Configuration
+# =========================
+INPUT_FILE = "QA_test.xlsx"
+OUTPUT_EXCEL = "ann_benchmark.xlsx"
+
+COLLECTION_NAME = "rutgers_corpus"
+RECALL_K = 20                  # hybrid_retrieve's k_chroma
+CORPUS_QUERY_SAMPLE = 200
+RANDOM_SEED = 42
+
+# (M, ef_construction) pairs for the temporary indexes.
+INDEX_CONFIGS = [(8, 50), (16, 100), (32, 200), (64, 400)]
+EF_SEARCH_VALUES = [10, 20, 50, 100, 200]
+ADD_BATCH_SIZE = 1000
+
+# (storage dtype, re-scoring dtype or None) for the numpy backend.
+DENSE_CONFIGS = [
+    ("float32", None),
+    ("float16", None),
+    ("int8", None),
+    ("int8", "float16"),
+    ("binary", None),
+    ("binary", "float16"),
+]
+DENSE_RESCORE_FACTOR = 4
+
+
+# =========================
+# Helpers
+# =========================
+def load_repo_modules():
+    repo_root = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(repo_root))
+    os.chdir(repo_root)
+    import dense_index
+    import vector
+    return vector, dense_index
+
+
+def find_question_column(df: pd.DataFrame) -> str:
+    """Prefer a question-like column; otherwise use the first column."""
+    normalized = {str(col).strip().lower(): col for col in df.columns}
+    for candidate in ("question", "questions", "query", "prompt"):
+        if candidate in normalized:
+            return normalized[candidate]
+    return df.columns[0]
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def embed_questions(model: str, input_path: Path) -> np.ndarray:
+    if not input_path.exists():
+        return np.zeros((0, 0), dtype=np.float32)
+    df = pd.read_excel(input_path)
+    question_col = find_question_column(df)
+    questions = [str(q).strip() for q in df[question_col] if not pd.isna(q) and str(q).strip()]
+    if not questions:
+        return np.zeros((0, 0), dtype=np.float32)
+    try:
+        from langchain_ollama import OllamaEmbeddings
+        vectors = OllamaEmbeddings(model=model).embed_documents(questions)
+    except Exception as exc:
+        print(f"Could not embed QA_test questions ({exc}); using stored chunk embeddings only.")
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, space: str, k: int) -> tuple[list, list]:
+    """Brute-force neighbors in the collection's distance space; returns (rows per query, seconds per query)."""
+    if space == "cosine":
+        corpus = corpus / np.maximum(np.linalg.norm(corpus, axis=1, keepdims=True), 1e-12)
+    corpus_sq = (corpus * corpus).sum(axis=1)
+
+    results, seconds = [], []
+    for query in queries:
+        start = time.perf_counter()
+        if space == "l2":
+            scores = 2 * (corpus @ query) - corpus_sq          # larger = closer
+        elif space == "cosine":
+            scores = corpus @ (query / max(np.linalg.norm(query), 1e-12))
+        else:
+            scores = corpus @ query
+        top = np.argpartition(-scores, k - 1)[:k]
+        results.append(set(top[np.argsort(-scores[top])].tolist()))
+        seconds.append(time.perf_counter() - start)
+    return results, seconds
+
+
+def run_queries(collection, queries: np.ndarray, row_of_id: dict, k: int) -> tuple[list, list]:
+    results, seconds = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        seconds.append(time.perf_counter() - start)
+        results.append({row_of_id[i] for i in found["ids"][0]})
+    return results, seconds
+
+
+def run_dense_queries(index, queries: np.ndarray, k: int) -> tuple[list, list]:
+    results, seconds = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = index.search(query, k)
+        seconds.append(time.perf_counter() - start)
+        results.append(set(rows))
+    return results, seconds
+
+
+def summarize(index: str, m, ef_construction, ef_search, found: list, truth: list, seconds: list,
+              build_s=None, index_bytes=None, rescore_bytes=None) -> dict:
+    recalls = [len(f & t) / len(t) for f, t in zip(found, truth) if t]
+    ms = [1000 * s for s in seconds]
+    return {
+        "index": index,
+        "M": m,
+        "ef_construction": ef_construction,
+        "ef_search": ef_search,
+        f"recall@{RECALL_K}": round(statistics.mean(recalls), 4),
+        f"min_recall@{RECALL_K}": round(min(recalls), 4),
+        "mean_ms": round(statistics.mean(ms), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "build_s": round(build_s, 2) if build_s is not None else None,
+        "index_mb": round(index_bytes / 1e6, 2) if index_bytes is not None else None,
+        "rescore_mb": round(rescore_bytes / 1e6, 2) if rescore_bytes is not None else None,
+    }
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    import chromadb
+
+    script_dir = Path(__file__).resolve().parent
+    input_path = script_dir / INPUT_FILE
+    output_path = script_dir / OUTPUT_EXCEL
+
+    vector, dense_index = load_repo_modules()
+    client = chromadb.PersistentClient(path=vector.DB_PATH)
+    live = client.get_collection(COLLECTION_NAME)
+    live_hnsw = dict(live.configuration.get("hnsw") or {})
+    space = live_hnsw.get("space", "l2")
+
+    stored = live.get(include=["embeddings"])
+    ids = list(stored["ids"])
+    corpus = np.asarray(stored["embeddings"], dtype=np.float32)
+    row_of_id = {doc_id: row for row, doc_id in enumerate(ids)}
+    k = min(RECALL_K, len(ids))
+    print(f"Loaded {len(ids)} stored embeddings (dim {corpus.shape[1]}), space={space}, live HNSW: {live_hnsw}")
+
+    rng = np.random.default_rng(RANDOM_SEED)
+    sample_rows = rng.choice(len(corpus), size=min(CORPUS_QUERY_SAMPLE, len(corpus)), replace=False)
+    question_vectors = embed_questions(vector.EMBED_MODEL, input_path)
+    parts = [corpus[sample_rows]]
+    if question_vectors.size and question_vectors.shape[1] == corpus.shape[1]:
+        parts.insert(0, question_vectors)
+    queries = np.concatenate(parts)
+    print(f"Queries: {len(question_vectors) if question_vectors.size else 0} QA_test questions "
+          f"+ {len(sample_rows)} stored chunks")
+
+    truth, exact_seconds = exact_top_k(corpus, queries, space, k)
+    summaries = [summarize("exact", None, None, None, truth, truth, exact_seconds)]
+
+    # Chroma reads ef_search when a process first loads the index, so every
+    # ef_search value gets its own collection. The live collection's own
+    # M / ef_construction are always part of the grid (index "current").
+    live_pair = (live_hnsw.get("max_neighbors", 16), live_hnsw.get("ef_construction", 100))
+    grid = [live_pair] + [pair for pair in INDEX_CONFIGS if pair != live_pair]
+
+    scratch = chromadb.EphemeralClient()
+    for m, ef_construction in grid:
+        label = "current" if (m, ef_construction) == live_pair else f"m{m}_efc{ef_construction}"
+        print(f"Building {label} (M={m}, ef_construction={ef_construction}) ...")
+        for ef_search in EF_SEARCH_VALUES:
+            name = f"ann_benchmark_m{m}_efc{ef_construction}_efs{ef_search}"
+            start = time.perf_counter()
+            collection = scratch.create_collection(
+                name,
+                configuration={"hnsw": {
+                    "space": space,
+                    "max_neighbors": m,
+                    "ef_construction": ef_construction,
+                    "ef_search": ef_search,
+                }},
+                embedding_function=None,
+            )
+            for i in range(0, len(ids), ADD_BATCH_SIZE):
+                collection.add(ids=ids[i:i + ADD_BATCH_SIZE], embeddings=corpus[i:i + ADD_BATCH_SIZE])
+            build_seconds = time.perf_counter() - start
+
+            found, seconds = run_queries(collection, queries, row_of_id, k)
+            summaries.append(summarize(label, m, ef_construction, ef_search, found, truth, seconds, build_seconds))
+            scratch.delete_collection(name)
+
+    cosine_truth, _ = exact_top_k(corpus, queries, "cosine", k)
+    with tempfile.TemporaryDirectory(prefix="ann_benchmark_") as tmp:
+        for dtype, rescore_dtype in DENSE_CONFIGS:
+            label = f"dense_{dtype}" + (f"+{rescore_dtype}" if rescore_dtype else "")
+            print(f"Building {label} ...")
+            start = time.perf_counter()
+            index = dense_index.DenseIndex.open_or_build(
+                tmp, ids, corpus, dtype=dtype, rescore_dtype=rescore_dtype, rescore_factor=DENSE_RESCORE_FACTOR,
+            )
+            build_seconds = time.perf_counter() - start
+            found, seconds = run_dense_queries(index, queries, k)
+            summaries.append(summarize(
+                label, None, None, None, found, cosine_truth, seconds, build_seconds,
+                index_bytes=index.nbytes,
+                rescore_bytes=index.rescore_index.nbytes if index.rescore_index is not None else None,
+            ))
+
+    summary_df = pd.DataFrame(summaries)
+    summary_df.to_excel(output_path, sheet_name="summary", index=False)
+
+    print(f"\n===== ANN latency vs recall@{k} ({len(queries)} queries) =====")
+    print(f"{'index':<22}{'M':>5}{'efC':>6}{'efS':>6}{'recall':>9}{'min':>8}{'mean ms':>10}{'p95 ms':>9}{'MB':>9}")
+    for s in summaries:
+        print(
+            f"{s['index']:<22}{s['M'] or '':>5}{s['ef_construction'] or '':>6}{s['ef_search'] or '':>6}"
+            f"{s[f'recall@{RECALL_K}']:>9}{s[f'min_recall@{RECALL_K}']:>8}{s['mean_ms']:>10}{s['p95_ms']:>9}"
+            f"{s['index_mb'] if s['index_mb'] is not None else '':>9}"
+        )
+    print(f"\nDetails saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
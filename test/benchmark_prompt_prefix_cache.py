@@ -0,0 +1,178 @@
+"""
+Prompt-prefix cache benchmark for the SPAA chatbot prompts.
+
+Compares prefill cost of the same router/answer prompts in two layouts:
+- static_first:   static instructions first, per-request values last
+                  (the layout used by main_two_endpoints.py)
+- variable_first: per-request values first, static instructions last
+                  (the old layout)
+
+Both layouts contain exactly the same text; only the order differs. Each layout
+is primed once, then called with a series of different questions. Ollama reports
+prompt_eval_count / prompt_eval_duration for the tokens it actually had to
+prefill, so reused prefix tokens show up as a lower count and time.
+
+Run from the repository root (main_two_endpoints.py is imported for its
+templates, so ./chroma_db must exist and Ollama must be running):
+    python test/benchmark_prompt_prefix_cache.py
+
+Required packages:
+    pip install requests
+"""
+
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import requests
+
+
+# =========================
+# Configuration
+# =========================
+OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
+TIMEOUT_SECONDS = 300
+
+QUESTIONS = [
+    "What are the admission requirements for the MPA program?",
+    "When is the application deadline for the PhD program?",
+    "Who should I contact about EMPA tuition?",
+    "Does SPAA offer scholarships for veterans?",
+    "How do I register for summer classes?",
+    "Where is the SPAA office located?",
+    "What careers do MPA graduates pursue?",
+    "Can international students apply to the online MPA?",
+]
+
+SAMPLE_INFO = (
+    "[S1]\nTITLE: Master of Public Administration\nURL: https://spaa.newark.rutgers.edu/mpa\n"
+    "CONTENT:\nThe MPA program prepares students for leadership in public service. "
+    "Applications are reviewed on a rolling basis."
+)
+
+
+# =========================
+# Helpers
+# =========================
+def load_prompts():
+    """Import the prompt pieces from the server module."""
+    repo_root = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(repo_root))
+    os.chdir(repo_root)
+    import main_two_endpoints as server
+    return server
+
+
+def render(template_static: str, template_dynamic: str, layout: str, values: dict) -> str:
+    dynamic = template_dynamic.strip().format(**values)
+    static = template_static.strip()
+    if layout == "static_first":
+        return f"{static}\n\n{dynamic}\n"
+    return f"{dynamic}\n\n{static}\n"
+
+
+def prefill(server, model_name: str, prompt: str) -> tuple[int, float]:
+    """Send one prompt with a 1-token generation; return (prefilled tokens, prefill ms)."""
+    response = requests.post(
+        OLLAMA_URL,
+        json={
+            "model": model_name,
+            "prompt": prompt,
+            "stream": False,
+            "keep_alive": server.OLLAMA_KEEP_ALIVE,
+            "options": {"num_ctx": server.OLLAMA_NUM_CTX, "num_predict": 1},
+        },
+        timeout=TIMEOUT_SECONDS,
+    )
+    response.raise_for_status()
+    data = response.json()
+    return int(data.get("prompt_eval_count", 0)), data.get("prompt_eval_duration", 0) / 1e6
+
+
+def run_layout(server, name: str, model_name: str, static: str, dynamic: str, layout: str, make_values) -> dict:
+    # Prime the slot so every layout starts from the same warm state.
+    prefill(server, model_name, render(static, dynamic, layout, make_values("Hello")))
+
+    counts, times = [], []
+    for question in QUESTIONS:
+        count, ms = prefill(server, model_name, render(static, dynamic, layout, make_values(question)))
+        counts.append(count)
+        times.append(ms)
+
+    return {
+        "prompt": name,
+        "layout": layout,
+        "mean_prefill_tokens": round(statistics.mean(counts), 1),
+        "mean_prefill_ms": round(statistics.mean(times), 1),
+        "median_prefill_ms": round(statistics.median(times), 1),
+    }
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    server = load_prompts()
+
+    cases = [
+        (
+            "router",
+            server.STAGE_MODELS["router"],
+            server.combined_static,
+            server.combined_dynamic,
+            lambda q: {
+                "context": "",
+                "question": q,
+                "cached_language": "unknown",
+                "cached_language_confidence": 0.0,
+                "cached_persona": "unknown",
+                "cached_persona_confidence": 0.0,
+                "should_check_persona_again": True,
+            },
+        ),
+        (
+            "answer",
+            server.STAGE_MODELS["answer"],
+            server.answer_static,
+            server.answer_dynamic,
+            lambda q: {
+                "context": "",
+                "info": SAMPLE_INFO,
+                "question": q,
+                "user_lang": "en",
+                "user_lang_name": "English",
+                "persona": "unknown",
+                "persona_confidence": 0.0,
+                "acknowledgment_to_use": "",
+            },
+        ),
+    ]
+
+    started = time.time()
+    results = []
+    for name, model_name, static, dynamic, make_values in cases:
+        for layout in ("variable_first", "static_first"):
+            print(f"Running {name} ({model_name}) / {layout} ...")
+            results.append(run_layout(server, name, model_name, static, dynamic, layout, make_values))
+
+    print(f"\n{'prompt':<8} {'layout':<15} {'tokens':>8} {'mean ms':>10} {'median ms':>10}")
+    for row in results:
+        print(
+            f"{row['prompt']:<8} {row['layout']:<15} {row['mean_prefill_tokens']:>8} "
+            f"{row['mean_prefill_ms']:>10} {row['median_prefill_ms']:>10}"
+        )
+
+    for name, *_ in cases:
+        before = next(r for r in results if r["prompt"] == name and r["layout"] == "variable_first")
+        after = next(r for r in results if r["prompt"] == name and r["layout"] == "static_first")
+        if before["mean_prefill_ms"]:
+            saved = 100 * (1 - after["mean_prefill_ms"] / before["mean_prefill_ms"])
+            print(f"{name}: prefill time reduced by {saved:.1f}% with static-first layout")
+
+    print(f"\nTotal benchmark time: {time.time() - started:.1f} seconds")
+
+
+if __name__ == "__main__":
+    main()
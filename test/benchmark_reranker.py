@@ -0,0 +1,157 @@
+"""
+CPU batch-size benchmark for the cross-encoder reranker (reranker.py).
+
+For every QA_test.xlsx question, the top RERANK_CANDIDATES fused chunks are
+taken from hybrid_retrieve (reranking and diversification off), then scored by
+the cross-encoder once per BATCH_SIZES value with an empty cache. Reported per
+batch size: mean / p95 milliseconds per question and per (query, chunk) pair.
+A final pass repeats the questions with a warm cache to show the cost of a
+repeated question. Put the fastest batch size and thread count in
+RERANK_BATCH_SIZE / RERANK_THREADS in main_two_endpoints.py.
+
+Outputs:
+- reranker_benchmark.xlsx (sheet "summary")
+
+Run from the repository root (main_two_endpoints.py is imported, so
+./chroma_db must exist and Ollama must be running for query embeddings;
+the reranker model folder must exist, see reranker.py):
+    python test/benchmark_reranker.py
+
+Required packages:
+    pip install pandas openpyxl onnxruntime tokenizers
+"""
+
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+# =========================
+# Configuration
+# =========================
+INPUT_FILE = "QA_test.xlsx"
+OUTPUT_EXCEL = "reranker_benchmark.xlsx"
+
+BATCH_SIZES = [1, 4, 8, 16, 32, 64]
+THREADS = [1, 2, 4]
+MAX_QUESTIONS = 50
+
+
+# =========================
+# Helpers
+# =========================
+def load_server():
+    repo_root = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(repo_root))
+    os.chdir(repo_root)
+    import main_two_endpoints as server
+    return server
+
+
+def find_question_column(df: pd.DataFrame) -> str:
+    """Prefer a question-like column; otherwise use the first column."""
+    normalized = {str(col).strip().lower(): col for col in df.columns}
+    for candidate in ("question", "questions", "query", "prompt"):
+        if candidate in normalized:
+            return normalized[candidate]
+    return df.columns[0]
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def time_questions(reranker, cases: list) -> list:
+    """Milliseconds per question for scoring its candidates."""
+    ms = []
+    for question, chunks in cases:
+        start = time.perf_counter()
+        reranker.score(question, chunks)
+        ms.append(1000 * (time.perf_counter() - start))
+    return ms
+
+
+def summary_row(label: str, batch_size: int, threads: int, ms: list, pairs: int) -> dict:
+    return {
+        "run": label,
+        "batch_size": batch_size,
+        "threads": threads,
+        "questions": len(ms),
+        "mean_ms": round(statistics.mean(ms), 1),
+        "p95_ms": round(percentile(ms, 95), 1),
+        "ms_per_pair": round(sum(ms) / max(pairs, 1), 2),
+    }
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    from reranker import CrossEncoderReranker
+
+    script_dir = Path(__file__).resolve().parent
+    input_path = script_dir / INPUT_FILE
+    output_path = script_dir / OUTPUT_EXCEL
+
+    if not input_path.exists():
+        raise FileNotFoundError(
+            f"Cannot find {input_path}. Put QA_test.xlsx in the same folder as this script, "
+            "or revise INPUT_FILE."
+        )
+
+    df = pd.read_excel(input_path)
+    question_col = find_question_column(df)
+    questions = [str(q).strip() for q in df[question_col] if not pd.isna(q) and str(q).strip()]
+    questions = questions[:MAX_QUESTIONS]
+
+    server = load_server()
+    print(f"Collecting {server.RERANK_CANDIDATES} candidates for {len(questions)} questions ...")
+    cases = []
+    for question in questions:
+        docs = server.hybrid_retrieve(question, k_final=server.RERANK_CANDIDATES, diversify=False, rerank=False)
+        chunks = [
+            (server.doc_key(doc), f"{doc.metadata.get('title', '')}\n{server.strip_chunk_header(doc.page_content)}")
+            for doc in docs
+        ]
+        cases.append((question, chunks))
+    pairs = sum(len(chunks) for _, chunks in cases)
+
+    summaries = []
+    for threads in THREADS:
+        for batch_size in BATCH_SIZES:
+            # cache_size=0: every pair goes through the model.
+            reranker = CrossEncoderReranker(
+                server.RERANK_MODEL_DIR, batch_size=batch_size, cache_size=0, threads=threads
+            )
+            time_questions(reranker, cases[:2])   # warm-up
+            ms = time_questions(reranker, cases)
+            summaries.append(summary_row("cold", batch_size, threads, ms, pairs))
+            print(f"threads={threads} batch_size={batch_size}: {summaries[-1]['mean_ms']} ms/question")
+
+    best = min(summaries, key=lambda row: row["mean_ms"])
+    reranker = CrossEncoderReranker(server.RERANK_MODEL_DIR, batch_size=best["batch_size"], threads=best["threads"])
+    time_questions(reranker, cases)
+    summaries.append(summary_row("cached", best["batch_size"], best["threads"], time_questions(reranker, cases), pairs))
+
+    pd.DataFrame(summaries).to_excel(output_path, sheet_name="summary", index=False)
+
+    print(f"\n===== Cross-encoder reranking ({pairs} pairs over {len(cases)} questions) =====")
+    print(f"{'run':<8}{'threads':>8}{'batch':>7}{'mean ms':>10}{'p95 ms':>9}{'ms/pair':>9}")
+    for s in summaries:
+        print(f"{s['run']:<8}{s['threads']:>8}{s['batch_size']:>7}{s['mean_ms']:>10}{s['p95_ms']:>9}{s['ms_per_pair']:>9}")
+    print(f"\nFastest: batch_size={best['batch_size']}, threads={best['threads']}")
+    print(f"Details saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Retrieval benchmark for hybrid_retrieve (no LLM calls except query embedding).
+
+Runs every labeled query through hybrid_retrieve once per configuration
+(k_chroma, k_bm25, RRF weights, metadata boost weights, diversification) and
+reports, per configuration:
+- recall@k for each k in K_VALUES (share of expected URLs found in the top k chunks)
+- MRR (reciprocal rank of the first chunk from an expected URL)
+- mean / p95 latency, total and without the query embedding call
+
+Labeled set: retrieval_labels.xlsx with columns question, search_query,
+expected_urls (" | " separated), label_source. If the file does not exist it
+is seeded from QA_test.xlsx and the retrieval logs (the SQLite log store and any
+old *_retrieval.csv files): each logged question gets the search_query and the
+top SEED_TOP_N URLs the server actually returned. Seeded labels only describe
+what the old configuration retrieved, so review and correct expected_urls
+before relying on the numbers; rows with empty expected_urls are skipped.
+
+Outputs:
+- retrieval_labels.xlsx (seeded on the first run)
+- retrieval_benchmark.xlsx (sheet "summary" per configuration, sheet "queries" per query)
+
+Run from the repository root (main_two_endpoints.py is imported, so
+./chroma_db must exist and Ollama must be running for query embeddings):
+    python test/benchmark_retrieval.py
+
+Required packages:
+    pip install pandas openpyxl
+"""
+
+import glob
+import os
+import statistics
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+
+# =========================
+# Configuration
+# =========================
+INPUT_FILE = "QA_test.xlsx"
+LABELS_FILE = "retrieval_labels.xlsx"
+OUTPUT_EXCEL = "retrieval_benchmark.xlsx"
+
+# Relative to the repository root.
+LOG_DIR = "./conversation"
+LEGACY_RETRIEVAL_CSV_GLOB = "./conversation/*_retrieval.csv"
+
+SEED_TOP_N = 3
+K_VALUES = [1, 3, 5, 8]
+URL_SEPARATOR = " | "
+
+# Each configuration is passed to hybrid_retrieve as keyword arguments, except
+# "boost_scale", which multiplies the server's METADATA_BOOST_WEIGHTS.
+# The first one should match the server defaults. Run with SPAA_RERANK=1 to
+# include cross-encoder reranking in "default" and compare it with "no_rerank".
+CONFIGS = [
+    {"name": "default"},
+    {"name": "diversify", "diversify": True},
+    {"name": "no_rerank", "rerank": False},
+    {"name": "chroma_10_bm25_10", "k_chroma": 10, "k_bm25": 10},
+    {"name": "chroma_40_bm25_40", "k_chroma": 40, "k_bm25": 40},
+    {"name": "rrf_50_50", "chroma_weight": 0.5, "bm25_weight": 0.5},
+    {"name": "rrf_85_15", "chroma_weight": 0.85, "bm25_weight": 0.15},
+    {"name": "no_metadata_boost", "boost_scale": 0.0},
+    {"name": "half_metadata_boost", "boost_scale": 0.5},
+]
+
+
+# =========================
+# Helpers
+# =========================
+def load_server():
+    repo_root = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(repo_root))
+    os.chdir(repo_root)
+    import main_two_endpoints as server
+    return server
+
+
+def find_question_column(df: pd.DataFrame) -> str:
+    """Prefer a question-like column; otherwise use the first column."""
+    normalized = {str(col).strip().lower(): col for col in df.columns}
+    for candidate in ("question", "questions", "query", "prompt"):
+        if candidate in normalized:
+            return normalized[candidate]
+    return df.columns[0]
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def load_logged_retrievals() -> pd.DataFrame:
+    """Retrieval log rows from the SQLite log store plus any old per-session CSVs."""
+    from conversation_store import read_retrievals
+
+    frames = [pd.DataFrame(read_retrievals(LOG_DIR))]
+    for path in glob.glob(LEGACY_RETRIEVAL_CSV_GLOB):
+        frames.append(pd.read_csv(path, encoding="utf-8-sig"))
+
+    columns = ["timestamp", "session_id", "question", "search_query", "rank", "source_url"]
+    frames = [frame.reindex(columns=columns) for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    logs = pd.concat(frames, ignore_index=True)
+    logs = logs.dropna(subset=["question", "source_url"])
+    logs["question"] = logs["question"].astype(str).str.strip()
+    return logs
+
+
+def seed_labels(questions: list) -> pd.DataFrame:
+    """One row per distinct logged question (QA_test questions first)."""
+    logs = load_logged_retrievals()
+
+    latest = {}
+    if not logs.empty:
+        # The newest retrieval of each question: same timestamp + session_id.
+        logs = logs.sort_values(["timestamp", "rank"])
+        for question, group in logs.groupby("question", sort=False):
+            last = group[group["timestamp"] == group["timestamp"].max()]
+            last = last[last["session_id"] == last["session_id"].iloc[-1]].sort_values("rank")
+            urls = list(dict.fromkeys(u for u in last["source_url"] if isinstance(u, str) and u))
+            latest[question] = {
+                "search_query": str(last["search_query"].iloc[0] or ""),
+                "expected_urls": URL_SEPARATOR.join(urls[:SEED_TOP_N]),
+            }
+
+    rows = []
+    for question in questions:
+        logged = latest.pop(question, {"search_query": "", "expected_urls": ""})
+        rows.append({"question": question, **logged, "label_source": "qa_test"})
+    for question, logged in latest.items():
+        rows.append({"question": question, **logged, "label_source": "retrieval_log"})
+    return pd.DataFrame(rows, columns=["question", "search_query", "expected_urls", "label_source"])
+
+
+def evaluate(server, query: str, expected: set, config: dict) -> dict:
+    kwargs = {key: value for key, value in config.items() if key not in ("name", "boost_scale")}
+    kwargs.setdefault("k_final", max(K_VALUES))
+    if "boost_scale" in config:
+        kwargs["boost_weights"] = {
+            key: value * config["boost_scale"] for key, value in server.METADATA_BOOST_WEIGHTS.items()
+        }
+
+    # hybrid_retrieve records its sub-stages (embed_query, vector_search, ...) on the active trace.
+    trace = server.start_trace("retrieval_benchmark")
+    with trace.stage("total"):
+        docs = server.hybrid_retrieve(query, **kwargs)
+    trace.finish()
+    stages = trace.stages
+
+    urls = [doc.metadata.get("source_url", "") for doc in docs]
+    row = {
+        "total_ms": 1000 * stages.get("total", 0.0),
+        "search_ms": 1000 * (stages.get("total", 0.0) - stages.get("embed_query", 0.0)),
+        "mrr": 0.0,
+        "retrieved_urls": URL_SEPARATOR.join(dict.fromkeys(urls)),
+    }
+    for rank, url in enumerate(urls, start=1):
+        if url in expected:
+            row["mrr"] = 1.0 / rank
+            break
+    for k in K_VALUES:
+        row[f"recall@{k}"] = len(expected & set(urls[:k])) / len(expected)
+    return row
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    script_dir = Path(__file__).resolve().parent
+    input_path = script_dir / INPUT_FILE
+    labels_path = script_dir / LABELS_FILE
+    output_path = script_dir / OUTPUT_EXCEL
+
+    server = load_server()
+
+    if not labels_path.exists():
+        questions = []
+        if input_path.exists():
+            df = pd.read_excel(input_path)
+            question_col = find_question_column(df)
+            questions = [str(q).strip() for q in df[question_col] if not pd.isna(q) and str(q).strip()]
+        labels = seed_labels(questions)
+        labels.to_excel(labels_path, index=False)
+        print(f"Seeded {len(labels)} labeled queries into {labels_path}; review expected_urls before trusting results.")
+
+    labels = pd.read_excel(labels_path).fillna("")
+    cases = []
+    for _, row in labels.iterrows():
+        expected = {u.strip() for u in str(row["expected_urls"]).split(URL_SEPARATOR.strip()) if u.strip()}
+        if not expected:
+            continue
+        query = str(row["search_query"]).strip() or str(row["question"]).strip()
+        cases.append((str(row["question"]), query, expected))
+
+    if not cases:
+        raise ValueError(f"{labels_path.name} has no rows with expected_urls.")
+
+    # Warm up the embedding model and Chroma so the first configuration is not penalized.
+    server.hybrid_retrieve(cases[0][1])
+
+    summaries, details = [], []
+    for config in CONFIGS:
+        print(f"Running {config['name']} over {len(cases)} queries ...")
+        rows = []
+        for question, query, expected in cases:
+            row = evaluate(server, query, expected, config)
+            rows.append(row)
+            details.append({"config": config["name"], "question": question, "query": query, **row})
+
+        totals = [r["total_ms"] for r in rows]
+        searches = [r["search_ms"] for r in rows]
+        summary = {"config": config["name"], "queries": len(rows)}
+        for k in K_VALUES:
+            summary[f"recall@{k}"] = round(statistics.mean(r[f"recall@{k}"] for r in rows), 3)
+        summary["mrr"] = round(statistics.mean(r["mrr"] for r in rows), 3)
+        summary["mean_ms"] = round(statistics.mean(totals), 1)
+        summary["p95_ms"] = round(percentile(totals, 95), 1)
+        summary["mean_search_ms"] = round(statistics.mean(searches), 1)
+        summary["p95_search_ms"] = round(percentile(searches, 95), 1)
+        summaries.append(summary)
+
+    with pd.ExcelWriter(output_path) as writer:
+        pd.DataFrame(summaries).to_excel(writer, sheet_name="summary", index=False)
+        pd.DataFrame(details).to_excel(writer, sheet_name="queries", index=False)
+
+    print("\n===== Retrieval benchmark =====")
+    header = f"{'config':<22}" + "".join(f"{'R@' + str(k):>7}" for k in K_VALUES)
+    print(header + f"{'MRR':>7}{'mean ms':>10}{'search ms':>11}")
+    for s in summaries:
+        print(
+            f"{s['config']:<22}" + "".join(f"{s[f'recall@{k}']:>7}" for k in K_VALUES)
+            + f"{s['mrr']:>7}{s['mean_ms']:>10}{s['mean_search_ms']:>11}"
+        )
+    print(f"\nDetails saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
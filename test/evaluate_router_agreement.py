@@ -0,0 +1,174 @@
+"""
+Router agreement check: small router model vs. the large model.
+
+Runs the /chat router prompt (combined language/persona/routing) over every
+question in QA_test.xlsx with two models and reports how often the small model
+makes the same decision as the large one, plus the mean router latency of each.
+
+Compared fields:
+- use_retrieval (exact match)
+- language      (exact match)
+- persona       (exact match)
+- search_query  (word-overlap Jaccard; counted as agreeing at >= 0.5)
+
+Outputs:
+- router_agreement.xlsx (one row per question with both decisions)
+
+Run from the repository root (main_two_endpoints.py is imported for its
+prompt and JSON parser, so ./chroma_db must exist and Ollama must be running):
+    python test/evaluate_router_agreement.py
+
+Required packages:
+    pip install pandas openpyxl
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+# =========================
+# Configuration
+# =========================
+INPUT_FILE = "QA_test.xlsx"
+OUTPUT_EXCEL = "router_agreement.xlsx"
+
+# Reference (large) model and candidate (small) model.
+# Defaults: the answer model as reference, the configured router model as candidate.
+REFERENCE_MODEL = os.environ.get("SPAA_REFERENCE_ROUTER_MODEL", "")
+CANDIDATE_MODEL = os.environ.get("SPAA_CANDIDATE_ROUTER_MODEL", "")
+
+QUERY_AGREEMENT_THRESHOLD = 0.5
+
+
+# =========================
+# Helpers
+# =========================
+def load_server():
+    repo_root = Path(__file__).resolve().parent.parent
+    sys.path.insert(0, str(repo_root))
+    os.chdir(repo_root)
+    import main_two_endpoints as server
+    return server
+
+
+def find_question_column(df: pd.DataFrame) -> str:
+    """Prefer a question-like column; otherwise use the first column."""
+    normalized = {str(col).strip().lower(): col for col in df.columns}
+    for candidate in ("question", "questions", "query", "prompt"):
+        if candidate in normalized:
+            return normalized[candidate]
+    return df.columns[0]
+
+
+def query_overlap(a: str, b: str) -> float:
+    words_a = set((a or "").lower().split())
+    words_b = set((b or "").lower().split())
+    if not words_a and not words_b:
+        return 1.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def route(server, chain, question: str) -> tuple[dict, float]:
+    """Run one first-turn router call; return (parsed decision, seconds)."""
+    start = time.perf_counter()
+    raw = chain.invoke({
+        "context": "",
+        "question": question,
+        "cached_language": "unknown",
+        "cached_language_confidence": 0.0,
+        "cached_persona": "unknown",
+        "cached_persona_confidence": 0.0,
+        "should_check_persona_again": True,
+    })
+    elapsed = time.perf_counter() - start
+
+    result = server.parse_combined_json(raw)
+    return {
+        "use_retrieval": bool(result.get("use_retrieval", True)),
+        "language": server.normalize_lang(result.get("language", "en")),
+        "persona": server.sanitize_persona_label(result.get("persona")),
+        "search_query": (result.get("search_query") or "").strip(),
+    }, elapsed
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    script_dir = Path(__file__).resolve().parent
+    input_path = script_dir / INPUT_FILE
+    output_path = script_dir / OUTPUT_EXCEL
+
+    if not input_path.exists():
+        raise FileNotFoundError(f"Cannot find {input_path}.")
+
+    df = pd.read_excel(input_path)
+    question_col = find_question_column(df)
+    questions = [str(q).strip() for q in df[question_col] if not pd.isna(q) and str(q).strip()]
+
+    server = load_server()
+    reference_model = REFERENCE_MODEL or server.STAGE_MODELS["answer"]
+    candidate_model = CANDIDATE_MODEL or server.STAGE_MODELS["router"]
+
+    schema = server.COMBINED_ROUTER_SCHEMA
+    reference_chain = server.combined_prompt | server.get_router_llm(reference_model, schema)
+    candidate_chain = server.combined_prompt | server.get_router_llm(candidate_model, schema)
+
+    print(f"Reference router: {reference_model}")
+    print(f"Candidate router: {candidate_model}")
+
+    rows = []
+    for position, question in enumerate(questions, start=1):
+        print(f"[{position}/{len(questions)}] {question[:100]}")
+        ref, ref_seconds = route(server, reference_chain, question)
+        cand, cand_seconds = route(server, candidate_chain, question)
+
+        overlap = query_overlap(ref["search_query"], cand["search_query"])
+        rows.append({
+            "question": question,
+            "ref_use_retrieval": ref["use_retrieval"],
+            "cand_use_retrieval": cand["use_retrieval"],
+            "ref_language": ref["language"],
+            "cand_language": cand["language"],
+            "ref_persona": ref["persona"],
+            "cand_persona": cand["persona"],
+            "ref_search_query": ref["search_query"],
+            "cand_search_query": cand["search_query"],
+            "search_query_overlap": round(overlap, 3),
+            "ref_seconds": round(ref_seconds, 3),
+            "cand_seconds": round(cand_seconds, 3),
+        })
+
+    out = pd.DataFrame(rows)
+    if out.empty:
+        raise ValueError(f"{input_path.name} has no questions.")
+
+    out.to_excel(output_path, index=False)
+
+    retrieval_agree = (out["ref_use_retrieval"] == out["cand_use_retrieval"]).mean()
+    language_agree = (out["ref_language"] == out["cand_language"]).mean()
+    persona_agree = (out["ref_persona"] == out["cand_persona"]).mean()
+    # Only compare queries where both models decided to retrieve.
+    both_retrieve = out[out["ref_use_retrieval"] & out["cand_use_retrieval"]]
+    query_agree = (
+        (both_retrieve["search_query_overlap"] >= QUERY_AGREEMENT_THRESHOLD).mean()
+        if not both_retrieve.empty else float("nan")
+    )
+
+    print("\n===== Router agreement =====")
+    print(f"Questions:              {len(out)}")
+    print(f"use_retrieval agreement: {retrieval_agree:.1%}")
+    print(f"language agreement:      {language_agree:.1%}")
+    print(f"persona agreement:       {persona_agree:.1%}")
+    print(f"search_query agreement:  {query_agree:.1%} (overlap >= {QUERY_AGREEMENT_THRESHOLD})")
+    print(f"Mean latency {reference_model}: {out['ref_seconds'].mean():.2f} s")
+    print(f"Mean latency {candidate_model}: {out['cand_seconds'].mean():.2f} s")
+    print(f"\nDetails saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Deterministic fake Ollama server for offline load tests.
+
+Answers the Ollama endpoints main_two_endpoints.py uses, with canned output
+and a configurable simulated model latency, so the serving layer (Flask,
+retrieval, prompt building, logging, session memory) can be measured without
+a GPU or real models:
+- POST /api/generate    router calls (requests with a JSON "format") get the
+                        canned router JSON; everything else gets a canned answer
+- POST /api/chat        same, in chat format
+- POST /api/embed       deterministic unit vectors derived from the input text
+- POST /api/embeddings  legacy single-embedding endpoint
+- GET  /api/ps, /api/tags, /api/version
+
+Like Ollama, each model runs at most NUM_PARALLEL generations at once; further
+calls queue. Embeddings are hash-based, so they do not carry meaning; set
+EMBEDDING_DIM to the dimension of the Chroma collection (768 for nomic-embed-text).
+
+Run:
+    python test/fake_ollama_server.py            # listens on 127.0.0.1:11500
+Then start the chatbot against it:
+    OLLAMA_HOST=http://127.0.0.1:11500 python main_two_endpoints.py
+
+Required packages:
+    none (standard library only)
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# =========================
+# Configuration
+# =========================
+HOST = os.environ.get("FAKE_OLLAMA_HOST", "127.0.0.1")
+PORT = int(os.environ.get("FAKE_OLLAMA_PORT", "11500"))
+
+EMBEDDING_DIM = int(os.environ.get("FAKE_OLLAMA_EMBEDDING_DIM", "768"))
+
+# Simulated model time per call, in milliseconds.
+ROUTER_LATENCY_MS = float(os.environ.get("FAKE_OLLAMA_ROUTER_MS", "150"))
+ANSWER_LATENCY_MS = float(os.environ.get("FAKE_OLLAMA_ANSWER_MS", "1200"))
+EMBED_LATENCY_MS = float(os.environ.get("FAKE_OLLAMA_EMBED_MS", "15"))
+
+# Like OLLAMA_NUM_PARALLEL: generations per model that run at once; the rest queue.
+NUM_PARALLEL = int(os.environ.get("FAKE_OLLAMA_NUM_PARALLEL", "4"))
+
+# Answers are streamed in this many chunks, like a real generation.
+ANSWER_STREAM_CHUNKS = 8
+
+CANNED_ANSWER = (
+    "The **Master of Public Administration (MPA)** program at SPAA accepts applications "
+    "on a rolling basis. Please review the admission requirements and deadlines on the "
+    "program page [source](https://spaa.newark.rutgers.edu/mpa) and contact the admissions "
+    "office with any questions."
+)
+
+ROUTER_DECISION = {
+    "language": "en",
+    "language_confidence": 0.95,
+    "persona": "general_public",
+    "persona_confidence": 0.8,
+    "use_acknowledgment": False,
+    "acknowledgment": "",
+    "use_retrieval": True,
+    "reason": "Question about SPAA programs.",
+}
+
+
+# =========================
+# Canned output
+# =========================
+_QUESTION_RE = re.compile(r"Question:\s*(.+?)\s*(?:\n|$)", flags=re.IGNORECASE)
+
+
+def last_question(prompt: str) -> str:
+    matches = _QUESTION_RE.findall(prompt or "")
+    return matches[-1].strip() if matches else ""
+
+
+def router_output(prompt: str, schema) -> str:
+    """Canned router JSON containing only the fields the requested schema declares."""
+    decision = dict(ROUTER_DECISION)
+    decision["search_query"] = last_question(prompt)[:120]
+    # Compound questions ("X and Y") get one sub-query per part, like the real router.
+    parts = [part.strip() for part in re.split(r"\s+and\s+", decision["search_query"]) if part.strip()]
+    decision["sub_queries"] = [part[:80] for part in parts[:3]] if len(parts) > 1 else []
+    properties = schema.get("properties", {}) if isinstance(schema, dict) else {}
+    if properties:
+        decision = {key: value for key, value in decision.items() if key in properties}
+    return json.dumps(decision)
+
+
+def fake_embedding(text: str) -> list:
+    """Deterministic unit vector seeded from the text."""
+    values = []
+    counter = 0
+    while len(values) < EMBEDDING_DIM:
+        digest = hashlib.sha256(f"{counter}:{text}".encode("utf-8")).digest()
+        values.extend((byte - 127.5) / 127.5 for byte in digest)
+        counter += 1
+    values = values[:EMBEDDING_DIM]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+_slots = {}
+_slots_lock = threading.Lock()
+
+
+def model_slots(model_name: str) -> threading.Semaphore:
+    with _slots_lock:
+        if model_name not in _slots:
+            _slots[model_name] = threading.Semaphore(NUM_PARALLEL)
+        return _slots[model_name]
+
+
+# =========================
+# HTTP handler
+# =========================
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b"{}"
+        return json.loads(body or b"{}")
+
+    def send_json(self, payload: dict, status: int = 200) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, chunks: list) -> None:
+        data = b"".join(json.dumps(chunk).encode("utf-8") + b"\n" for chunk in chunks)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/api/ps":
+            self.send_json({"models": []})
+        elif self.path == "/api/tags":
+            self.send_json({"models": []})
+        elif self.path == "/api/version":
+            self.send_json({"version": "0.0.0-fake"})
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def do_POST(self) -> None:
+        body = self.read_json()
+        if self.path == "/api/generate":
+            self.generate(body, body.get("prompt", ""), chat=False)
+        elif self.path == "/api/chat":
+            messages = body.get("messages") or []
+            prompt = "\n".join(str(m.get("content", "")) for m in messages)
+            self.generate(body, prompt, chat=True)
+        elif self.path == "/api/embed":
+            inputs = body.get("input", "")
+            inputs = [inputs] if isinstance(inputs, str) else list(inputs)
+            time.sleep(EMBED_LATENCY_MS / 1000)
+            self.send_json({
+                "model": body.get("model", ""),
+                "embeddings": [fake_embedding(text) for text in inputs],
+            })
+        elif self.path == "/api/embeddings":
+            time.sleep(EMBED_LATENCY_MS / 1000)
+            self.send_json({"embedding": fake_embedding(body.get("prompt", ""))})
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def generate(self, body: dict, prompt: str, chat: bool) -> None:
+        model_name = body.get("model", "")
+
+        if not prompt.strip():
+            # Warm-up ping: load only.
+            self.send_json({"model": model_name, "created_at": now_iso(), "response": "", "done": True})
+            return
+
+        schema = body.get("format")
+        if schema:
+            with model_slots(model_name):
+                time.sleep(ROUTER_LATENCY_MS / 1000)
+            text = router_output(prompt, schema)
+            pieces = [text]
+        else:
+            with model_slots(model_name):
+                time.sleep(ANSWER_LATENCY_MS / 1000)
+            text = CANNED_ANSWER
+            size = math.ceil(len(text) / ANSWER_STREAM_CHUNKS)
+            pieces = [text[i:i + size] for i in range(0, len(text), size)]
+
+        def chunk(piece: str, done: bool) -> dict:
+            item = {"model": model_name, "created_at": now_iso(), "done": done}
+            if chat:
+                item["message"] = {"role": "assistant", "content": piece}
+            else:
+                item["response"] = piece
+            return item
+
+        stats = {
+            "done_reason": "stop",
+            "prompt_eval_count": len(prompt.split()),
+            "eval_count": len(text.split()),
+        }
+
+        if body.get("stream", True) is False:
+            self.send_json({**chunk(text, True), **stats})
+            return
+
+        chunks = [chunk(piece, False) for piece in pieces]
+        chunks.append({**chunk("", True), **stats})
+        self.send_stream(chunks)
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    server = ThreadingHTTPServer((HOST, PORT), FakeOllamaHandler)
+    server.daemon_threads = True
+    print(f"Fake Ollama listening on http://{HOST}:{PORT} (embedding dim {EMBEDDING_DIM})")
+    print(f"Latency: router {ROUTER_LATENCY_MS} ms, answer {ANSWER_LATENCY_MS} ms, embed {EMBED_LATENCY_MS} ms")
+    print(f"Parallel generations per model: {NUM_PARALLEL}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Load test for the /chat and /chat_rag endpoints.
+
+Drives the running chatbot server with questions from QA_test.xlsx, one
+scenario at a time, and reports throughput and p50/p95/p99 latency for each.
+A scenario is either:
+- closed loop (rate=None): `concurrency` clients send back-to-back requests,
+- open loop (rate=N):      requests arrive as a Poisson process at N per second
+                           and are served by up to `concurrency` clients.
+                           Latency is measured from the scheduled arrival time,
+                           so time spent queued behind busy clients is counted.
+
+Per-stage means are taken from the server's /metrics (difference before and
+after each scenario), so the report shows where the time went.
+
+To measure the serving layer offline, run it against the fake Ollama server:
+    python test/fake_ollama_server.py
+    OLLAMA_HOST=http://127.0.0.1:11500 python main_two_endpoints.py
+    python test/load_test_chat_endpoints.py
+
+Outputs:
+- load_test_results.xlsx (sheet "summary" per scenario, sheet "requests" per request)
+
+Required packages:
+    pip install pandas openpyxl requests
+"""
+
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import requests
+
+
+# =========================
+# Configuration
+# =========================
+INPUT_FILE = "QA_test.xlsx"
+OUTPUT_EXCEL = "load_test_results.xlsx"
+
+SERVER_URL = "http://127.0.0.1:5000"
+TIMEOUT_SECONDS = 180
+RANDOM_SEED = 42
+
+# Every request uses a new session_id (stateless first turns) unless
+# TURNS_PER_SESSION > 1, in which case consecutive requests of a client share one.
+TURNS_PER_SESSION = 1
+
+SCENARIOS = [
+    {"endpoint": "/chat", "concurrency": 1, "rate": None, "requests": 20},
+    {"endpoint": "/chat", "concurrency": 4, "rate": None, "requests": 40},
+    {"endpoint": "/chat", "concurrency": 8, "rate": None, "requests": 80},
+    {"endpoint": "/chat", "concurrency": 8, "rate": 2.0, "requests": 60},
+    {"endpoint": "/chat_rag", "concurrency": 4, "rate": None, "requests": 40},
+    {"endpoint": "/chat_rag", "concurrency": 8, "rate": 2.0, "requests": 60},
+]
+
+
+# =========================
+# Helpers
+# =========================
+def find_question_column(df: pd.DataFrame) -> str:
+    """Prefer a question-like column; otherwise use the first column."""
+    normalized = {str(col).strip().lower(): col for col in df.columns}
+    for candidate in ("question", "questions", "query", "prompt"):
+        if candidate in normalized:
+            return normalized[candidate]
+    return df.columns[0]
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+_STAGE_LINE_RE = re.compile(
+    r'^spaa_stage_duration_seconds_(sum|count)\{endpoint="([^"]+)",stage="([^"]+)"\}\s+([0-9.eE+-]+)$'
+)
+
+
+def scrape_stages() -> dict:
+    """(endpoint, stage) -> [sum_seconds, count] from the server's /metrics."""
+    try:
+        text = requests.get(f"{SERVER_URL}/metrics", timeout=10).text
+    except requests.RequestException:
+        return {}
+    stages = {}
+    for line in text.splitlines():
+        match = _STAGE_LINE_RE.match(line.strip())
+        if match:
+            kind, endpoint, stage, value = match.groups()
+            entry = stages.setdefault((endpoint, stage), [0.0, 0])
+            entry[0 if kind == "sum" else 1] = float(value)
+    return stages
+
+
+def stage_means(before: dict, after: dict, endpoint: str) -> dict:
+    means = {}
+    for (ep, stage), (total, count) in after.items():
+        if ep != endpoint:
+            continue
+        prev_total, prev_count = before.get((ep, stage), [0.0, 0])
+        if count > prev_count:
+            means[stage] = round(1000 * (total - prev_total) / (count - prev_count), 1)
+    return means
+
+
+class Client:
+    """One simulated user: its own HTTP session and session_id rotation."""
+
+    def __init__(self):
+        self.http = requests.Session()
+        self.session_id = ""
+        self.turns = 0
+
+    def next_session_id(self) -> str:
+        if not self.session_id or self.turns >= TURNS_PER_SESSION:
+            self.session_id = f"load-{uuid.uuid4()}"
+            self.turns = 0
+        self.turns += 1
+        return self.session_id
+
+
+_client_local = threading.local()
+
+
+def current_client() -> Client:
+    if not hasattr(_client_local, "client"):
+        _client_local.client = Client()
+    return _client_local.client
+
+
+def send(endpoint: str, question: str, arrival: float) -> dict:
+    client = current_client()
+    started = time.perf_counter()
+    status, error = 0, ""
+    try:
+        response = client.http.post(
+            f"{SERVER_URL}{endpoint}",
+            json={"question": question, "session_id": client.next_session_id()},
+            timeout=TIMEOUT_SECONDS,
+        )
+        status = response.status_code
+        if status != 200:
+            error = response.text[:200]
+    except requests.RequestException as e:
+        error = repr(e)
+    finished = time.perf_counter()
+    return {
+        "question": question,
+        "status": status,
+        "error": error,
+        "queue_ms": round(1000 * (started - arrival), 1),
+        "service_ms": round(1000 * (finished - started), 1),
+        "latency_ms": round(1000 * (finished - arrival), 1),
+        "finished": finished,
+    }
+
+
+# =========================
+# Scenarios
+# =========================
+def run_scenario(scenario: dict, questions: list, rng: random.Random) -> tuple[dict, list]:
+    endpoint = scenario["endpoint"]
+    concurrency = scenario["concurrency"]
+    rate = scenario["rate"]
+    total = scenario["requests"]
+    picks = [rng.choice(questions) for _ in range(total)]
+
+    before = scrape_stages()
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="load") as pool:
+        if rate:
+            # Open loop: submit at Poisson arrival times regardless of completions.
+            futures = []
+            arrival = started
+            for question in picks:
+                arrival += rng.expovariate(rate)
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(send, endpoint, question, arrival))
+            rows = [f.result() for f in futures]
+        else:
+            # Closed loop: each request is submitted as soon as a client is free.
+            rows = list(pool.map(lambda q: send(endpoint, q, time.perf_counter()), picks))
+
+    elapsed = time.perf_counter() - started
+    after = scrape_stages()
+
+    ok = [row["latency_ms"] for row in rows if row["status"] == 200]
+    label = f"{endpoint} c={concurrency} " + (f"rate={rate}/s" if rate else "closed")
+    summary = {
+        "scenario": label,
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "arrival_rate": rate or "",
+        "requests": total,
+        "errors": total - len(ok),
+        "wall_seconds": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "mean_ms": round(sum(ok) / len(ok), 1) if ok else float("nan"),
+        "p50_ms": round(percentile(ok, 50), 1),
+        "p95_ms": round(percentile(ok, 95), 1),
+        "p99_ms": round(percentile(ok, 99), 1),
+        "max_ms": max(ok) if ok else float("nan"),
+    }
+    for stage, mean_ms in stage_means(before, after, endpoint.strip("/")).items():
+        summary[f"stage_{stage}_ms"] = mean_ms
+
+    for row in rows:
+        row["scenario"] = label
+        row.pop("finished")
+    return summary, rows
+
+
+# =========================
+# Main workflow
+# =========================
+def main() -> None:
+    script_dir = Path(__file__).resolve().parent
+    input_path = script_dir / INPUT_FILE
+    output_path = script_dir / OUTPUT_EXCEL
+
+    if not input_path.exists():
+        raise FileNotFoundError(f"Cannot find {input_path}.")
+
+    df = pd.read_excel(input_path)
+    question_col = find_question_column(df)
+    questions = [str(q).strip() for q in df[question_col] if not pd.isna(q) and str(q).strip()]
+    if not questions:
+        raise ValueError(f"{input_path.name} has no questions.")
+
+    rng = random.Random(RANDOM_SEED)
+    summaries, all_rows = [], []
+
+    for scenario in SCENARIOS:
+        print(f"Running {scenario} ...")
+        summary, rows = run_scenario(scenario, questions, rng)
+        summaries.append(summary)
+        all_rows.extend(rows)
+        print(
+            f"  {summary['throughput_rps']} req/s | p50 {summary['p50_ms']} ms | "
+            f"p95 {summary['p95_ms']} ms | p99 {summary['p99_ms']} ms | errors {summary['errors']}"
+        )
+
+    with pd.ExcelWriter(output_path) as writer:
+        pd.DataFrame(summaries).to_excel(writer, sheet_name="summary", index=False)
+        pd.DataFrame(all_rows).to_excel(writer, sheet_name="requests", index=False)
+
+    print("\n===== Load test summary =====")
+    print(f"{'scenario':<32} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for s in summaries:
+        print(
+            f"{s['scenario']:<32} {s['throughput_rps']:>8} {s['p50_ms']:>9} "
+            f"{s['p95_ms']:>9} {s['p99_ms']:>9} {s['errors']:>7}"
+        )
+    print(f"\nDetails saved to: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
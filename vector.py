@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import hashlib
 from typing import List, Dict, Any, Tuple
@@ -26,6 +27,34 @@ SAFE_TEXT_CAP = 2000
 # If True: wipe DB and rebuild from scratch every time
 REBUILD_FROM_SCRATCH = True
 
+# Near-duplicate suppression (MinHash + LSH over word shingles).
+# Boilerplate blocks repeated across pages collapse into one canonical chunk;
+# the other URLs are kept in the "source_urls" metadata field.
+# Note: with REBUILD_FROM_SCRATCH = False, chunks that already exist keep their
+# old metadata, so rebuild once after changing these settings.
+DEDUP_NEAR_DUPLICATES = True
+DEDUP_SHINGLE_SIZE = 5          # words per shingle
+DEDUP_NUM_PERM = 64             # MinHash signature length
+DEDUP_BANDS = 16                # LSH bands (rows per band = NUM_PERM / BANDS)
+DEDUP_JACCARD_THRESHOLD = 0.85  # estimated similarity needed to collapse
+
+# HNSW index of the Chroma collection (applied when the collection is created,
+# so REBUILD_FROM_SCRATCH must be True for changes to M / ef_construction / space).
+# Larger M and ef_construction give a better graph (higher recall) at the cost of
+# build time and memory. ef_search can be changed without a rebuild: set
+# UPDATE_EF_SEARCH_ONLY = True and run this script once (restart the server
+# afterwards; Chroma reads ef_search when it loads the index). Chroma's defaults
+# are M=16, ef_construction=100, ef_search=100. Use test/benchmark_ann_recall.py
+# to compare settings against exact search.
+HNSW_SPACE = "l2"               # "l2", "cosine" or "ip"
+HNSW_M = 16                     # graph neighbors per node (Chroma: max_neighbors)
+HNSW_EF_CONSTRUCTION = 100      # candidate list size while building
+HNSW_EF_SEARCH = 100            # candidate list size while querying
+
+# If True: only write HNSW_EF_SEARCH into the existing collection, then exit
+# (no re-embedding; REBUILD_FROM_SCRATCH is ignored).
+UPDATE_EF_SEARCH_ONLY = False
+
 
 
 # ------------------------
@@ -34,6 +63,95 @@ REBUILD_FROM_SCRATCH = True
 def stable_hash(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
 
+# Fixed (a, b) pairs so signatures are reproducible across runs.
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_PARAMS = [
+    (
+        int(stable_hash(f"minhash-a-{i}")[:15], 16) % (_MINHASH_PRIME - 1) + 1,
+        int(stable_hash(f"minhash-b-{i}")[:15], 16) % _MINHASH_PRIME,
+    )
+    for i in range(DEDUP_NUM_PERM)
+]
+
+def chunk_shingles(text: str, size: int = DEDUP_SHINGLE_SIZE) -> set:
+    words = re.sub(r"[^a-z0-9\s]", " ", (text or "").lower()).split()
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def minhash_signature(shingles: set) -> Tuple[int, ...]:
+    if not shingles:
+        return tuple([_MINHASH_PRIME] * DEDUP_NUM_PERM)
+    base = [
+        int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+        for s in shingles
+    ]
+    return tuple(
+        min((a * h + b) % _MINHASH_PRIME for h in base)
+        for a, b in _MINHASH_PARAMS
+    )
+
+def estimated_jaccard(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    same = sum(1 for x, y in zip(sig_a, sig_b) if x == y)
+    return same / len(sig_a)
+
+def dedup_near_duplicate_chunks(
+        documents: List[Document],
+        ids: List[str]
+    ) -> Tuple[List[Document], List[str]]:
+    """
+    Collapses near-duplicate chunks to the first one seen (the canonical chunk).
+    Candidates come from LSH buckets over MinHash signatures and are confirmed with
+    the estimated Jaccard similarity, so only a handful of pairs are compared.
+    The canonical chunk's metadata lists every source URL it stands for.
+    """
+    rows = DEDUP_NUM_PERM // DEDUP_BANDS
+    buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+    kept: List[int] = []
+    signatures: Dict[int, Tuple[int, ...]] = {}
+    merged_urls: Dict[int, List[str]] = {}
+
+    for idx, doc in enumerate(documents):
+        sig = minhash_signature(chunk_shingles(doc.page_content))
+        band_keys = [(b, sig[b * rows:(b + 1) * rows]) for b in range(DEDUP_BANDS)]
+
+        canonical = None
+        seen = set()
+        for key in band_keys:
+            for cand in buckets.get(key, []):
+                if cand in seen:
+                    continue
+                seen.add(cand)
+                if estimated_jaccard(sig, signatures[cand]) >= DEDUP_JACCARD_THRESHOLD:
+                    canonical = cand
+                    break
+            if canonical is not None:
+                break
+
+        url = doc.metadata.get("source_url", "")
+        if canonical is not None:
+            if url and url not in merged_urls[canonical]:
+                merged_urls[canonical].append(url)
+            continue
+
+        signatures[idx] = sig
+        merged_urls[idx] = [url] if url else []
+        kept.append(idx)
+        for key in band_keys:
+            buckets.setdefault(key, []).append(idx)
+
+    out_docs: List[Document] = []
+    out_ids: List[str] = []
+    for idx in kept:
+        doc = documents[idx]
+        # Chroma metadata values must be scalars, so the URL list is stored as text.
+        doc.metadata["source_urls"] = " | ".join(merged_urls[idx])
+        doc.metadata["source_url_count"] = len(merged_urls[idx])
+        out_docs.append(doc)
+        out_ids.append(ids[idx])
+
+    return out_docs, out_ids
+
 def list_json_files(data_dir: str) -> List[str]:
     if not os.path.isdir(data_dir):
         raise FileNotFoundError(f"DATA_DIR not found: {data_dir}")
@@ -142,6 +260,11 @@ def build_documents_from_records(
             documents.append(Document(page_content=safe_text, metadata=metadata))
             ids.append(doc_id)
 
+    if DEDUP_NEAR_DUPLICATES and documents:
+        before = len(documents)
+        documents, ids = dedup_near_duplicate_chunks(documents, ids)
+        print(f"  Near-duplicate chunks collapsed: {before - len(documents)}")
+
     return documents, ids
 
 
@@ -163,6 +286,14 @@ def create_or_update_database():
         persist_directory=DB_PATH,
         embedding_function=embeddings,
         collection_name="rutgers_corpus",
+        collection_configuration={
+            "hnsw": {
+                "space": HNSW_SPACE,
+                "max_neighbors": HNSW_M,
+                "ef_construction": HNSW_EF_CONSTRUCTION,
+                "ef_search": HNSW_EF_SEARCH,
+            }
+        },
     )
 
     splitter = RecursiveCharacterTextSplitter(
@@ -220,5 +351,17 @@ def create_or_update_database():
     print(f"Total new chunks added this run: {total_added}")
 
 
+def update_ef_search():
+    import chromadb
+
+    client = chromadb.PersistentClient(path=DB_PATH)
+    collection = client.get_collection("rutgers_corpus", embedding_function=None)
+    collection.modify(configuration={"hnsw": {"ef_search": HNSW_EF_SEARCH}})
+    print(f"HNSW config of rutgers_corpus: {dict(collection.configuration.get('hnsw') or {})}")
+
+
 if __name__ == "__main__":
-    create_or_update_database()
+    if UPDATE_EF_SEARCH_ONLY:
+        update_ef_search()
+    else:
+        create_or_update_database()